@@ -40,6 +40,7 @@ from Products.PageTemplates.ZopePageTemplate import ZopePageTemplate
 from Products.PythonScripts.PythonScript import PythonScript
 from zope.interface import implementer
 
+from .counters import incrementCounter
 from .interfaces import SKIPPED_FILES
 from .interfaces import SKIPPED_SUFFIXES
 from .interfaces import IChunkableExportContext
@@ -202,6 +203,7 @@ class DirectoryImportContext(BaseContext):
         if not os.path.exists(full_path):
             return None
 
+        incrementCounter('files_read')
         return open(full_path, 'rb')
 
     @security.protected(ManagePortal)
@@ -213,6 +215,7 @@ class DirectoryImportContext(BaseContext):
         if file is not None:
             result = file.read()
             file.close()
+            incrementCounter('bytes_read', len(result))
         return result
 
     @security.protected(ManagePortal)
@@ -327,7 +330,10 @@ class TarballImportContext(BaseContext):
         except KeyError:
             return None
 
-        return file.read()
+        data = file.read()
+        incrementCounter('files_read')
+        incrementCounter('bytes_read', len(data))
+        return data
 
     def getLastModified(self, path):
         """ See IImportContext.
@@ -603,6 +609,8 @@ class SnapshotImportContext(BaseContext):
             data = object.read()
         if isinstance(data, str):
             data = data.encode('utf-8')
+        incrementCounter('files_read')
+        incrementCounter('bytes_read', len(data))
         return data
 
     @security.protected(ManagePortal)
@@ -0,0 +1,85 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Cumulative counters of GenericSetup activity in this process.
+
+The counters are kept in memory, shared by all setup tools, and are
+cheap enough to be always on.  'SetupTool.getStatistics' reports them.
+"""
+
+import contextlib
+import threading
+import time
+
+
+_lock = threading.Lock()
+_counters = {}
+# (kind, step id) -> [runs, seconds]
+_steps = {}
+_since = time.time()
+# Per thread: whether counting is suspended.
+_local = threading.local()
+
+
+def incrementCounter(name, amount=1):
+    if getattr(_local, 'suspended', False):
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+@contextlib.contextmanager
+def suspendCounters():
+    """ Do not count anything this thread does inside.
+
+    o For reading profiles without importing them, e.g. in a dry run.
+    """
+    suspended = getattr(_local, 'suspended', False)
+    _local.suspended = True
+    try:
+        yield
+    finally:
+        _local.suspended = suspended
+
+
+def recordStep(kind, step_id, seconds):
+    """ Count a run of an 'import' or 'export' step.
+    """
+    with _lock:
+        info = _steps.setdefault((kind, step_id), [0, 0.0])
+        info[0] += 1
+        info[1] += seconds
+
+
+def getCounters():
+    """ Return a copy of the counters.
+
+    o A mapping with 'since' (the time of process start or of the last
+      reset), the counters by name, and 'steps', a mapping from step kind
+      to mappings from step id to 'runs' and 'seconds'.
+    """
+    with _lock:
+        result = dict(_counters)
+        result['since'] = _since
+        result['steps'] = {'import': {}, 'export': {}}
+        for (kind, step_id), (runs, seconds) in _steps.items():
+            result['steps'][kind][step_id] = {'runs': runs,
+                                              'seconds': seconds}
+    return result
+
+
+def resetCounters():
+    global _since
+    with _lock:
+        _counters.clear()
+        _steps.clear()
+        _since = time.time()
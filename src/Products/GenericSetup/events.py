@@ -17,6 +17,10 @@ from zope.component import adapter
 from zope.interface import implementer
 
 from Products.GenericSetup.interfaces import IBeforeProfileImportEvent
+from Products.GenericSetup.interfaces import IExportStepFinishedEvent
+from Products.GenericSetup.interfaces import IExportStepStartedEvent
+from Products.GenericSetup.interfaces import IImportStepFinishedEvent
+from Products.GenericSetup.interfaces import IImportStepStartedEvent
 from Products.GenericSetup.interfaces import IProfileImportedEvent
 
 
@@ -39,6 +43,44 @@ class ProfileImportedEvent(BaseProfileImportEvent):
     pass
 
 
+class BaseStepStartedEvent:
+
+    def __init__(self, tool, step_id, context):
+        self.tool = tool
+        self.step_id = step_id
+        self.context = context
+
+
+class BaseStepFinishedEvent(BaseStepStartedEvent):
+
+    def __init__(self, tool, step_id, context, seconds, exception=None,
+                 message=None):
+        super().__init__(tool, step_id, context)
+        self.seconds = seconds
+        self.exception = exception
+        self.message = message
+
+
+@implementer(IImportStepStartedEvent)
+class ImportStepStartedEvent(BaseStepStartedEvent):
+    pass
+
+
+@implementer(IImportStepFinishedEvent)
+class ImportStepFinishedEvent(BaseStepFinishedEvent):
+    pass
+
+
+@implementer(IExportStepStartedEvent)
+class ExportStepStartedEvent(BaseStepStartedEvent):
+    pass
+
+
+@implementer(IExportStepFinishedEvent)
+class ExportStepFinishedEvent(BaseStepFinishedEvent):
+    pass
+
+
 @adapter(IProfileImportedEvent)
 def handleProfileImportedEvent(event):
     """Update 'last version for profile' after a full import.
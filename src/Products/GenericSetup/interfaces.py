@@ -395,6 +395,8 @@ class IProfileRegistry(Interface):
 
           'type' -- either BASE or EXTENSION
 
+        o The mapping is read-only.
+
         o 'for_', if passed, should be the interface specifying the "site
             type" for which the profile is relevant, e.g.
             Products.CMFCore.interfaces.ISiteRoot or
@@ -511,17 +513,44 @@ class ISetupTool(Interface):
         o If 'run_dependencies' is True, then run any out-of-date
           dependency steps first.
 
+        o If the tool is stored in a ZODB, count the persistent objects
+          each step loads and modifies, as with
+          'runAllImportStepsFromProfile'.
+
         o Return a mapping, with keys:
 
           'steps' -- a sequence of IDs of the steps run.
 
           'messages' -- a dictionary holding messages returned from each
             step
+
+          'objects' -- only if the tool is stored in a ZODB: the counted
+            persistent objects, as with 'runAllImportStepsFromProfile'.
+        """
+
+    def runImportStepsFromProfile(profile_id, step_ids,
+                                  run_dependencies=True, purge_old=None):
+        """ Execute the given setup steps from the given profile.
+
+        o Like 'runImportStepFromProfile', but for a sequence of step IDs.
+          The profile is applied once, each step (or dependency, direct
+          or indirect) runs at most once, in dependency order, and one
+          pair of import events is fired.
+
+        o If the tool is stored in a ZODB, count the persistent objects
+          each step loads and modifies, as with
+          'runAllImportStepsFromProfile'.
+
+        o Return a mapping like 'runImportStepFromProfile', with the
+          'objects' counted, if any.
         """
 
     def runAllImportStepsFromProfile(profile_id, purge_old=None,
                                      ignore_dependencies=False,
-                                     blacklisted_steps=None):
+                                     blacklisted_steps=None,
+                                     release_memory=False,
+                                     cprofile=False,
+                                     trace_memory=False):
         """ Run all setup steps for the given profile in dependency order.
 
         o 'profile_id' must be a valid ID of a registered profile;
@@ -537,6 +566,22 @@ class ISetupTool(Interface):
         o 'blacklisted_steps' can be a list of step-names that won't be
           executed. Use with special care and only for special cases.
 
+        o If 'release_memory' is True, take an optimistic savepoint and
+          garbage collect the ZODB connection cache after each step and
+          each profile, to keep memory bounded on large sites.
+
+        o If 'cprofile' is True, run each step handler with cProfile.  The
+          functions with the highest cumulative time are added to the
+          messages, and the statistics of each step are stored as a
+          '.pstats' file next to the log of the import.
+
+        o If 'trace_memory' is True, trace the memory allocated by each
+          step handler with tracemalloc.  The net growth, the peak and the
+          allocation sites with most growth are added to the messages.
+
+        o If the tool is stored in a ZODB, count the persistent objects
+          each step loads from it, and stores or registers as modified.
+          The counts are added to the messages.
 
         o Return a mapping, with keys:
 
@@ -544,6 +589,67 @@ class ISetupTool(Interface):
 
           'messages' -- a dictionary holding messages returned from each
             step
+
+          'peak_memory_growth' -- only with 'release_memory': a
+            dictionary holding how much each step raised the peak memory
+            of the process, in KiB
+
+          'pstats' -- only with 'cprofile': a dictionary holding the
+            marshalled cProfile statistics of each step, as read by
+            'pstats.Stats'
+
+          'memory' -- only with 'trace_memory': a dictionary holding a
+            mapping for each step, with the net 'growth' and the 'peak' of
+            the traced memory in bytes, and the allocation 'sites' with
+            most growth.  The 'peak' is None when steps traced in other
+            threads ran at the same time.
+
+          'objects' -- only if the tool is stored in a ZODB: a dictionary
+            holding a mapping for each step, with the numbers of
+            persistent objects 'loaded' and 'modified'
+        """
+
+    def runAllImportStepsFromProfiles(profile_ids, purge_old=None,
+                                      ignore_dependencies=False,
+                                      blacklisted_steps=None,
+                                      dependency_strategy=None,
+                                      release_memory=False,
+                                      trace_memory=False):
+        """ Run all setup steps for the given profiles.
+
+        o Like 'runAllImportStepsFromProfile', but the dependency chains of
+          all profiles are merged, so that each profile is applied (or
+          upgraded, or skipped) at most once.  Each profile comes after
+          its dependencies.
+
+        o Return one combined mapping like 'runAllImportStepsFromProfile'.
+        """
+
+    def planImport(profile_id, ignore_dependencies=False,
+                   blacklisted_steps=None, dependency_strategy=None,
+                   purge_old=None):
+        """ Report what 'runAllImportStepsFromProfile' would do.
+
+        o Nothing is imported and the tool is not changed.
+
+        o When a base profile would purge the profile versions, the
+          dependencies after it in the chain are planned as new.
+
+        o Return a mapping, with keys:
+
+          'profile_id' -- the main profile.
+
+          'dependency_strategy' -- the strategy used for dependencies.
+
+          'profiles' -- a sequence of mappings for the dependency chain,
+            main profile last, with keys 'profile_id', 'action' (one of
+            'apply', 'reapply', 'upgrade' or 'skip'), 'steps' (mappings
+            with the 'id' of each import step and the 'seconds' recorded
+            for it by earlier imports of the profile, or None), 'files' (the
+            files in the profile), 'upgrades' (titles of the upgrade steps
+            to run) and 'seconds' (the estimated duration).
+
+          'seconds' -- the estimated duration of the whole import.
         """
 
     def runExportStep(step_id):
@@ -561,9 +667,15 @@ class ISetupTool(Interface):
           'tarball' -- the stringified tar-gz data.
         """
 
-    def runAllExportSteps():
+    def runAllExportSteps(cprofile=False, trace_memory=False):
         """ Generate a tarball containing artifacts from all export steps.
 
+        o If 'cprofile' is True, run each step handler with cProfile, as
+          with 'runAllImportStepsFromProfile'.
+
+        o If 'trace_memory' is True, trace the memory allocated by each
+          step handler, as with 'runAllImportStepsFromProfile'.
+
         o Return a mapping, with keys:
 
           'steps' -- a sequence of IDs of the steps run.
@@ -572,6 +684,12 @@ class ISetupTool(Interface):
             step
 
           'tarball' -- the stringified tar-gz data.
+
+          'pstats' -- only with 'cprofile', see
+            'runAllImportStepsFromProfile'.
+
+          'memory' -- only with 'trace_memory', see
+            'runAllImportStepsFromProfile'.
         """
 
     def createSnapshot(snapshot_id):
@@ -816,6 +934,58 @@ class IProfileImportedEvent(Interface):
     tool = Attribute("The tool which is performing the import")
 
 
+class IImportStepStartedEvent(Interface):
+    """ An event which is fired before an import step is run.
+    """
+    step_id = Attribute("id of the import step")
+
+    context = Attribute("The import context passed to the step")
+
+    tool = Attribute("The tool which is performing the import")
+
+
+class IImportStepFinishedEvent(Interface):
+    """ An event which is fired after an import step has run.
+    """
+    step_id = Attribute("id of the import step")
+
+    context = Attribute("The import context passed to the step")
+
+    tool = Attribute("The tool which is performing the import")
+
+    seconds = Attribute("time the step took, in seconds")
+
+    exception = Attribute("exception raised by the step, or None")
+
+    message = Attribute("message returned by the step, or None")
+
+
+class IExportStepStartedEvent(Interface):
+    """ An event which is fired before an export step is run.
+    """
+    step_id = Attribute("id of the export step")
+
+    context = Attribute("The export context passed to the step")
+
+    tool = Attribute("The tool which is performing the export")
+
+
+class IExportStepFinishedEvent(Interface):
+    """ An event which is fired after an export step has run.
+    """
+    step_id = Attribute("id of the export step")
+
+    context = Attribute("The export context passed to the step")
+
+    tool = Attribute("The tool which is performing the export")
+
+    seconds = Attribute("time the step took, in seconds")
+
+    exception = Attribute("exception raised by the step, or None")
+
+    message = Attribute("message returned by the step, or None")
+
+
 class IComponentsHandlerBlacklist(Interface):
     """ Interface for named utilities which can exclude specified interfaces
     from being handled by the components export and import handlers.
@@ -0,0 +1,226 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Background import and upgrade jobs of the setup tool.
+
+Jobs queued with 'queueImport' or 'queueUpgrade' on the setup tool are
+started in a worker thread once the queuing transaction is committed.
+The worker does the work in its own ZODB connection and commits it at
+the end.  Progress is written to the job record on the tool through a
+second connection with its own transaction manager, so that it can be
+polled while the work itself is not committed yet.
+
+The host and process id of the worker are stored with each job.  A job
+that is still queued or running when its process is gone is reported as
+failed.  This can only be told for processes on the same host.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from io import BytesIO
+
+import transaction
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import noSecurityManager
+from AccessControl.SpecialUsers import system
+from Acquisition import aq_parent
+from ZODB.POSException import ConflictError
+from zope.component.hooks import setSite
+from zope.component.interfaces import ISite
+from zope.globalrequest import clearRequest
+from zope.globalrequest import setRequest
+from zope.publisher.browser import setDefaultSkin
+from ZPublisher.BaseRequest import RequestContainer
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+
+from .utils import _setRunState
+
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+
+# Status of a step that is followed by another one, or by the end of its
+# job.
+STEP_DONE = 'done'
+
+# Saving progress is retried this often on conflicts.
+_COMMIT_ATTEMPTS = 3
+
+logger = logging.getLogger('GenericSetup')
+
+
+def getWorker():
+    """ Return the host and process id of the worker of a job queued here.
+    """
+    return {'host': socket.gethostname(), 'pid': os.getpid()}
+
+
+def isJobLost(job):
+    """ Tell whether a queued or running job has lost its worker process.
+
+    o Only workers on this host can be checked.
+    """
+    if job['status'] not in (JOB_QUEUED, JOB_RUNNING):
+        return False
+    worker = job.get('worker')
+    if not worker or worker['host'] != socket.gethostname():
+        return False
+    if worker['pid'] == os.getpid():
+        # A queued job has no thread until its transaction is committed.
+        return (job['status'] == JOB_RUNNING and
+                _getJobThread(job['id']) is None)
+    try:
+        os.kill(worker['pid'], 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        # E.g. no permission to signal it: the process exists.
+        return False
+    return False
+
+
+def _getJobThread(job_id):
+    name = 'GenericSetup job %s' % job_id
+    for thread in threading.enumerate():
+        if thread.name == name:
+            return thread
+    return None
+
+
+def startJob(status, db, tool_path, job_id):
+    """ Start a worker thread for a job.
+
+    o Registered as after commit hook of the transaction queuing the job,
+      so the thread is only started if the job record was committed.
+    """
+    if not status:
+        return None
+    thread = threading.Thread(target=runJob,
+                              args=(db, tool_path, job_id),
+                              name='GenericSetup job %s' % job_id,
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def runJob(db, tool_path, job_id):
+    """ Run a queued job of the tool at 'tool_path' in this thread.
+    """
+    reporter = JobReporter(db, tool_path, job_id)
+    connection = db.open()
+    tool = None
+    try:
+        reporter.start()
+        app = _makeRequest(connection.root()['Application'])
+        tool = app.unrestrictedTraverse(tool_path)
+        site = aq_parent(tool)
+        if ISite.providedBy(site):
+            setSite(site)
+        newSecurityManager(None, system)
+        _setRunState(tool, 'job_reporter', reporter)
+        transaction.get().note('GenericSetup job %s' % job_id)
+        messages = tool._executeJob(job_id)
+        transaction.commit()
+    except Exception:
+        transaction.abort()
+        logger.exception('GenericSetup job %s failed.', job_id)
+        reporter.finish(JOB_FAILED, error=traceback.format_exc())
+    else:
+        reporter.finish(JOB_FINISHED, messages=messages)
+    finally:
+        if tool is not None:
+            _setRunState(tool, 'job_reporter', None)
+        noSecurityManager()
+        setSite(None)
+        clearRequest()
+        connection.close()
+        reporter.close()
+
+
+def _makeRequest(app):
+    """ Wrap 'app' in a request, as the publisher does for web requests.
+    """
+    response = HTTPResponse(stdout=BytesIO())
+    environ = {'SERVER_NAME': socket.gethostname(),
+               'SERVER_PORT': '80',
+               'REQUEST_METHOD': 'GET'}
+    request = HTTPRequest(BytesIO(), environ, response)
+    setDefaultSkin(request)
+    setRequest(request)
+    return app.__of__(RequestContainer(REQUEST=request))
+
+
+class JobReporter:
+
+    """ Write the progress of a job to its record on the tool.
+    """
+
+    def __init__(self, db, tool_path, job_id):
+        self.job_id = job_id
+        self._tm = transaction.TransactionManager()
+        self._connection = db.open(transaction_manager=self._tm)
+        app = self._connection.root()['Application']
+        self._job = app.unrestrictedTraverse(tool_path)._jobs[job_id]
+
+    def start(self):
+        self._change(status=JOB_RUNNING, started=time.time())
+
+    def step(self, step_id, title=None):
+        """ Record that 'step_id' started, and the previous step is done.
+        """
+        now = time.time()
+        self._change(steps=self._endStep(STEP_DONE, now) + [{
+            'id': step_id,
+            'title': title or step_id,
+            'status': JOB_RUNNING,
+            'started': now,
+            'seconds': None,
+        }])
+
+    def finish(self, status, messages=None, error=None):
+        step_status = status == JOB_FINISHED and STEP_DONE or JOB_FAILED
+        now = time.time()
+        self._change(status=status,
+                     finished=now,
+                     steps=self._endStep(step_status, now),
+                     messages=dict(messages or {}),
+                     error=error)
+
+    def close(self):
+        self._tm.abort()
+        self._connection.close()
+
+    def _endStep(self, status, now):
+        steps = [dict(info) for info in self._job['steps']]
+        if steps and steps[-1]['status'] == JOB_RUNNING:
+            steps[-1]['status'] = status
+            steps[-1]['seconds'] = now - steps[-1]['started']
+        return steps
+
+    def _change(self, **changes):
+        for attempt in range(_COMMIT_ATTEMPTS):
+            self._job.update(changes)
+            try:
+                self._tm.commit()
+            except ConflictError:
+                self._tm.abort()
+            else:
+                return
+        logger.warning('Could not save the progress of GenericSetup job %s.',
+                       self.job_id)
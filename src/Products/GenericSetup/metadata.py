@@ -13,7 +13,13 @@
 """ GenericSetup profile metadata
 """
 
+import argparse
+import json
+import logging
 import os
+import sys
+import tempfile
+import threading
 from xml.parsers.expat import ExpatError
 
 from .utils import CONVERTER
@@ -25,6 +31,19 @@ from .utils import _getProductPath
 
 METADATA_XML = 'metadata.xml'
 
+# Name of the environment variable pointing to the on-disk metadata cache.
+METADATA_CACHE_ENV = 'GENERICSETUP_METADATA_CACHE'
+_METADATA_CACHE_FORMAT = 1
+
+# (absolute path of a metadata.xml, encoding)
+#   -> ((mtime, size), parsed metadata)
+_metadata_cache = {}
+_disk_cache_loaded = False
+# Guards loading the disk cache, so that no thread sees it half filled.
+_disk_cache_lock = threading.Lock()
+
+logger = logging.getLogger('Products.GenericSetup')
+
 
 class ProfileMetadata(ImportConfiguratorBase):
 
@@ -36,30 +55,38 @@ class ProfileMetadata(ImportConfiguratorBase):
         # don't call the base class __init__ b/c we don't have (or need)
         # a site
 
-        self._path = path
-        if product is not None:
-            # Handle relative paths
-            try:
-                product_path = _getProductPath(product)
-            except ValueError:
-                pass
-            else:
-                self._path = os.path.join(product_path, path)
-
+        self._path = _resolveProfilePath(path, product)
         self._encoding = encoding
 
     def __call__(self):
 
+        if not _disk_cache_loaded:
+            _loadDiskCache()
+
         full_path = os.path.join(self._path, METADATA_XML)
-        if not os.path.exists(full_path):
+        # With an encoding, parsed values are encoded bytes.
+        cache_key = (os.path.abspath(full_path), self._encoding)
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            _metadata_cache.pop(cache_key, None)
             return {}
 
+        # Only parse the file again when it has changed.
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = _metadata_cache.get(cache_key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1].copy()
+
         with open(full_path) as fp:
             try:
-                return self.parseXML(fp.read())
+                metadata = self.parseXML(fp.read())
             except ExpatError as e:
                 raise ExpatError(f'{full_path}: {e}')
 
+        _metadata_cache[cache_key] = (stamp, metadata)
+        return metadata.copy()
+
     def _getImportMapping(self):
 
         return {
@@ -71,3 +98,122 @@ class ProfileMetadata(ImportConfiguratorBase):
             'version': {'#text': {KEY: None}},
             'dependencies': {'dependency': {KEY: None, DEFAULT: ()}},
             'dependency': {'#text': {KEY: None}}}
+
+
+def _resolveProfilePath(path, product=None):
+    # Directory of a profile registered with 'path' relative to 'product'.
+    if product is not None:
+        # Handle relative paths
+        try:
+            product_path = _getProductPath(product)
+        except ValueError:
+            pass
+        else:
+            return os.path.join(product_path, path)
+    return path
+
+
+def _loadDiskCache():
+    global _disk_cache_loaded
+    with _disk_cache_lock:
+        if _disk_cache_loaded:
+            return
+        try:
+            path = os.environ.get(METADATA_CACHE_ENV)
+            if path:
+                loadMetadataCache(path)
+        finally:
+            _disk_cache_loaded = True
+
+
+def loadMetadataCache(path):
+    """ Fill the metadata cache from the JSON file at 'path'.
+
+    o Entries are keyed by the path, modification time and size of each
+      metadata.xml, so outdated entries are simply parsed again.
+
+    o Return the number of entries read.  An unreadable file is logged
+      and ignored.
+    """
+    try:
+        with open(path) as fp:
+            data = json.load(fp)
+    except (OSError, ValueError) as e:
+        logger.warning('Cannot read profile metadata cache %s: %s', path, e)
+        return 0
+
+    if data.get('format') != _METADATA_CACHE_FORMAT:
+        logger.warning('Ignoring profile metadata cache %s with unknown '
+                       'format.', path)
+        return 0
+
+    for full_path, (mtime, size, metadata) in data['entries'].items():
+        metadata = {k: tuple(v) if isinstance(v, list) else v
+                    for k, v in metadata.items()}
+        # Files parsed in this process win over the disk cache.
+        _metadata_cache.setdefault((full_path, None),
+                                   ((mtime, size), metadata))
+
+    return len(data['entries'])
+
+
+def writeMetadataCache(path, directories):
+    """ Parse all metadata.xml files below 'directories' and write them to
+    the JSON file at 'path'.
+
+    o Files which are no profile metadata are skipped.
+
+    o Return the number of entries written.
+    """
+    entries = {}
+    for directory in directories:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [d for d in dirnames
+                           if not d.startswith('.') and d != '__pycache__']
+            if METADATA_XML not in filenames:
+                continue
+            try:
+                ProfileMetadata(dirpath)()
+            except Exception as e:
+                logger.debug('Skipping %s: %s', dirpath, e)
+                continue
+            full_path = os.path.abspath(os.path.join(dirpath, METADATA_XML))
+            (mtime, size), metadata = _metadata_cache[(full_path, None)]
+            entries[full_path] = (mtime, size, metadata)
+
+    data = {'format': _METADATA_CACHE_FORMAT, 'entries': entries}
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(data, fp)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return len(entries)
+
+
+def prewarmMetadataCache(argv=None):
+    """ Write the on-disk profile metadata cache.
+
+    o Run as 'python -m Products.GenericSetup.metadatacache'.
+    """
+    parser = argparse.ArgumentParser(
+        description='Write the GenericSetup profile metadata cache.')
+    parser.add_argument(
+        '--cache', default=os.environ.get(METADATA_CACHE_ENV),
+        help='Path of the cache file, defaults to $%s.' % METADATA_CACHE_ENV)
+    parser.add_argument(
+        'directories', nargs='*',
+        help='Directories to search for profiles, defaults to sys.path.')
+    args = parser.parse_args(argv)
+
+    if not args.cache:
+        parser.error('No cache file given.')
+    directories = args.directories or [p for p in sys.path
+                                       if os.path.isdir(p)]
+
+    count = writeMetadataCache(args.cache, directories)
+    print(f'Wrote {count} profile metadata entries to {args.cache}.')
@@ -15,7 +15,9 @@
 
 
 import logging
+import os
 import types
+from collections.abc import Mapping
 from xml.sax import parseString
 from xml.sax.handler import ContentHandler
 
@@ -34,7 +36,9 @@ from .interfaces import IImportStepRegistry
 from .interfaces import IProfile
 from .interfaces import IProfileRegistry
 from .interfaces import IToolsetRegistry
+from .metadata import METADATA_XML
 from .metadata import ProfileMetadata
+from .metadata import _resolveProfilePath
 from .permissions import ManagePortal
 from .utils import _computeTopologicalSort
 from .utils import _extractDocstring
@@ -45,6 +49,35 @@ from .utils import _xmldir
 
 logger = logging.getLogger('Products.GenericSetup')
 
+# Bumped on every change made through a GlobalRegistryStorage, so data
+# derived from the registrations can be cached.
+_storage_generation = 0
+
+
+# interface -> [snapshot hits, snapshot misses] of GlobalRegistryStorage
+_storage_statistics = {}
+
+
+def _bumpStorageGeneration():
+    global _storage_generation
+    _storage_generation += 1
+
+
+def getStorageCacheStatistics():
+    """ Return the snapshot statistics of all GlobalRegistryStorages.
+
+    o Keys are the dotted names of the utility interfaces, values are
+      mappings with the keys 'hits' and 'misses'.
+    """
+    return {iface.__identifier__: {'hits': hits, 'misses': misses}
+            for iface, (hits, misses) in _storage_statistics.items()}
+
+
+def resetStorageCacheStatistics():
+    """ Reset the snapshot statistics of all GlobalRegistryStorages.
+    """
+    _storage_statistics.clear()
+
 #
 #   XML parser
 #
@@ -226,16 +259,58 @@ InitializeClass(_ExportStepRegistryParser)
 
 class GlobalRegistryStorage:
 
+    """ Mapping-like access to named global utilities of an interface.
+
+    o 'keys', 'values' and 'items' are served from a snapshot of the
+      registrations, which is dropped whenever a GlobalRegistryStorage
+      or the utility registrations of the global site manager change.
+    """
+
+    _snapshot = None
+    _snapshot_generation = None
+
     def __init__(self, interfaceClass):
         self.interfaceClass = interfaceClass
 
-    def keys(self):
+    def generation(self):
+        """ Return a token which changes whenever the registrations change.
+
+        o Tokens are compared with '_sameGeneration'.
+        """
         sm = getGlobalSiteManager()
-        return [n for n, _i in sm.getUtilitiesFor(self.interfaceClass)]
+        # The utility registry counts its changes, so registrations made
+        # directly with the site manager (e.g. 'provideUtility') are seen.
+        # Without the counter, nothing is cached.
+        registry_generation = getattr(getattr(sm, 'utilities', None),
+                                      '_generation', None)
+        return (sm, _storage_generation, registry_generation)
+
+    def keys(self):
+        return [n for n, _i in self._getSnapshot()]
 
     def values(self):
-        sm = getGlobalSiteManager()
-        return [i for _n, i in sm.getUtilitiesFor(self.interfaceClass)]
+        return [i for _n, i in self._getSnapshot()]
+
+    def items(self):
+        return list(self._getSnapshot())
+
+    def getCacheStatistics(self):
+        """ Return a mapping with the snapshot 'hits' and 'misses'.
+        """
+        hits, misses = _storage_statistics.get(self.interfaceClass, (0, 0))
+        return {'hits': hits, 'misses': misses}
+
+    def _getSnapshot(self):
+        generation = self.generation()
+        stats = _storage_statistics.setdefault(self.interfaceClass, [0, 0])
+        if _sameGeneration(self._snapshot_generation, generation):
+            stats[0] += 1
+        else:
+            stats[1] += 1
+            sm = getGlobalSiteManager()
+            self._snapshot = tuple(sm.getUtilitiesFor(self.interfaceClass))
+            self._snapshot_generation = generation
+        return self._snapshot
 
     def get(self, key):
         sm = getGlobalSiteManager()
@@ -243,16 +318,34 @@ class GlobalRegistryStorage:
 
     def __setitem__(self, id, info):
         sm = getGlobalSiteManager()
+        _bumpStorageGeneration()
         return sm.registerUtility(info, provided=self.interfaceClass, name=id)
 
     def __delitem__(self, id):
         sm = getGlobalSiteManager()
+        _bumpStorageGeneration()
         return sm.unregisterUtility(provided=self.interfaceClass, name=id)
 
     def clear(self):
+        _bumpStorageGeneration()
         for key in self.keys():
             del self[key]
 
+    def changed(self):
+        """ Note that a registered value was changed in place.
+
+        o Changes the generation, so caches derived from it are dropped.
+        """
+        _bumpStorageGeneration()
+
+
+def _sameGeneration(token, other):
+    # The global site manager is compared by identity, as test layers may
+    # stack site managers.
+    return (token is not None and other is not None and
+            token[0] is other[0] and token[1] == other[1] and
+            token[2] is not None and token[2] == other[2])
+
 
 class BaseStepRegistry(Implicit):
 
@@ -655,6 +748,78 @@ class ToolsetRegistry(Implicit):
 InitializeClass(ToolsetRegistry)
 
 
+class _ProfileInfo(Mapping):
+
+    """ Read-only mapping describing a registered profile.
+    """
+
+    security = ClassSecurityInfo()
+    security.declareObjectPublic()
+    security.setDefaultAccess('allow')
+
+    def __init__(self, info):
+        self._info = info
+
+    def __getitem__(self, key):
+        return self._info[key]
+
+    def __iter__(self):
+        return iter(self._info)
+
+    def __len__(self):
+        return len(self._info)
+
+    def copy(self):
+        """ Return a mutable copy, as a dictionary.
+        """
+        return dict(self._info)
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self._info)
+
+
+InitializeClass(_ProfileInfo)
+
+
+class _ProfileIndex:
+
+    """ Lookup structures derived from the registered profiles.
+
+    o Built lazily and dropped whenever the storage generation changes.
+    """
+
+    def __init__(self, storage):
+        self.generation = storage.generation()
+        self.raw = {}       # profile id -> registered info
+        self.infos = {}     # profile id -> read-only info incl. metadata
+        self.metadata = {}  # profile id -> metadata merged into 'infos'
+        self.paths = {}     # profile id -> absolute path of metadata.xml
+        self.stamps = {}    # profile id -> (mtime, size) of that file
+        self.by_type = {}   # profile type -> tuple of profile ids
+        self.by_for = {}    # site interface -> tuple of profile ids
+        self.queries = {}   # (query name, args) -> result
+
+        by_type = {}
+        by_for = {}
+        for profile_id, info in storage.items():
+            self.raw[profile_id] = info
+            by_type.setdefault(info.get('type'), []).append(profile_id)
+            by_for.setdefault(info['for'], []).append(profile_id)
+        self.ids = tuple(self.raw)
+        self.by_type = {k: tuple(v) for k, v in by_type.items()}
+        self.by_for = {k: tuple(v) for k, v in by_for.items()}
+
+    def query(self, name, args, compute):
+        """ Return the cached result of 'compute(*args)'.
+        """
+        key = (name, args)
+        try:
+            return self.queries[key]
+        except KeyError:
+            result = self.queries[key] = compute(*args)
+            return result
+
+
 @implementer(IProfileRegistry)
 class ProfileRegistry(Implicit):
 
@@ -664,6 +829,8 @@ class ProfileRegistry(Implicit):
     security = ClassSecurityInfo()
     security.setDefaultAccess('allow')
 
+    _index = None
+
     def __init__(self):
         self._registered = GlobalRegistryStorage(IProfile)
         self.clear()
@@ -671,6 +838,8 @@ class ProfileRegistry(Implicit):
     @security.protected(ManagePortal)
     def getProfileInfo(self, profile_id, for_=None):
         """ See IProfileRegistry.
+
+        o The result is a read-only mapping.
         """
         if profile_id is None:
             # tarball import
@@ -688,33 +857,110 @@ class ProfileRegistry(Implicit):
                 profile_id = profile_id[len(prefix):]
                 break
 
-        result = self._registered.get(profile_id)
+        index = self._getIndex()
+        result = index.raw.get(profile_id)
         if result is None:
             raise KeyError(profile_id)
-        if for_ is not None:
+        if for_ is not None and result['for'] is not None:
             if not issubclass(for_, result['for']):
                 raise KeyError(profile_id)
-        return result.copy()
+        return self._getMergedInfo(index, profile_id)
 
     @security.protected(ManagePortal)
     def listProfiles(self, for_=None):
         """ See IProfileRegistry.
+
+        o Profiles without site interface are listed for any 'for_'.
         """
-        result = []
-        for profile_id in self._registered.keys():
-            info = self.getProfileInfo(profile_id)
-            if for_ is None or issubclass(for_, info['for']):
-                result.append(profile_id)
-        return tuple(result)
+        index = self._getIndex()
+        if for_ is None:
+            return index.ids
+        return index.query('listProfiles', (for_,), self._computeProfileIds)
 
     @security.protected(ManagePortal)
     def listProfileInfo(self, for_=None):
         """ See IProfileRegistry.
+
+        o The mappings are read-only.
+        """
+        index = self._getIndex()
+        return [self._getMergedInfo(index, profile_id)
+                for profile_id in self.listProfiles(for_)]
+
+    @security.private
+    def listOrderedProfileInfo(self, for_=None):
+        """ Return a tuple of read-only mappings describing profiles.
+
+        o Base profiles come first, in registration order, followed by the
+          extension profiles sorted by id.
         """
-        candidates = [self.getProfileInfo(id)
-                      for id in self.listProfiles()]
-        return [x for x in candidates if for_ is None or x['for'] is None or
-                issubclass(for_, x['for'])]
+        index = self._getIndex()
+        profile_ids = index.query('listOrderedProfileIds', (for_,),
+                                  self._computeOrderedProfileIds)
+        return tuple(self._getMergedInfo(index, x) for x in profile_ids)
+
+    @security.private
+    def queryIndex(self, name, args, compute):
+        """ Return 'compute(*args)', cached until profiles change.
+
+        o Allows callers to cache data derived from the profile infos.
+        """
+        return self._getIndex().query(name, args, compute)
+
+    def _getIndex(self):
+        index = self._index
+        if (index is None or not _sameGeneration(
+                index.generation, self._registered.generation())):
+            index = self._index = _ProfileIndex(self._registered)
+        return index
+
+    def _getMergedInfo(self, index, profile_id):
+        # All profile infos are handed out from here, so they reflect the
+        # current metadata.xml.  Its path is resolved once per index; on
+        # access it is only checked by modification time and size.
+        raw = index.raw[profile_id]
+        path = index.paths.get(profile_id)
+        if path is None:
+            path = index.paths[profile_id] = os.path.abspath(os.path.join(
+                _resolveProfilePath(raw['path'], raw['product']),
+                METADATA_XML))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stamp = None
+        else:
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        info = index.infos.get(profile_id)
+        if info is not None and index.stamps.get(profile_id) == stamp:
+            return info
+        metadata = self._getProfileMetadata(os.path.dirname(path))
+        if info is None or index.metadata.get(profile_id) != metadata:
+            merged = raw.copy()
+            # metadata.xml description trumps ZCML description... awkward
+            merged.update(metadata)
+            info = index.infos[profile_id] = _ProfileInfo(merged)
+            index.metadata[profile_id] = metadata
+        index.stamps[profile_id] = stamp
+        return info
+
+    def _computeProfileIds(self, for_):
+        index = self._getIndex()
+        matching = set()
+        for site_type, profile_ids in index.by_for.items():
+            if site_type is None or issubclass(for_, site_type):
+                matching.update(profile_ids)
+        return tuple(x for x in index.ids if x in matching)
+
+    def _computeOrderedProfileIds(self, for_):
+        index = self._getIndex()
+        profile_ids = set(self.listProfiles(for_))
+        base = []
+        ext = []
+        for profile_type, type_ids in index.by_type.items():
+            target = base if profile_type == BASE else ext
+            target.extend(x for x in type_ids if x in profile_ids)
+        ext.sort()
+        return tuple(base + ext)
 
     @security.protected(ManagePortal)
     def registerProfile(self, name, title, description, path, product=None,
@@ -747,11 +993,8 @@ class ProfileRegistry(Implicit):
                 'post_handler': post_handler,
                 }
 
-        metadata = ProfileMetadata(path, product=product)()
-
-        # metadata.xml description trumps ZCML description... awkward
-        info.update(metadata)
-
+        # metadata.xml is only read when the profile info is needed,
+        # see '_getProfileMetadata'.
         existing_info = self._registered.get(profile_id)
         if existing_info is not None:
             # If it is the same, we can safely accept it.
@@ -764,6 +1007,15 @@ class ProfileRegistry(Implicit):
 
         self._registered[profile_id] = info
 
+    def _getProfileMetadata(self, path):
+        """ Return the contents of the metadata.xml in directory 'path'.
+
+        o Parsing is deferred until the info of a profile is requested,
+          so registration at startup does not touch the filesystem.
+          'ProfileMetadata' caches the result by file modification time.
+        """
+        return ProfileMetadata(path)()
+
     def _computeProfileId(self, name, product):
         profile_id = '{}:{}'.format(product or 'other', name)
         return profile_id
@@ -781,3 +1033,13 @@ class ProfileRegistry(Implicit):
 InitializeClass(ProfileRegistry)
 
 _profile_registry = ProfileRegistry()
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:  # pragma: no cover
+    pass
+else:
+    # Cleaning up resets the global site manager behind our back.
+    addCleanUp(_bumpStorageGeneration)
+    del addCleanUp
@@ -0,0 +1,80 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Timings of the ZCML registrations of GenericSetup.
+
+The ZCML directives in 'zcml.py' run their registrations through
+'timeRegistration'.  The time spent is logged once the database is
+opened.
+
+The registries are not frozen into a snapshot file: the ZCML has to be
+parsed on every start anyway, restoring frozen infos would bypass the
+checks of 'registerProfile' and 'registerStep', and a key made of ZCML
+mtimes and package versions misses Python changes in develop checkouts.
+The timings show how little such a snapshot could save.
+"""
+
+import logging
+import time
+
+
+logger = logging.getLogger('Products.GenericSetup')
+
+# kind -> [count, seconds]
+_timings = {}
+
+
+def timeRegistration(kind, register, *args):
+    """ Run the registration of a ZCML action, and time it.
+    """
+    start = time.perf_counter()
+    try:
+        register(*args)
+    finally:
+        timing = _timings.setdefault(kind, [0, 0.0])
+        timing[0] += 1
+        timing[1] += time.perf_counter() - start
+
+
+def getRegistrationTimings():
+    """ Return a mapping of registration kind to timing statistics.
+
+    o Values are mappings with the keys 'count' and 'seconds'.
+    """
+    return {kind: {'count': count, 'seconds': seconds}
+            for kind, (count, seconds) in _timings.items()}
+
+
+def handleDatabaseOpened(event):
+    """ Log the registration timings.
+    """
+    timings = getRegistrationTimings()
+    if not timings:
+        return
+
+    logger.info(
+        'GenericSetup registrations: %s',
+        ', '.join('%s %d in %.3fs' % (kind, t['count'], t['seconds'])
+                  for kind, t in sorted(timings.items())))
+
+
+def _clear():
+    _timings.clear()
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:  # pragma: no cover
+    pass
+else:
+    addCleanUp(_clear)
+    del addCleanUp
@@ -3,8 +3,16 @@ import unittest
 from zope.interface.verify import verifyObject
 
 from ..events import BeforeProfileImportEvent
+from ..events import ExportStepFinishedEvent
+from ..events import ExportStepStartedEvent
+from ..events import ImportStepFinishedEvent
+from ..events import ImportStepStartedEvent
 from ..events import ProfileImportedEvent
 from ..interfaces import IBeforeProfileImportEvent
+from ..interfaces import IExportStepFinishedEvent
+from ..interfaces import IExportStepStartedEvent
+from ..interfaces import IImportStepFinishedEvent
+from ..interfaces import IImportStepStartedEvent
 from ..interfaces import IProfileImportedEvent
 
 
@@ -40,10 +48,78 @@ class ProfileImportedEventTests(BaseEventTests, unittest.TestCase):
     iface = IProfileImportedEvent
 
 
+class BaseStepStartedEventTests:
+
+    def testInterface(self):
+        event = self.klass("tool", "step_id", "context")
+        verifyObject(self.iface, event)
+
+    def testNormalConstruction(self):
+        event = self.klass("tool", "step_id", "context")
+        self.assertEqual(event.tool, "tool")
+        self.assertEqual(event.step_id, "step_id")
+        self.assertEqual(event.context, "context")
+
+
+class ImportStepStartedEventTests(BaseStepStartedEventTests,
+                                  unittest.TestCase):
+    klass = ImportStepStartedEvent
+    iface = IImportStepStartedEvent
+
+
+class ExportStepStartedEventTests(BaseStepStartedEventTests,
+                                  unittest.TestCase):
+    klass = ExportStepStartedEvent
+    iface = IExportStepStartedEvent
+
+
+class BaseStepFinishedEventTests:
+
+    def testInterface(self):
+        event = self.klass("tool", "step_id", "context", 0.5)
+        verifyObject(self.iface, event)
+
+    def testNormalConstruction(self):
+        event = self.klass("tool", "step_id", "context", 0.5)
+        self.assertEqual(event.tool, "tool")
+        self.assertEqual(event.step_id, "step_id")
+        self.assertEqual(event.context, "context")
+        self.assertEqual(event.seconds, 0.5)
+        self.assertIsNone(event.exception)
+        self.assertIsNone(event.message)
+
+    def testKeywordConstruction(self):
+        error = ValueError()
+        event = self.klass(tool="tool", step_id="step_id", context="context",
+                           seconds=0.5, exception=error, message="message")
+        self.assertIs(event.exception, error)
+        self.assertEqual(event.message, "message")
+
+
+class ImportStepFinishedEventTests(BaseStepFinishedEventTests,
+                                   unittest.TestCase):
+    klass = ImportStepFinishedEvent
+    iface = IImportStepFinishedEvent
+
+
+class ExportStepFinishedEventTests(BaseStepFinishedEventTests,
+                                   unittest.TestCase):
+    klass = ExportStepFinishedEvent
+    iface = IExportStepFinishedEvent
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(
         BeforeProfileImportEventTests))
     suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(
         ProfileImportedEventTests))
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(
+        ImportStepStartedEventTests))
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(
+        ExportStepStartedEventTests))
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(
+        ImportStepFinishedEventTests))
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(
+        ExportStepFinishedEventTests))
     return suite
@@ -0,0 +1,238 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Unit tests for jobs module.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import unittest
+
+import transaction
+from OFS.Application import Application
+from OFS.Folder import Folder
+from ZODB.DB import DB
+from ZODB.DemoStorage import DemoStorage
+from zope.globalrequest import getRequest
+
+
+def _renameSite(context):
+    context.getSite().title = 'renamed'
+    return 'Renamed site'
+
+
+def _failing(context):
+    raise ValueError('broken step')
+
+
+def _checkRequest(context):
+    request = context.getSite().REQUEST
+    assert getRequest() is request
+    return 'Request for %s' % request['SERVER_NAME']
+
+
+class JobTests(unittest.TestCase):
+
+    def setUp(self):
+        from ..tool import SetupTool
+
+        self.db = DB(DemoStorage())
+        self.tm = transaction.TransactionManager()
+        self.connection = self.db.open(transaction_manager=self.tm)
+        app = Application()
+        self.connection.root()['Application'] = app
+        site = Folder('site')
+        site.title = 'original'
+        app._setObject('site', site)
+        site._setObject('setup_tool', SetupTool('setup_tool'))
+        self.tm.commit()
+
+    def tearDown(self):
+        from ..upgrade import _upgrade_registry
+
+        _upgrade_registry.clear()
+        self.tm.abort()
+        self.connection.close()
+        self.db.close()
+
+    def _getTool(self, *steps):
+        app = self.connection.root()['Application']
+        tool = app.site.setup_tool
+        tool._exclude_global_steps = True
+        registry = tool.getImportStepRegistry()
+        for step_id, handler in steps:
+            registry.registerStep(step_id, '1', handler)
+        return tool
+
+    def _commitAndWait(self, job_id):
+        self.tm.commit()
+        for thread in threading.enumerate():
+            if thread.name == 'GenericSetup job %s' % job_id:
+                thread.join(10)
+        # Look at what the worker committed.
+        self.tm.begin()
+
+    def test_queueImport(self):
+        tool = self._getTool(('rename', _renameSite))
+        job_id = tool.queueImport('snapshot-dummy')
+        self.assertEqual(tool.getJobStatus(job_id)['status'], 'queued')
+        self.assertEqual(tool.getJobStatus(job_id)['kind'], 'import')
+
+        self._commitAndWait(job_id)
+        status = tool.getJobStatus(job_id)
+        self.assertEqual(status['status'], 'finished')
+        self.assertEqual([(info['id'], info['status'])
+                          for info in status['steps']],
+                         [('rename', 'done')])
+        self.assertEqual(status['messages']['rename'],
+                         'Renamed site\nZODB: 0 objects loaded, 1 modified')
+        self.assertIsNone(status['error'])
+        self.assertEqual(tool.aq_parent.title, 'renamed')
+        self.assertEqual([job['id'] for job in tool.listJobs()], [job_id])
+
+    def test_queueImport_failing(self):
+        tool = self._getTool(('rename', _renameSite))
+        tool.getImportStepRegistry().registerStep(
+            'zzz_failing', '1', _failing, ('rename',))
+        job_id = tool.queueImport('snapshot-dummy')
+
+        self._commitAndWait(job_id)
+        status = tool.getJobStatus(job_id)
+        self.assertEqual(status['status'], 'failed')
+        self.assertEqual([(info['id'], info['status'])
+                          for info in status['steps']],
+                         [('rename', 'done'), ('zzz_failing', 'failed')])
+        self.assertIn('broken step', status['error'])
+        # The work of the job was aborted.
+        self.assertEqual(tool.aq_parent.title, 'original')
+
+    def test_queueUpgrade(self):
+        from ..upgrade import UpgradeStep
+        from ..upgrade import _registerUpgradeStep
+
+        done = []
+        step = UpgradeStep('Upgrade', 'other:foo', '1.0', '1.1', '',
+                           lambda tool: done.append(tool.getId()))
+        _registerUpgradeStep(step)
+        tool = self._getTool()
+        tool.setLastVersionForProfile('other:foo', '1.0')
+        job_id = tool.queueUpgrade('other:foo', [step.id])
+        self.assertEqual(tool.getJobStatus(job_id)['options'],
+                         {'step_ids': [step.id]})
+
+        self._commitAndWait(job_id)
+        status = tool.getJobStatus(job_id)
+        self.assertEqual(status['status'], 'finished')
+        self.assertEqual([(info['title'], info['status'])
+                          for info in status['steps']],
+                         [('Upgrade', 'done')])
+        self.assertEqual(done, ['setup_tool'])
+        self.assertEqual(tool.getLastVersionForProfile('other:foo'),
+                         ('1', '1'))
+
+    def test_queueUpgrade_minimized(self):
+        from ..upgrade import UpgradeStep
+        from ..upgrade import _registerUpgradeStep
+
+        # The tool is ghosted by the first step; the progress of the
+        # later steps is still reported.
+        minimize = UpgradeStep('Minimize', 'other:foo', '1.0', '1.1', '',
+                               lambda tool: tool._p_jar.cacheMinimize())
+        later = UpgradeStep('Later', 'other:foo', '1.1', '1.2', '',
+                            lambda tool: None)
+        _registerUpgradeStep(minimize)
+        _registerUpgradeStep(later)
+        tool = self._getTool()
+        tool.setLastVersionForProfile('other:foo', '1.0')
+        job_id = tool.queueUpgrade('other:foo', [minimize.id, later.id])
+
+        self._commitAndWait(job_id)
+        status = tool.getJobStatus(job_id)
+        self.assertEqual(status['status'], 'finished')
+        self.assertEqual([(info['title'], info['status'])
+                          for info in status['steps']],
+                         [('Minimize', 'done'), ('Later', 'done')])
+
+    def test_request(self):
+        tool = self._getTool(('request', _checkRequest))
+        job_id = tool.queueImport('snapshot-dummy')
+
+        self._commitAndWait(job_id)
+        status = tool.getJobStatus(job_id)
+        self.assertEqual(status['status'], 'finished')
+        self.assertTrue(status['messages']['request'].startswith(
+            'Request for %s' % socket.gethostname()))
+
+    def test_lost_job(self):
+        tool = self._getTool()
+        job_id = tool.queueImport('snapshot-dummy')
+        job = tool._jobs[job_id]
+        self.assertEqual(job['worker'], {'host': socket.gethostname(),
+                                         'pid': os.getpid()})
+        # Queued in this process, not committed yet.
+        self.assertEqual(tool.getJobStatus(job_id)['status'], 'queued')
+
+        # Running in this process, without a worker thread.
+        job['status'] = 'running'
+        job['steps'] = [{'id': 'step', 'title': 'step', 'status': 'running',
+                         'started': 0, 'seconds': None}]
+        status = tool.getJobStatus(job_id)
+        self.assertEqual(status['status'], 'failed')
+        self.assertEqual(status['steps'][0]['status'], 'failed')
+        self.assertIn('gone', status['error'])
+        # The stored record is not changed.
+        self.assertEqual(job['status'], 'running')
+
+        # Queued in a process that is gone.
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        job['status'] = 'queued'
+        job['worker'] = {'host': socket.gethostname(), 'pid': process.pid}
+        self.assertEqual(tool.getJobStatus(job_id)['status'], 'failed')
+        self.assertEqual(tool.listJobs()[0]['status'], 'failed')
+
+        # Processes on other hosts cannot be checked.
+        job['worker'] = {'host': 'other.' + socket.gethostname(),
+                         'pid': process.pid}
+        self.assertEqual(tool.getJobStatus(job_id)['status'], 'queued')
+        self.tm.abort()
+
+    def test_aborted_queue(self):
+        tool = self._getTool(('rename', _renameSite))
+        job_id = tool.queueImport('snapshot-dummy')
+        self.tm.abort()
+        self.assertIsNone(tool.getJobStatus(job_id))
+        self.assertEqual(tool.aq_parent.title, 'original')
+
+    def test_manage_jobStatus(self):
+        tool = self._getTool()
+        job_id = tool.queueImport('snapshot-dummy')
+        self.assertEqual(json.loads(tool.manage_jobStatus(job_id)),
+                         tool.getJobStatus(job_id))
+        self.assertEqual(json.loads(tool.manage_jobStatus('unknown')),
+                         {'id': 'unknown', 'status': None})
+
+    def test_queue_unstored_tool(self):
+        from ..tool import SetupTool
+
+        tool = SetupTool('setup_tool')
+        self.assertRaises(ValueError, tool.queueImport, 'snapshot-dummy')
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.defaultTestLoader.loadTestsFromTestCase(JobTests),
+    ))
@@ -13,12 +13,16 @@
 """ Unit tests for ProfileMetadata.
 """
 
+import os
+import shutil
+import tempfile
 import unittest
 
 from Testing.ZopeTestCase import ZopeTestCase
 from Testing.ZopeTestCase import installProduct
 
 from .. import profile_registry
+from ..metadata import METADATA_XML
 from ..metadata import ProfileMetadata
 
 
@@ -85,8 +89,171 @@ class ProfileMetadataTests(ZopeTestCase):
         parsed = metadata.parseXML(_METADATA_EMPTY_DEPENDENCIES_XML)
         self.assertEqual(parsed, _METADATA_MAP_EMPTY_DEPENDENCIES)
 
+    def _makeProfileDir(self, text):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self._writeMetadata(path, text)
+        return path
+
+    def _writeMetadata(self, path, text, mtime=None):
+        full_path = os.path.join(path, METADATA_XML)
+        with open(full_path, 'w') as fp:
+            fp.write(text)
+        if mtime is not None:
+            os.utime(full_path, (mtime, mtime))
+
+    def test_call_cached_by_mtime(self):
+        path = self._makeProfileDir(_METADATA_XML)
+        metadata = ProfileMetadata(path)
+        self.assertEqual(metadata(), _METADATA_MAP)
+
+        parsed = []
+        metadata.parseXML = parsed.append
+        self.assertEqual(metadata(), _METADATA_MAP)
+        self.assertEqual(parsed, [])
+
+        # Changing the file invalidates the cache.
+        self._writeMetadata(path, _METADATA_EMPTY_DEPENDENCIES_XML, 1)
+        self.assertEqual(ProfileMetadata(path)(),
+                         _METADATA_MAP_EMPTY_DEPENDENCIES)
+
+    def test_call_cached_by_encoding(self):
+        path = self._makeProfileDir(_METADATA_XML)
+        self.assertEqual(ProfileMetadata(path)(), _METADATA_MAP)
+
+        # Metadata parsed with another encoding is cached apart.
+        metadata = ProfileMetadata(path, encoding='utf-8')
+        metadata.parseXML = lambda xml: {'version': b'1.0'}
+        self.assertEqual(metadata(), {'version': b'1.0'})
+        metadata.parseXML = None
+        self.assertEqual(metadata(), {'version': b'1.0'})
+        self.assertEqual(ProfileMetadata(path)(), _METADATA_MAP)
+
+    def test_call_returns_copy(self):
+        path = self._makeProfileDir(_METADATA_XML)
+        ProfileMetadata(path)()['version'] = 'CHANGED'
+        self.assertEqual(ProfileMetadata(path)(), _METADATA_MAP)
+
+    def test_registerProfile_lazy(self):
+        path = self._makeProfileDir('<metadata><broken></metadata>')
+        # Registration does not parse metadata.xml...
+        profile_registry.registerProfile(
+            'lazy', 'Lazy Profile', 'Not parsed yet', path)
+        self.addCleanup(profile_registry.unregisterProfile, 'lazy')
+        self.assertIn('other:lazy', profile_registry.listProfiles())
+        # ...only the first lookup of the profile info does.
+        from xml.parsers.expat import ExpatError
+        self.assertRaises(ExpatError, profile_registry.getProfileInfo,
+                          'other:lazy')
+        self._writeMetadata(path, _METADATA_XML, 1)
+        info = profile_registry.getProfileInfo('other:lazy')
+        self.assertEqual(info['description'], desc)
+        self.assertEqual(info['version'], version)
+        self.assertEqual(info['dependencies'], (dep1, dep2))
+
+
+class MetadataCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        from .. import metadata
+        self._tmpdir = tempfile.mkdtemp()
+        self._cache = os.path.join(self._tmpdir, 'cache.json')
+        self._profile = os.path.join(self._tmpdir, 'profiles', 'default')
+        os.makedirs(self._profile)
+        with open(os.path.join(self._profile, METADATA_XML), 'w') as fp:
+            fp.write(_METADATA_XML)
+        with open(os.path.join(self._tmpdir, METADATA_XML), 'w') as fp:
+            fp.write('<other-metadata/>')
+        metadata._metadata_cache.clear()
+
+    def tearDown(self):
+        from .. import metadata
+        shutil.rmtree(self._tmpdir)
+        metadata._metadata_cache.clear()
+
+    def _parseFails(self):
+        metadata = ProfileMetadata(self._profile)
+        metadata.parseXML = None
+        return metadata
+
+    def test_write_and_load(self):
+        from .. import metadata
+        self.assertEqual(
+            metadata.writeMetadataCache(self._cache, [self._tmpdir]), 1)
+        metadata._metadata_cache.clear()
+        self.assertEqual(metadata.loadMetadataCache(self._cache), 1)
+        self.assertEqual(self._parseFails()(), _METADATA_MAP)
+
+    def test_load_outdated_entry(self):
+        from .. import metadata
+        metadata.writeMetadataCache(self._cache, [self._tmpdir])
+        metadata._metadata_cache.clear()
+        os.utime(os.path.join(self._profile, METADATA_XML), (1, 1))
+        metadata.loadMetadataCache(self._cache)
+        self.assertRaises(TypeError, self._parseFails())
+        self.assertEqual(ProfileMetadata(self._profile)(), _METADATA_MAP)
+
+    def test_load_broken(self):
+        from .. import metadata
+        with open(self._cache, 'w') as fp:
+            fp.write('{broken')
+        self.assertEqual(metadata.loadMetadataCache(self._cache), 0)
+        self.assertEqual(metadata.loadMetadataCache(self._cache + '.nonesuch'),
+                         0)
+
+    def test_environment(self):
+        from contextlib import redirect_stdout
+        from io import StringIO
+        from unittest import mock
+
+        from .. import metadata
+        with redirect_stdout(StringIO()) as out:
+            metadata.prewarmMetadataCache(
+                ['--cache', self._cache, self._tmpdir])
+        self.assertIn('Wrote 1 profile metadata entries', out.getvalue())
+        metadata._metadata_cache.clear()
+        environ = {metadata.METADATA_CACHE_ENV: self._cache}
+        with mock.patch.dict(os.environ, environ), \
+                mock.patch.object(metadata, '_disk_cache_loaded', False):
+            self.assertEqual(self._parseFails()(), _METADATA_MAP)
+            self.assertTrue(metadata._disk_cache_loaded)
+
+    def test_environment_threads(self):
+        import threading
+        from unittest import mock
+
+        from .. import metadata
+        loading = threading.Event()
+        proceed = threading.Event()
+        calls = []
+
+        def loadMetadataCache(path):
+            calls.append(path)
+            loading.set()
+            proceed.wait(5)
+
+        environ = {metadata.METADATA_CACHE_ENV: self._cache}
+        with mock.patch.dict(os.environ, environ), \
+                mock.patch.object(metadata, '_disk_cache_loaded', False), \
+                mock.patch.object(metadata, 'loadMetadataCache',
+                                  loadMetadataCache):
+            first = threading.Thread(target=metadata._loadDiskCache)
+            first.start()
+            loading.wait(5)
+            # Another thread waits until the cache is filled.
+            second = threading.Thread(target=metadata._loadDiskCache)
+            second.start()
+            second.join(0.1)
+            self.assertTrue(second.is_alive())
+            proceed.set()
+            first.join(5)
+            second.join(5)
+            self.assertEqual(calls, [self._cache])
+            self.assertTrue(metadata._disk_cache_loaded)
+
 
 def test_suite():
     return unittest.TestSuite((
         unittest.defaultTestLoader.loadTestsFromTestCase(ProfileMetadataTests),
+        unittest.defaultTestLoader.loadTestsFromTestCase(MetadataCacheTests),
     ))
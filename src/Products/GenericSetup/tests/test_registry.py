@@ -61,6 +61,77 @@ DOC_FUNC_NAME = f'{__name__}.{DOC_FUNC.__name__}'
 ###############################
 
 
+class IDummyUtility(Interface):
+    pass
+
+
+class GlobalRegistryStorageTests(unittest.TestCase):
+
+    def setUp(self):
+        from zope.testing.cleanup import cleanUp
+        cleanUp()
+
+    def tearDown(self):
+        from zope.testing.cleanup import cleanUp
+        cleanUp()
+
+    def _makeOne(self):
+        from ..registry import GlobalRegistryStorage
+        return GlobalRegistryStorage(IDummyUtility)
+
+    def test_snapshot(self):
+        storage = self._makeOne()
+        storage['one'] = {'id': 'one'}
+        before = storage.getCacheStatistics()
+        self.assertEqual(storage.keys(), ['one'])
+        self.assertEqual(storage.values(), [{'id': 'one'}])
+        self.assertEqual(storage.items(), [('one', {'id': 'one'})])
+        stats = storage.getCacheStatistics()
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+        self.assertEqual(stats['hits'] - before['hits'], 2)
+
+        # Returned lists can be changed by the caller.
+        storage.keys().append('two')
+        self.assertEqual(storage.keys(), ['one'])
+
+    def test_snapshot_invalidation(self):
+        storage = self._makeOne()
+        other = self._makeOne()
+        storage['one'] = {'id': 'one'}
+        self.assertEqual(other.keys(), ['one'])
+        storage['two'] = {'id': 'two'}
+        self.assertEqual(sorted(other.keys()), ['one', 'two'])
+        del storage['one']
+        self.assertEqual(other.keys(), ['two'])
+        storage.clear()
+        self.assertEqual(other.keys(), [])
+
+    def test_snapshot_site_manager_changes(self):
+        from zope.component import getGlobalSiteManager
+        from zope.component import provideUtility
+        from zope.testing.cleanup import cleanUp
+
+        storage = self._makeOne()
+        storage['one'] = {'id': 'one'}
+        self.assertEqual(storage.keys(), ['one'])
+        provideUtility({'id': 'two'}, IDummyUtility, 'two')
+        self.assertEqual(sorted(storage.keys()), ['one', 'two'])
+        getGlobalSiteManager().unregisterUtility(provided=IDummyUtility,
+                                                 name='one')
+        self.assertEqual(storage.keys(), ['two'])
+        cleanUp()
+        self.assertEqual(storage.keys(), [])
+
+    def test_getStorageCacheStatistics(self):
+        from ..registry import getStorageCacheStatistics
+        storage = self._makeOne()
+        storage.keys()
+        storage.keys()
+        stats = getStorageCacheStatistics()
+        self.assertEqual(stats[IDummyUtility.__identifier__],
+                         storage.getCacheStatistics())
+
+
 class ImportStepRegistryTests(BaseRegistryTests, ConformsToIStepRegistry,
                               ConformsToIImportStepRegistry):
 
@@ -1030,6 +1101,141 @@ class ProfileRegistryTests(BaseRegistryTests, ConformsToIProfileRegistry):
         self.assertEqual(info['type'], PROFILE_TYPE)
         self.assertEqual(info['for'], FOR)
 
+    def test_getProfileInfo_readonly(self):
+
+        registry = self._makeOne()
+        registry.registerProfile('one', 'One', 'One profile', '/path/to/one')
+
+        info = registry.getProfileInfo('other:one')
+        with self.assertRaises(TypeError):
+            info['title'] = 'Changed'
+        self.assertIs(registry.getProfileInfo('other:one'), info)
+        self.assertIs(registry.listProfileInfo()[0], info)
+        self.assertEqual(info.copy()['title'], 'One')
+
+    def test_getProfileInfo_restricted(self):
+        import types
+
+        from AccessControl.unauthorized import Unauthorized
+        from AccessControl.ZopeGuards import guarded_getattr
+        from AccessControl.ZopeGuards import guarded_getitem
+
+        registry = self._makeOne()
+        registry.registerProfile('one', 'One', 'One profile', '/path/to/one')
+
+        info = registry.getProfileInfo('other:one')
+        self.assertEqual(guarded_getitem(info, 'title'), 'One')
+        self.assertEqual(guarded_getattr(info, 'get')('id'), 'other:one')
+        self.assertRaises(Unauthorized, guarded_getattr, info, '_info')
+        # Mapping proxies in general are not opened to restricted code.
+        self.assertRaises(Unauthorized, guarded_getitem,
+                          types.MappingProxyType({'a': 1}), 'a')
+
+    def test_listProfileInfo_metadata_changed(self):
+        import os
+        import shutil
+        import tempfile
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        metadata_path = os.path.join(path, 'metadata.xml')
+        with open(metadata_path, 'w') as f:
+            f.write('<metadata><version>1</version></metadata>')
+        registry = self._makeOne()
+        registry.registerProfile('one', 'One', '', path)
+        self.assertEqual(registry.listProfileInfo()[0]['version'], '1')
+        self.assertEqual(
+            registry.listOrderedProfileInfo()[0]['version'], '1')
+
+        with open(metadata_path, 'w') as f:
+            f.write('<metadata><version>22</version></metadata>')
+        stat = os.stat(metadata_path)
+        os.utime(metadata_path, ns=(stat.st_atime_ns,
+                                    stat.st_mtime_ns + 10 ** 9))
+        # All APIs serve the same, refreshed info.
+        info = registry.listProfileInfo()[0]
+        self.assertEqual(info['version'], '22')
+        self.assertIs(registry.listOrderedProfileInfo()[0], info)
+        self.assertIs(registry.getProfileInfo('other:one'), info)
+
+    def test_listProfileInfo_resolves_path_once(self):
+        from unittest import mock
+
+        from .. import metadata
+
+        registry = self._makeOne()
+        registry.registerProfile('one', 'One', '', 'tests/metadata_profile',
+                                 product='GenericSetup')
+        with mock.patch.object(metadata, '_getProductPath',
+                               wraps=metadata._getProductPath) as resolve, \
+                mock.patch.object(metadata.ProfileMetadata, '__call__',
+                                  autospec=True,
+                                  side_effect=metadata.ProfileMetadata.__call__
+                                  ) as parse:
+            for i in range(3):
+                info = registry.listProfileInfo()[0]
+                registry.getProfileInfo('GenericSetup:one')
+        self.assertEqual(info['description'], 'Description from metadata')
+        # The path is resolved and the metadata read once, later calls
+        # only look at the file's modification time and size.
+        self.assertEqual(resolve.call_count, 1)
+        self.assertEqual(parse.call_count, 1)
+
+    def test_listProfiles_without_site_type(self):
+
+        registry = self._makeOne()
+        registry.registerProfile('one', 'One', '', '/path/to/one', for_=ISite)
+        registry.registerProfile('two', 'Two', '', '/path/to/two')
+
+        self.assertEqual(registry.listProfiles(for_=ISite),
+                         ('other:one', 'other:two'))
+        self.assertEqual(registry.listProfiles(for_=IAnotherSite),
+                         ('other:two',))
+        info = registry.getProfileInfo('other:two', for_=IAnotherSite)
+        self.assertEqual(info['id'], 'other:two')
+
+    def test_listOrderedProfileInfo(self):
+
+        registry = self._makeOne()
+        registry.registerProfile('b', 'B', '', '/path/to/b',
+                                 profile_type=EXTENSION)
+        registry.registerProfile('c', 'C', '', '/path/to/c')
+        registry.registerProfile('a', 'A', '', '/path/to/a',
+                                 profile_type=EXTENSION, for_=ISite)
+
+        self.assertEqual(
+            [x['id'] for x in registry.listOrderedProfileInfo()],
+            ['other:c', 'other:a', 'other:b'])
+        self.assertEqual(
+            [x['id'] for x in registry.listOrderedProfileInfo(IAnotherSite)],
+            ['other:c', 'other:b'])
+
+    def test_index_invalidation(self):
+
+        registry = self._makeOne()
+        registry.registerProfile('one', 'One', '', '/path/to/one')
+        computed = []
+
+        def compute(arg):
+            computed.append(arg)
+            return tuple(registry.listProfiles())
+
+        self.assertEqual(registry.queryIndex('test', ('x',), compute),
+                         ('other:one',))
+        self.assertEqual(registry.queryIndex('test', ('x',), compute),
+                         ('other:one',))
+        self.assertEqual(computed, ['x'])
+
+        registry.registerProfile('two', 'Two', '', '/path/to/two')
+        self.assertEqual(registry.queryIndex('test', ('x',), compute),
+                         ('other:one', 'other:two'))
+        self.assertEqual(len(registry.listProfileInfo()), 2)
+
+        self.assertEqual(computed, ['x', 'x'])
+
+        registry.unregisterProfile('one')
+        self.assertEqual(registry.listProfiles(), ('other:two',))
+
     def test_getProfileInfo_tarball(self):
         # When importing a tarball, some code calls getProfileInfo with id
         # None.  This must not crash.
@@ -1047,6 +1253,7 @@ class ProfileRegistryTests(BaseRegistryTests, ConformsToIProfileRegistry):
 def test_suite():
     loader = unittest.defaultTestLoader
     return unittest.TestSuite((
+        loader.loadTestsFromTestCase(GlobalRegistryStorageTests),
         loader.loadTestsFromTestCase(ImportStepRegistryTests),
         loader.loadTestsFromTestCase(ExportStepRegistryTests),
         loader.loadTestsFromTestCase(ToolsetRegistryTests),
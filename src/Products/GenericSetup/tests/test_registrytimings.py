@@ -0,0 +1,116 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Unit tests for registrytimings module.
+"""
+
+import unittest
+
+from zope.configuration import xmlconfig
+from zope.testing.cleanup import cleanUp
+
+import Products.GenericSetup
+
+from ..registry import _profile_registry
+
+
+def dummy_importstep(context):
+    """ Dummy import step.
+    """
+
+
+def dummy_exportstep(context):
+    """ Dummy export step.
+    """
+
+
+def dummy_upgrade(context):
+    pass
+
+
+_CONFIGURE_ZCML = """\
+<configure
+    xmlns:genericsetup="http://namespaces.zope.org/genericsetup"
+    package="Products.GenericSetup"
+    i18n_domain="foo">
+  <genericsetup:registerProfile
+      name="timed"
+      title="Timed"
+      directory="tests/default_profile"
+      />
+  <genericsetup:importStep
+      name="Products.GenericSetup.tests.test_registrytimings.import"
+      title="title"
+      description="description"
+      handler="Products.GenericSetup.tests.test_registrytimings.dummy_importstep">
+    <depends name="something.else"/>
+  </genericsetup:importStep>
+  <genericsetup:exportStep
+      name="Products.GenericSetup.tests.test_registrytimings.export"
+      title="title"
+      description="description"
+      handler="Products.GenericSetup.tests.test_registrytimings.dummy_exportstep"
+      />
+  <genericsetup:upgradeStep
+      title="Upgrade"
+      profile="Products.GenericSetup:timed"
+      source="1.0"
+      destination="1.1"
+      handler="Products.GenericSetup.tests.test_registrytimings.dummy_upgrade"
+      />
+</configure>
+"""
+
+
+class RegistryTimingsTests(unittest.TestCase):
+
+    def setUp(self):
+        cleanUp()
+
+    def tearDown(self):
+        cleanUp()
+
+    def _loadZCML(self, zcml):
+        context = xmlconfig.file('meta.zcml', Products.GenericSetup)
+        xmlconfig.string(zcml, context=context)
+
+    def _getTimings(self):
+        from ..registrytimings import getRegistrationTimings
+        return getRegistrationTimings()
+
+    def test_timings(self):
+        self._loadZCML(_CONFIGURE_ZCML)
+        timings = self._getTimings()
+        self.assertEqual(sorted(timings),
+                         ['exportStep', 'importStep', 'profile',
+                          'upgradeStep'])
+        for timing in timings.values():
+            self.assertEqual(timing['count'], 1)
+            self.assertGreaterEqual(timing['seconds'], 0)
+        info = _profile_registry.getProfileInfo(
+            'Products.GenericSetup:timed')
+        self.assertEqual(info['title'], 'Timed')
+
+    def test_handleDatabaseOpened(self):
+        from ..registrytimings import handleDatabaseOpened
+
+        self._loadZCML(_CONFIGURE_ZCML)
+        with self.assertLogs('Products.GenericSetup', 'INFO') as logs:
+            handleDatabaseOpened(None)
+        self.assertIn('profile 1 in ', logs.output[0])
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            RegistryTimingsTests),
+    ))
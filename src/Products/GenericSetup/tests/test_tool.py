@@ -35,6 +35,8 @@ from ..context import TarballExportContext
 from ..interfaces import IBeforeProfileImportEvent
 from ..interfaces import IProfileImportedEvent
 from ..testing import ExportImportZCMLLayer
+from ..tool import _getRunState
+from ..tool import _run_state
 from ..upgrade import UpgradeDepends
 from ..upgrade import UpgradeStep
 from ..upgrade import _registerNestedUpgradeStep
@@ -54,6 +56,8 @@ from .test_registry import _NORMAL_TOOLSET_XML
 from .test_registry import _SINGLE_EXPORT_XML
 from .test_registry import _SINGLE_IMPORT_XML
 from .test_registry import ONE_FUNC
+from .test_registry import ONE_FUNC_NAME
+from .test_registry import TWO_FUNC_NAME
 from .test_registry import IAnotherSite
 from .test_registry import IDerivedSite
 from .test_registry import ISite
@@ -312,6 +316,58 @@ class SetupToolTests(FilesystemTestBase, TarballTester, ConformsToISetupTool):
                          ['dependable', 'dependent'])
         self.assertEqual(_after_import_events[0].full_import, False)
 
+    def test_runImportStepsFromProfile(self):
+
+        TITLE = 'original title'
+        site = self._makeSite(TITLE)
+
+        tool = self._makeOne('setup_tool').__of__(site)
+
+        registry = tool.getImportStepRegistry()
+        registry.registerStep('dependable', '1', _underscoreSiteTitle)
+        registry.registerStep('dependent', '1', _uppercaseSiteTitle,
+                              ('dependable', ))
+        registry.registerStep('purging', '1', _purgeIfRequired,
+                              ('dependable', ))
+
+        result = tool.runImportStepsFromProfile(
+            'snapshot-dummy', ['purging', 'dependent', 'dependable'])
+
+        # 'dependable' ran only once, before the steps depending on it
+        self.assertEqual(result['steps'][0], 'dependable')
+        self.assertEqual(sorted(result['steps']),
+                         ['dependable', 'dependent', 'purging'])
+        self.assertEqual(result['messages']['dependable'], 'Underscored title')
+        self.assertEqual(result['messages']['dependent'], 'Uppercased title')
+        self.assertEqual(site.title, TITLE.replace(' ', '_').upper())
+
+        self.assertEqual(len(_before_import_events), 1)
+        self.assertEqual(_before_import_events[0].steps, result['steps'])
+        self.assertEqual(len(_after_import_events), 1)
+
+        self.assertRaises(ValueError, tool.runImportStepsFromProfile,
+                          'snapshot-dummy', ['dependent', 'nonesuch'])
+
+    def test_runImportStepsFromProfile_indirect_dependencies(self):
+
+        site = self._makeSite('original title')
+
+        tool = self._makeOne('setup_tool').__of__(site)
+
+        registry = tool.getImportStepRegistry()
+        registry.registerStep('c', '1', _underscoreSiteTitle)
+        registry.registerStep('b', '1', _noopStep, ('c', ))
+        registry.registerStep('a', '1', _uppercaseSiteTitle, ('b', ))
+
+        result = tool.runImportStepsFromProfile('snapshot-dummy', ['a'])
+
+        self.assertEqual(result['steps'], ['c', 'b', 'a'])
+        self.assertEqual(site.title, 'ORIGINAL_TITLE')
+
+        result = tool.runImportStepsFromProfile('snapshot-dummy', ['a'],
+                                                run_dependencies=False)
+        self.assertEqual(result['steps'], ['a'])
+
     def test_runImportStepFromProfile_skip_dependencies(self):
 
         TITLE = 'original title'
@@ -471,6 +527,247 @@ class SetupToolTests(FilesystemTestBase, TarballTester, ConformsToISetupTool):
         logged = [x for x in tool.objectIds('File') if x.startswith(prefix)]
         self.assertEqual(len(logged), 1)
 
+    def test_runAllImportStepsFromProfile_release_memory(self):
+        from unittest import mock
+
+        site = self._makeSite()
+        tool = self._makeOne('setup_tool').__of__(site)
+        tool._exclude_global_steps = True
+
+        registry = tool.getImportStepRegistry()
+        registry.registerStep('dependable', '1', _underscoreSiteTitle)
+        registry.registerStep('dependent', '1', _uppercaseSiteTitle,
+                              ('dependable', ))
+
+        with mock.patch('transaction.savepoint') as savepoint:
+            result = tool.runAllImportStepsFromProfile('snapshot-testing')
+            self.assertEqual(savepoint.call_count, 0)
+            self.assertNotIn('peak_memory_growth', result)
+
+            # The peak memory is taken before and after each step.
+            with mock.patch('Products.GenericSetup.tool._getPeakMemory',
+                            side_effect=[1000, 1000, 1000, 1500]):
+                result = tool.runAllImportStepsFromProfile(
+                    'snapshot-testing', release_memory=True)
+            # One savepoint after each step and one after the profile.
+            self.assertEqual(savepoint.call_count, 3)
+            savepoint.assert_called_with(optimistic=True)
+
+        self.assertEqual(result['peak_memory_growth'],
+                         {'dependable': 0, 'dependent': 500})
+        self.assertIn('Peak memory growth: 500 KiB',
+                      result['messages']['dependent'])
+
+    def test_runAllImportStepsFromProfile_cprofile(self):
+        import marshal
+
+        site = self._makeSite()
+        tool = self._makeOne('setup_tool').__of__(site)
+        tool._exclude_global_steps = True
+        registry = tool.getImportStepRegistry()
+        registry.registerStep('simple', '1', _uppercaseSiteTitle)
+
+        result = tool.runAllImportStepsFromProfile('snapshot-testing')
+        self.assertNotIn('pstats', result)
+        self.assertEqual(tool.objectIds('File')[-1][-4:], '.log')
+
+        result = tool.runAllImportStepsFromProfile('snapshot-testing',
+                                                   cprofile=True)
+        self.assertEqual(list(result['pstats']), ['simple'])
+        stats = marshal.loads(result['pstats']['simple'])
+        self.assertIn('_uppercaseSiteTitle',
+                      [function for (_, _, function) in stats])
+        message = result['messages']['simple']
+        self.assertTrue(message.startswith('Uppercased title\n'))
+        self.assertIn('cumulative', message)
+        self.assertIn('_uppercaseSiteTitle', message)
+        pstats_ids = [x for x in tool.objectIds('File')
+                      if x.endswith('-simple.pstats')]
+        self.assertEqual(len(pstats_ids), 1)
+        self.check_restricted_access(tool[pstats_ids[0]])
+        self.assertIsNone(_getRunState(tool, 'step_profiles'))
+
+    def test_runAllImportStepsFromProfile_objects(self):
+        import transaction
+
+        site = self._makeSite()
+        site._setObject('setup_tool', self._makeOne('setup_tool'))
+        tool = site.setup_tool
+        tool._exclude_global_steps = True
+        registry = tool.getImportStepRegistry()
+        registry.registerStep('simple', '1', _uppercaseSiteTitle)
+        registry.registerStep('nothing', '1', _noopStep)
+
+        # Without a database, nothing is counted.
+        unstored = self._makeOne('setup_tool').__of__(site)
+        unstored._exclude_global_steps = True
+        unstored.getImportStepRegistry().registerStep(
+            'simple', '1', _uppercaseSiteTitle)
+        result = unstored.runAllImportStepsFromProfile('snapshot-testing')
+        self.assertNotIn('objects', result)
+
+        transaction.savepoint()
+        result = tool.runAllImportStepsFromProfile('snapshot-testing')
+        self.assertEqual(result['objects'],
+                         {'simple': {'loaded': 0, 'modified': 1},
+                          'nothing': {'loaded': 0, 'modified': 0}})
+        self.assertEqual(result['messages']['simple'],
+                         'Uppercased title\n'
+                         'ZODB: 0 objects loaded, 1 modified')
+
+        # Loading a ghost is counted.
+        site._setObject('child', Folder('child'))
+        registry.registerStep('child', '1', _readChildTitle)
+        transaction.savepoint()
+        aq_base(site.child)._p_deactivate()
+        result = tool.runImportStepsFromProfile('snapshot-testing',
+                                                ['child'])
+        self.assertEqual(result['objects'],
+                         {'child': {'loaded': 1, 'modified': 0}})
+        self.assertEqual(result['messages']['child'],
+                         'ZODB: 1 objects loaded, 0 modified')
+
+        # Single steps, as run by upgradeDepends, are counted as well.
+        site.title = 'lower'
+        transaction.savepoint()
+        with self.assertLogs('Products.GenericSetup.tool') as logs:
+            result = tool.runImportStepFromProfile('snapshot-testing',
+                                                   'simple')
+        self.assertEqual(result['objects'],
+                         {'simple': {'loaded': 0, 'modified': 1}})
+        self.assertEqual(result['messages']['simple'],
+                         'Uppercased title\n'
+                         'ZODB: 0 objects loaded, 1 modified')
+        self.assertEqual(logs.output,
+                         ['INFO:Products.GenericSetup.tool:Import step '
+                          'simple: 0 objects loaded, 1 modified'])
+
+    def test_runAllImportStepsFromProfile_cprofile_nested(self):
+        import marshal
+
+        site = self._makeSite()
+        tool = self._makeOne('setup_tool').__of__(site)
+        tool._exclude_global_steps = True
+        registry = tool.getImportStepRegistry()
+        registry.registerStep('outer', '1', _runInnerStep)
+        registry.registerStep('simple', '1', _uppercaseSiteTitle,
+                              ('outer',))
+
+        result = tool.runAllImportStepsFromProfile('snapshot-testing',
+                                                   cprofile=True)
+        self.assertEqual(result['steps'], ['outer', 'simple'])
+        stats = marshal.loads(result['pstats']['outer'])
+        functions = [function for (_, _, function) in stats]
+        self.assertIn('_runInnerStep', functions)
+        # The nested step is part of the statistics of the outer one.
+        self.assertIn('_uppercaseSiteTitle', functions)
+        self.assertFalse(_run_state.running_step)
+
+    def test_runAllImportStepsFromProfile_cprofile_busy(self):
+        import cProfile
+        from unittest import mock
+
+        class BusyProfile(cProfile.Profile):
+            # As on Python 3.12+ while another thread is profiling.
+            def enable(self, *args, **kw):
+                raise ValueError('Another profiling tool is already active')
+
+        site = self._makeSite()
+        tool = self._makeOne('setup_tool').__of__(site)
+        tool._exclude_global_steps = True
+        tool.getImportStepRegistry().registerStep(
+            'simple', '1', _uppercaseSiteTitle)
+
+        with mock.patch('cProfile.Profile', BusyProfile):
+            result = tool.runAllImportStepsFromProfile('snapshot-testing',
+                                                       cprofile=True)
+        # The step runs anyway, unprofiled.
+        self.assertEqual(site.title, site.title.upper())
+        self.assertEqual(result['pstats'], {})
+        self.assertEqual(result['messages']['simple'],
+                         'Uppercased title\n'
+                         'Not profiled: another profiler was active.')
+
+    def test_runAllImportStepsFromProfile_trace_memory(self):
+        import tracemalloc
+
+        site = self._makeSite()
+        tool = self._makeOne('setup_tool').__of__(site)
+        tool._exclude_global_steps = True
+        registry = tool.getImportStepRegistry()
+        registry.registerStep('allocate', '1', _allocateMemory)
+
+        result = tool.runAllImportStepsFromProfile('snapshot-testing')
+        self.assertNotIn('memory', result)
+
+        result = tool.runAllImportStepsFromProfile('snapshot-testing',
+                                                   trace_memory=True)
+        self.assertEqual(list(result['memory']), ['allocate'])
+        info = result['memory']['allocate']
+        self.assertGreater(info['growth'], 10000 * 40)
+        self.assertGreaterEqual(info['peak'], info['growth'])
+        self.assertIn('test_tool.py', info['sites'][0])
+        message = result['messages']['allocate']
+        self.assertTrue(message.startswith('Allocated memory\nMemory: +'))
+        self.assertIn('KiB peak', message)
+        self.assertIn('test_tool.py', message)
+        self.assertIsNone(_getRunState(tool, 'step_memory'))
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_runAllImportStepsFromProfile_trace_memory_nested(self):
+        import tracemalloc
+
+        site = self._makeSite()
+        tool = self._makeOne('setup_tool').__of__(site)
+        tool._exclude_global_steps = True
+        registry = tool.getImportStepRegistry()
+        registry.registerStep('outer', '1', _runInnerAllocateStep)
+        registry.registerStep('allocate', '1', _allocateMemory, ('outer',))
+
+        result = tool.runAllImportStepsFromProfile(
+            'snapshot-testing', blacklisted_steps=['allocate'],
+            trace_memory=True)
+        # The memory allocated by the nested step is part of the figures
+        # of the outer step, and the nested step is not traced itself.
+        self.assertEqual(list(result['memory']), ['outer'])
+        info = result['memory']['outer']
+        self.assertGreater(info['growth'], 10000 * 40)
+        self.assertGreaterEqual(info['peak'], info['growth'])
+        self.assertIn('test_tool.py', info['sites'][0])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_runAllImportStepsFromProfile_trace_memory_threads(self):
+        import threading
+        import tracemalloc
+
+        site = self._makeSite()
+        first = self._makeOne('setup_tool').__of__(site)
+        first._exclude_global_steps = True
+        first.getImportStepRegistry().registerStep(
+            'wait', '1', _waitForOverlap)
+        second = self._makeOne('setup_tool').__of__(site)
+        second._exclude_global_steps = True
+        second.getImportStepRegistry().registerStep(
+            'finish', '1', _finishOverlapping)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            first.runAllImportStepsFromProfile('snapshot-dummy',
+                                               trace_memory=True)))
+        _overlap.update(waiting=threading.Event(), go=threading.Event(),
+                        thread=thread)
+        self.addCleanup(_overlap.clear)
+
+        # The first run ends while a step of the second one is traced.
+        thread.start()
+        _overlap['waiting'].wait(10)
+        result = second.runAllImportStepsFromProfile('snapshot-dummy',
+                                                     trace_memory=True)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(result['memory']['finish']['peak'])
+        self.assertIn('peak unknown', result['messages']['finish'])
+        self.assertIsNone(results[0]['memory']['wait']['peak'])
+        self.assertFalse(tracemalloc.is_tracing())
+
     def check_restricted_access(self, obj):
         # For most objects that we create, we do not want ordinary users to
         # see it, also not when they have View permission on a higher level.
@@ -670,6 +967,147 @@ class SetupToolTests(FilesystemTestBase, TarballTester, ConformsToISetupTool):
         self.assertEqual(tool.getLastVersionForProfile('other:ham'),
                          ('1', '0'))
 
+    def test_runAllImportStepsFromProfiles(self):
+        tool = self._setup_dependency_strategy_test_tool()
+
+        # The third profile is a dependency of the main profile, and
+        # selected itself.  It is applied only once.
+        result = tool.runAllImportStepsFromProfiles(
+            ['profile-other:foo', 'profile-other:ham'])
+        self.assertEqual(tool._imported,
+                         [self._PROFILE_PATH3, self._PROFILE_PATH])
+        self.assertEqual(tool.getLastVersionForProfile('other:bar'),
+                         ('1', '1'))
+        self.assertIn('profile-other:foo', result['messages'])
+        self.assertIn('profile-other:ham', result['messages'])
+
+    def test_runAllImportStepsFromProfiles_shared_dependency(self):
+        from ..metadata import METADATA_XML
+        self._makeFile(METADATA_XML, _METADATA_XML)
+        _makeTestFile(METADATA_XML, self._PROFILE_PATH2, _PLAIN_METADATA_XML)
+        _makeTestFile(METADATA_XML, self._PROFILE_PATH3, _METADATA_XML)
+        profile_registry.registerProfile('foo', 'Foo', '', self._PROFILE_PATH)
+        profile_registry.registerProfile('bar', 'Bar', '', self._PROFILE_PATH2)
+        profile_registry.registerProfile('ham', 'Ham', '', self._PROFILE_PATH3)
+        site = self._makeSite()
+        tool = self._makeOne('setup_tool').__of__(site)
+        tool._exclude_global_steps = True
+        tool.getImportStepRegistry().registerStep(
+            'path', '1', _reportProfilePath)
+
+        # Both main profiles depend on 'other:bar'.
+        result = tool.runAllImportStepsFromProfiles(
+            ['profile-other:foo', 'profile-other:ham'])
+
+        # The shared dependency is applied once, before both.
+        self.assertEqual([event.profile_id for event in _before_import_events],
+                         ['profile-other:bar', 'profile-other:foo',
+                          'profile-other:ham'])
+        # The report combines the steps and messages in chain order.
+        self.assertEqual(result['steps'], ['path'])
+        self.assertEqual(result['messages']['path'],
+                         '\n'.join([self._PROFILE_PATH2, self._PROFILE_PATH,
+                                    self._PROFILE_PATH3]))
+        for profile_id in ('bar', 'foo', 'ham'):
+            self.assertIn('profile-other:%s' % profile_id, result['messages'])
+
+    def test_planImport(self):
+        tool = self._setup_dependency_strategy_test_tool()
+        tool.getImportStepRegistry().registerStep(
+            'simple', '1', _uppercaseSiteTitle)
+
+        plan = tool.planImport('profile-other:foo')
+        # Nothing has been imported.
+        self.assertEqual(tool._imported, [])
+        self.assertEqual(tool.getLastVersionForProfile('other:ham'),
+                         'unknown')
+        self.assertEqual(plan['dependency_strategy'], 'upgrade')
+        self.assertEqual([(info['profile_id'], info['action'])
+                          for info in plan['profiles']],
+                         [('profile-other:bar', 'upgrade'),
+                          ('profile-other:ham', 'apply'),
+                          ('profile-other:foo', 'apply')])
+        bar, ham, foo = plan['profiles']
+        self.assertEqual(bar['upgrades'], ['Upgrade'])
+        self.assertEqual(bar['steps'], [])
+        self.assertEqual(foo['files'], ['metadata.xml'])
+        # Without earlier runs there are no timings.
+        self.assertIn({'id': 'simple', 'seconds': None}, foo['steps'])
+        self.assertEqual(plan['seconds'], 0.0)
+
+        plan = tool.planImport('profile-other:foo',
+                               dependency_strategy='new')
+        self.assertEqual([info['action'] for info in plan['profiles']],
+                         ['skip', 'apply', 'apply'])
+
+        # The timings of an import are used as estimates.
+        tool.runAllImportStepsFromProfile('profile-other:foo')
+        plan = tool.planImport('profile-other:foo',
+                               dependency_strategy='reapply')
+        self.assertEqual([info['action'] for info in plan['profiles']],
+                         ['reapply', 'reapply', 'apply'])
+        foo = plan['profiles'][-1]
+        self.assertNotIn(None, [step['seconds'] for step in foo['steps']])
+        self.assertEqual(foo['seconds'],
+                         sum(step['seconds'] for step in foo['steps']))
+
+    def test_planImport_base_profile_purges_versions(self):
+        from ..interfaces import BASE
+        tool = self._setup_dependency_strategy_test_tool()
+        profile_registry.unregisterProfile('bar')
+        profile_registry.registerProfile('bar', 'Bar', '',
+                                         self._PROFILE_PATH2,
+                                         profile_type=BASE)
+        tool.setLastVersionForProfile('other:ham', '1.0')
+
+        # Reapplying the base profile purges the versions, so the next
+        # dependency is new.
+        plan = tool.planImport('profile-other:foo',
+                               dependency_strategy='reapply')
+        self.assertEqual([info['action'] for info in plan['profiles']],
+                         ['reapply', 'apply', 'apply'])
+        plan = tool.planImport('profile-other:foo',
+                               dependency_strategy='reapply',
+                               purge_old=False)
+        self.assertEqual([info['action'] for info in plan['profiles']],
+                         ['reapply', 'reapply', 'apply'])
+        # Upgrading the base profile does not purge.
+        plan = tool.planImport('profile-other:foo')
+        self.assertEqual([info['action'] for info in plan['profiles']],
+                         ['upgrade', 'upgrade', 'apply'])
+
+    def test_planImport_not_counted(self):
+        from ..tool import IMPORT_STEPS_XML
+        tool = self._setup_dependency_strategy_test_tool()
+        self._makeFile(IMPORT_STEPS_XML, _SINGLE_IMPORT_XML)
+
+        tool.resetStatistics()
+        plan = tool.planImport('profile-other:foo')
+        self.assertIn({'id': 'one', 'seconds': None},
+                      plan['profiles'][-1]['steps'])
+        statistics = tool.getStatistics()
+        self.assertEqual(statistics.get('files_read', 0), 0)
+        self.assertEqual(statistics.get('bytes_read', 0), 0)
+
+    def test_recordImportTimings(self):
+        tool = self._makeOne('setup_tool')
+
+        tool._recordImportTimings('other:foo', {'one': 2.0})
+        timings = tool._import_timings
+        self.assertEqual(timings['other:foo'], {'one': 2.0})
+
+        # Small changes are not stored, the tool is not written to.
+        recorded = timings['other:foo']
+        tool._recordImportTimings('other:foo', {'one': 2.5})
+        self.assertIs(timings['other:foo'], recorded)
+        self.assertEqual(recorded, {'one': 2.0})
+
+        # New steps and clear changes are.
+        tool._recordImportTimings('other:foo', {'one': 2.5, 'two': 0.1})
+        self.assertEqual(timings['other:foo'], {'one': 2.0, 'two': 0.1})
+        tool._recordImportTimings('other:foo', {'one': 4.0})
+        self.assertEqual(timings['other:foo'], {'one': 4.0, 'two': 0.1})
+
     def test_runAllImportStepsFromProfile_with_reapply_strategy(self):
         # You can choose the old behavior of always applying the
         # dependencies.  This ignores any upgrade steps.
@@ -935,6 +1373,149 @@ class SetupToolTests(FilesystemTestBase, TarballTester, ConformsToISetupTool):
         self._verifyTarballEntryXML(fileish, 'export_steps.xml',
                                     _DEFAULT_STEP_REGISTRIES_EXPORT_XML)
 
+    def _recordStepEvents(self, *ifaces):
+        events = []
+
+        def handler(event):
+            events.append(event)
+
+        for iface in ifaces:
+            provideHandler(handler, (iface,))
+            self.addCleanup(base_registry.unregisterHandler, handler,
+                            (iface,))
+        return events
+
+    def test_runImportStepFromProfile_step_events(self):
+        from ..interfaces import IImportStepFinishedEvent
+        from ..interfaces import IImportStepStartedEvent
+
+        site = self._makeSite()
+        tool = self._makeOne('setup_tool').__of__(site)
+        registry = tool.getImportStepRegistry()
+        registry.registerStep('simple', '1', _uppercaseSiteTitle)
+        registry.registerStep('failing', '1', _raiseValueError)
+        events = self._recordStepEvents(IImportStepStartedEvent,
+                                        IImportStepFinishedEvent)
+
+        tool.runImportStepFromProfile('snapshot-dummy', 'simple')
+        started, finished = events
+        self.assertTrue(IImportStepStartedEvent.providedBy(started))
+        self.assertFalse(IImportStepFinishedEvent.providedBy(started))
+        self.assertTrue(IImportStepFinishedEvent.providedBy(finished))
+        self.assertEqual(finished.step_id, 'simple')
+        self.assertIs(finished.tool, tool)
+        self.assertIs(finished.context, started.context)
+        self.assertEqual(finished.message, 'Uppercased title')
+        self.assertIsNone(finished.exception)
+        self.assertGreaterEqual(finished.seconds, 0)
+
+        del events[:]
+        self.assertRaises(ValueError, tool.runImportStepFromProfile,
+                          'snapshot-dummy', 'failing')
+        started, finished = events
+        self.assertEqual(finished.step_id, 'failing')
+        self.assertIsInstance(finished.exception, ValueError)
+        self.assertIsNone(finished.message)
+
+    def test_runExportStep_step_events(self):
+        from ..interfaces import IExportStepFinishedEvent
+        from ..interfaces import IExportStepStartedEvent
+
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        tool._export_registry.registerStep('properties',
+                                           _exportPropertiesINI)
+        events = self._recordStepEvents(IExportStepStartedEvent,
+                                        IExportStepFinishedEvent)
+
+        tool.runExportStep('properties')
+        started, finished = events
+        self.assertTrue(IExportStepStartedEvent.providedBy(started))
+        self.assertEqual(finished.step_id, 'properties')
+        self.assertEqual(finished.message, 'Exported properties')
+        self.assertIsNone(finished.exception)
+
+        # Snapshots run the export steps as well.
+        del events[:]
+        tool.createSnapshot('default')
+        self.assertIn('properties', [e.step_id for e in events])
+
+    def test_runAllExportSteps_cprofile(self):
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        tool._export_registry.registerStep('properties',
+                                           _exportPropertiesINI)
+
+        result = tool.runAllExportSteps(cprofile=True)
+        self.assertIn('properties', result['pstats'])
+        self.assertTrue(result['messages']['properties'].startswith(
+            'Exported properties\n'))
+        self.assertIn('_exportPropertiesINI',
+                      result['messages']['properties'])
+
+    def test_runAllExportSteps_trace_memory(self):
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        tool._export_registry.registerStep('properties',
+                                           _exportPropertiesINI)
+
+        result = tool.runAllExportSteps(trace_memory=True)
+        self.assertIn('properties', result['memory'])
+        self.assertIn('\nMemory: ', result['messages']['properties'])
+
+    def test_getStatistics(self):
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        tool._exclude_global_steps = True
+        tool.getImportStepRegistry().registerStep(
+            'simple', '1', _uppercaseSiteTitle)
+        tool.getImportStepRegistry().registerStep(
+            'failing', '1', _raiseValueError)
+        tool._export_registry.registerStep('properties',
+                                           _exportPropertiesINI)
+
+        tool.resetStatistics()
+        statistics = tool.getStatistics()
+        self.assertEqual(statistics['imports'], 0)
+        self.assertEqual(statistics['steps'], {'import': {}, 'export': {}})
+        self.assertIsNone(statistics['caches']['versions']['ratio'])
+
+        tool.runImportStepFromProfile('snapshot-dummy', 'simple')
+        self.assertRaises(ValueError, tool.runImportStepFromProfile,
+                          'snapshot-dummy', 'failing')
+        tool.runAllExportSteps()
+        tool.createSnapshot('default')
+        tool.compareConfigurations(tool._getImportContext('snapshot-default'),
+                                   tool._getImportContext('snapshot-default'))
+        tool.runImportStepFromProfile('snapshot-default', 'simple')
+
+        statistics = tool.getStatistics()
+        self.assertEqual(statistics['imports'], 3)
+        self.assertEqual(statistics['exports'], 1)
+        self.assertEqual(statistics['snapshots'], 1)
+        self.assertEqual(statistics['diffs'], 1)
+        self.assertEqual(statistics['import_steps'], 3)
+        self.assertEqual(statistics['export_steps'], 2)
+        self.assertEqual(statistics['failed_steps'], 1)
+        self.assertEqual(statistics['steps']['import']['simple']['runs'], 2)
+        self.assertEqual(statistics['import_seconds'],
+                         sum(info['seconds'] for info
+                             in statistics['steps']['import'].values()))
+        self.assertGreater(statistics['files_read'], 0)
+        self.assertGreater(statistics['bytes_read'], 0)
+        self.assertEqual(sorted(statistics['caches']),
+                         ['registry', 'versions'])
+
+        tool.resetStatistics()
+        statistics = tool.getStatistics()
+        self.assertEqual(statistics['imports'], 0)
+        self.assertEqual(statistics['files_read'], 0)
+        self.assertEqual(statistics['caches']['registry']['hits'], 0)
+
     def test_runAllExportSteps_empty(self):
         site = self._makeSite()
         site.setup_tool = self._makeOne('setup_tool')
@@ -1220,6 +1801,9 @@ class SetupToolTests(FilesystemTestBase, TarballTester, ConformsToISetupTool):
         self.assertEqual(info['id'], 'profile-Foo:foo')
         self.assertEqual(info['title'], 'Foo')
         self.assertEqual(info['type'], 'base')
+        # Changing the result does not change the cached infos.
+        info['title'] = 'Changed'
+        self.assertEqual(tool.listContextInfos()[0]['title'], 'Foo')
 
     def test_listContextInfos_with_registered_extension_profile(self):
         from ..interfaces import EXTENSION
@@ -1475,6 +2059,71 @@ class SetupToolTests(FilesystemTestBase, TarballTester, ConformsToISetupTool):
             1,
         )
 
+    def test_listUpgradeSteps_skips_older_steps(self):
+        from ..upgrade import _upgrade_registry
+
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+
+        for i in range(10):
+            _registerUpgradeStep(
+                UpgradeStep("Upgrade %d" % i, 'prof', str(i), str(i + 1), '',
+                            dummy_upgrade))
+        nested = UpgradeStep("Nested", 'prof', '2', '3', '', dummy_upgrade)
+        _registerNestedUpgradeStep(nested, 'outer')
+        anytime = UpgradeStep("Any", 'prof', '*', '*', '', dummy_upgrade)
+        _registerUpgradeStep(anytime)
+
+        candidates = _upgrade_registry.listCandidateSteps('prof', '8')
+        self.assertEqual(len(candidates), 3)
+        self.assertIn((anytime.id, anytime), candidates)
+        self.assertEqual(
+            [info['title'] for info in listUpgradeSteps(tool, 'prof', '8')],
+            ['Any', 'Upgrade 8', 'Upgrade 9'])
+        self.assertEqual(
+            len(_upgrade_registry.listCandidateSteps('prof', '2')), 10)
+        self.assertEqual(
+            len(_upgrade_registry.listCandidateSteps('prof', None)), 12)
+
+        # registering a step updates the index
+        _registerNestedUpgradeStep(
+            UpgradeStep("Nested 2", 'prof', '9', '10', '', dummy_upgrade),
+            'outer')
+        self.assertEqual(
+            len(_upgrade_registry.listCandidateSteps('prof', '8')), 4)
+
+        # so does adding a step to the profile steps directly
+        direct = UpgradeStep("Direct", 'prof', '9', '10', '', dummy_upgrade)
+        profile_steps = _upgrade_registry.getUpgradeStepsForProfile('prof')
+        profile_steps[direct.id] = direct
+        self.assertIn((direct.id, direct),
+                      _upgrade_registry.listCandidateSteps('prof', '8'))
+        self.assertIs(_upgrade_registry.getUpgradeStep('prof', direct.id),
+                      direct)
+
+    def test_getUpgradeStep(self):
+        from ..upgrade import _upgrade_registry
+
+        single = UpgradeStep("Single", 'prof', '1', '2', '', dummy_upgrade)
+        _registerUpgradeStep(single)
+        inner1 = UpgradeStep("Inner 1", 'prof', '2', '3', '', dummy_upgrade)
+        inner2 = UpgradeStep("Inner 2", 'prof', '2', '3', '', dummy_upgrade)
+        _registerNestedUpgradeStep(inner1, 'outer')
+        _registerNestedUpgradeStep(inner2, 'outer')
+
+        getUpgradeStep = _upgrade_registry.getUpgradeStep
+        self.assertIs(getUpgradeStep('prof', single.id), single)
+        self.assertIs(getUpgradeStep('profile-prof', inner1.id), inner1)
+        self.assertIs(getUpgradeStep('prof', inner2.id), inner2)
+        self.assertIsNone(getUpgradeStep('prof', 'outer'))
+        self.assertIsNone(getUpgradeStep('prof', 'unknown'))
+        self.assertIsNone(getUpgradeStep('other', single.id))
+
+        inner3 = UpgradeStep("Inner 3", 'prof', '3', '4', '', dummy_upgrade)
+        _registerNestedUpgradeStep(inner3, 'outer')
+        self.assertIs(getUpgradeStep('prof', inner3.id), inner3)
+
     def test_listUpgrades(self):
         site = self._makeSite()
         site.setup_tool = self._makeOne('setup_tool')
@@ -1623,6 +2272,76 @@ class SetupToolTests(FilesystemTestBase, TarballTester, ConformsToISetupTool):
             [step1],
         )
 
+    def test_listUpgrades_checkers(self):
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        profile_id = 'GenericSetup:dummy_profile'
+        calls = []
+
+        def checker(tool):
+            calls.append(tool)
+            return False
+
+        step1 = UpgradeStep("Upgrade 1", profile_id, '1.0', '1.1', '',
+                            dummy_upgrade, checker)
+        _registerUpgradeStep(step1)
+        step2 = UpgradeStep("Upgrade 2", profile_id, '1.1', '1.2', '',
+                            dummy_upgrade, checker)
+        _registerUpgradeStep(step2)
+        tool.setLastVersionForProfile(profile_id, '1.0')
+
+        # Only step1 matches the version, so only its checker runs.
+        infos = tool.listUpgrades(profile_id)
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(infos[0]['proposed'])
+        self.assertFalse(infos[1]['proposed'])
+        # 'done' is evaluated lazily, and results are cached.
+        self.assertTrue(infos[0]['done'])
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(infos[1].get('done'))
+        self.assertEqual(len(calls), 2)
+        tool.listUpgrades(profile_id)[1]['done']
+        self.assertEqual(len(calls), 2)
+
+        # Checkers can be skipped entirely.
+        tool._invalidateCheckerResults()
+        infos = tool.listUpgrades(profile_id, run_checkers=False)
+        self.assertTrue(infos[0]['proposed'])
+        self.assertFalse(infos[0]['done'])
+        self.assertFalse(infos[1]['proposed'])
+        self.assertIsNone(infos[1]['done'])
+        self.assertTrue(tool.hasUpgrades(profile_id))
+        self.assertEqual(len(calls), 2)
+
+        # A new transaction runs the checkers again.
+        transaction.abort()
+        tool.listUpgrades(profile_id)
+        self.assertEqual(len(calls), 3)
+
+        # 'done' is part of the mapping before it was read.
+        import json
+        import pickle
+
+        tool._invalidateCheckerResults()
+        info = tool.listUpgrades(profile_id)[1]
+        self.assertIn('done', info)
+        self.assertEqual(len(calls), 4)
+        self.assertIn('done', list(info))
+        self.assertEqual(len(calls), 5)
+        self.assertTrue(info.copy()['done'])
+        self.assertEqual(len(calls), 5)
+        for info in tool.listUpgrades(profile_id)[1:]:
+            self.assertIn(('done', True), list(info.items()))
+            self.assertEqual(info, dict(info))
+            self.assertTrue(dict(info)['done'])
+        info = tool.listUpgrades(profile_id)[1]
+        info['step'] = info['id']  # the step has a local checker
+        self.assertIs(pickle.loads(pickle.dumps(info))['done'], True)
+        info = tool.listUpgrades(profile_id)[1]
+        self.assertIs(json.loads(json.dumps(info, default=repr))['done'],
+                      True)
+
     def test_listProfilesWithUpgrades(self):
         site = self._makeSite()
         site.setup_tool = self._makeOne('setup_tool')
@@ -1783,6 +2502,38 @@ class SetupToolTests(FilesystemTestBase, TarballTester, ConformsToISetupTool):
         self.assertEqual(tool.hasPendingUpgrades(profile_id_1), False)
         self.assertEqual(tool.hasPendingUpgrades(profile_id_2), False)
 
+    def test_pending_upgrades_summary_cached(self):
+        from unittest import mock
+
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        profile_id = 'GenericSetup:dummy_profile'
+        _registerUpgradeStep(UpgradeStep("Upgrade 1", profile_id, '1.0',
+                                         '1.1', '', dummy_upgrade))
+        tool.setLastVersionForProfile(profile_id, '1.0')
+        self.assertEqual(tool.listProfilesWithPendingUpgrades(), [profile_id])
+
+        with mock.patch.object(tool, 'hasUpgrades') as hasUpgrades:
+            self.assertTrue(tool.hasPendingUpgrades())
+            self.assertTrue(tool.hasPendingUpgrades('profile-' + profile_id))
+            self.assertEqual(tool.listUptodateProfiles(), [])
+        self.assertFalse(hasUpgrades.called)
+
+        # changing the version invalidates the summary
+        tool.setLastVersionForProfile(profile_id, '1.1')
+        self.assertFalse(tool.hasPendingUpgrades())
+        self.assertEqual(tool.listUptodateProfiles(), [profile_id])
+
+        # so does registering a step
+        _registerUpgradeStep(UpgradeStep("Upgrade 2", profile_id, '1.1',
+                                         '1.2', '', dummy_upgrade))
+        self.assertTrue(tool.hasPendingUpgrades(profile_id))
+
+        tool.unsetLastVersionForProfile(profile_id)
+        self.assertFalse(tool.hasPendingUpgrades())
+        self.assertEqual(tool.listUptodateProfiles(), [])
+
     def test_manage_doUpgrades_no_profile_id_or_updates(self):
         site = self._makeSite()
         site.setup_tool = self._makeOne('setup_tool')
@@ -1913,6 +2664,222 @@ class SetupToolTests(FilesystemTestBase, TarballTester, ConformsToISetupTool):
         tool.upgradeProfile('foo')
         self.assertEqual(tool.getLastVersionForProfile('foo'), ('4', ))
 
+    def test_upgradeProfile_commit(self):
+        from unittest import mock
+
+        applied = []
+        progress = []
+        failing = [True]
+
+        def handler(tool):
+            progress.append(tool.getUpgradeProgress('profile-foo'))
+            applied.append(len(applied) + 1)
+
+        def failing_handler(tool):
+            if failing:
+                failing.pop()
+                raise ValueError('conflict')
+            handler(tool)
+
+        for i in range(4):
+            _registerUpgradeStep(UpgradeStep(
+                'Step %d' % i, 'foo', str(i), str(i + 1), 'DESC',
+                failing_handler if i == 2 else handler))
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        tool.setLastVersionForProfile('foo', '0')
+        self.assertIsNone(tool.getUpgradeProgress('foo'))
+
+        # Do not commit the test fixture, but keep what would be committed.
+        with mock.patch('transaction.commit') as commit, \
+                mock.patch('transaction.abort') as abort:
+            with self.assertRaises(ValueError):
+                tool.upgradeProfile('foo', commit=True)
+            self.assertEqual(commit.call_count, 2)
+            self.assertEqual(abort.call_count, 1)
+            self.assertEqual(applied, [1, 2])
+            self.assertIsNone(progress[0])
+            self.assertEqual(progress[1]['done'], 1)
+            checkpoint = tool.getUpgradeProgress('foo')
+            self.assertEqual(checkpoint['profile_id'], 'foo')
+            self.assertEqual(checkpoint['title'], 'Step 1')
+            self.assertEqual(checkpoint['done'], 2)
+            self.assertEqual(checkpoint['total'], 4)
+            self.assertEqual(tool.getLastVersionForProfile('foo'), ('0',))
+
+            # The second run resumes after the checkpoint.
+            tool.upgradeProfile('foo', commit=True)
+            self.assertEqual(commit.call_count, 5)
+        self.assertEqual(applied, [1, 2, 3, 4])
+        self.assertEqual(progress[2]['title'], 'Step 1')
+        self.assertIsNone(tool.getUpgradeProgress('foo'))
+        self.assertEqual(tool.getLastVersionForProfile('foo'), ('4',))
+
+    def test_upgradeProfile_commit_unknown_checkpoint(self):
+        from unittest import mock
+
+        applied = []
+        for i in range(2):
+            _registerUpgradeStep(UpgradeStep(
+                'Step %d' % i, 'foo', str(i), str(i + 1), 'DESC',
+                lambda tool, i=i: applied.append(i)))
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        tool.setLastVersionForProfile('foo', '0')
+        tool._setUpgradeCheckpoint('foo', {
+            'step': 'nonesuch', 'title': 'Gone', 'done': 1, 'total': 3,
+            'time': 0})
+
+        with mock.patch('transaction.commit') as commit, \
+                mock.patch('transaction.abort'):
+            # Steps are not run again without an explicit reset.
+            with self.assertRaises(ValueError):
+                tool.upgradeProfile('profile-foo', commit=True)
+            self.assertEqual(applied, [])
+            self.assertEqual(commit.call_count, 0)
+            self.assertEqual(tool.getUpgradeProgress('foo')['title'], 'Gone')
+
+            tool.resetUpgradeProgress('profile-foo')
+            self.assertIsNone(tool.getUpgradeProgress('foo'))
+            tool.upgradeProfile('foo', commit=True)
+        self.assertEqual(applied, [0, 1])
+        self.assertEqual(tool.getLastVersionForProfile('foo'), ('2',))
+
+    def test_upgradeProfile_reuses_import_context(self):
+        from unittest import mock
+
+        from ..tool import IMPORT_STEPS_XML
+
+        self._makeFile(IMPORT_STEPS_XML, _SINGLE_IMPORT_XML)
+        profile_registry.registerProfile('foo', 'Foo', '', self._PROFILE_PATH)
+        for i in range(3):
+            _registerUpgradeStep(UpgradeDepends(
+                'Step %d' % i, 'other:foo', str(i), str(i + 1), '',
+                import_steps=['one']))
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        tool.setLastVersionForProfile('other:foo', '0')
+
+        with mock.patch.object(
+                tool, '_getImportContext',
+                wraps=tool._getImportContext) as getImportContext, \
+                mock.patch.object(
+                    tool, 'applyContext',
+                    wraps=tool.applyContext) as applyContext:
+            tool.upgradeProfile('other:foo')
+        self.assertEqual(getImportContext.call_count, 1)
+        self.assertEqual(applyContext.call_count, 1)
+        self.assertEqual(tool.getLastVersionForProfile('other:foo'), ('3',))
+        self.assertIsNone(_getRunState(tool, 'upgrade_run'))
+
+        # Outside of upgrades, contexts are not reused.
+        with mock.patch.object(
+                tool, '_getImportContext',
+                wraps=tool._getImportContext) as getImportContext:
+            tool.runImportStepFromProfile('profile-other:foo', 'one')
+            tool.runImportStepFromProfile('profile-other:foo', 'one')
+        self.assertEqual(getImportContext.call_count, 2)
+
+    def test_upgradeProfile_reapplies_after_other_context(self):
+        from unittest import mock
+
+        from ..tool import IMPORT_STEPS_XML
+
+        self._makeFile(IMPORT_STEPS_XML, _SINGLE_IMPORT_XML)
+        _makeTestFile(IMPORT_STEPS_XML, self._PROFILE_PATH2,
+                      _SINGLE_IMPORT_XML.replace(ONE_FUNC_NAME,
+                                                 TWO_FUNC_NAME))
+        profile_registry.registerProfile('foo', 'Foo', '', self._PROFILE_PATH)
+        profile_registry.registerProfile('bar', 'Bar', '', self._PROFILE_PATH2)
+        _registerUpgradeStep(UpgradeDepends(
+            'Step 0', 'other:foo', '0', '1', '', import_steps=['one']))
+        _registerUpgradeStep(UpgradeStep(
+            'Step 1', 'other:foo', '1', '2', '',
+            lambda tool: tool.applyContextById('profile-other:bar')))
+        _registerUpgradeStep(UpgradeDepends(
+            'Step 2', 'other:foo', '2', '3', '', import_steps=['one']))
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        tool.setLastVersionForProfile('other:foo', '0')
+
+        with mock.patch.object(
+                tool, 'applyContext',
+                wraps=tool.applyContext) as applyContext:
+            tool.upgradeProfile('other:foo')
+        # 'other:bar' registered its own step 'one' in between, so the
+        # steps of 'other:foo' are applied again.
+        self.assertEqual(applyContext.call_count, 3)
+        self.assertEqual(tool.getImportStepRegistry().getStepMetadata(
+            'one')['handler'], ONE_FUNC_NAME)
+
+    def test_upgradeProfile_run_state_survives_ghosting(self):
+        from ..tool import IMPORT_STEPS_XML
+
+        self._makeFile(IMPORT_STEPS_XML, _SINGLE_IMPORT_XML)
+        profile_registry.registerProfile('foo', 'Foo', '', self._PROFILE_PATH)
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        states = []
+
+        def _ghost(tool):
+            # Drop the volatile attributes, as deactivating the tool would.
+            for name in list(aq_base(tool).__dict__):
+                if name.startswith('_v_'):
+                    delattr(aq_base(tool), name)
+            states.append(_getRunState(tool, 'upgrade_run'))
+
+        _registerUpgradeStep(UpgradeStep(
+            'Step', 'other:foo', '0', '1', '', _ghost))
+        tool.setLastVersionForProfile('other:foo', '0')
+        tool.upgradeProfile('other:foo')
+        self.assertEqual(len(states), 1)
+        self.assertIsNotNone(states[0])
+        self.assertIsNone(_getRunState(tool, 'upgrade_run'))
+
+    def test_upgradeAllProfiles(self):
+        from unittest import mock
+
+        applied = []
+        dependencies = {
+            'a': ('profile-b',),
+            'b': ('profile-x',),
+            'x': ('profile-c',),
+            'c': (),
+            'd': ('profile-d',),
+        }
+        for profile_id in ('a', 'b', 'c', 'd'):
+            _registerUpgradeStep(UpgradeStep(
+                'Step', profile_id, '1', '2', 'DESC',
+                lambda tool, id=profile_id: applied.append(id)))
+        site = self._makeSite()
+        site.setup_tool = self._makeOne('setup_tool')
+        tool = site.setup_tool
+        for profile_id in ('a', 'b', 'c'):
+            tool.setLastVersionForProfile(profile_id, '1')
+
+        with mock.patch.object(
+                tool, 'getDependenciesForProfile',
+                side_effect=lambda profile_id, ignore_broken: (
+                    dependencies[profile_id])):
+            report = tool.upgradeAllProfiles()
+        self.assertEqual(applied, ['c', 'b', 'a'])
+        self.assertEqual([info['profile_id'] for info in report],
+                         ['c', 'b', 'a'])
+        self.assertEqual(report[0]['source'], ('1',))
+        self.assertEqual(report[0]['dest'], ('2',))
+        self.assertGreaterEqual(report[0]['seconds'], 0)
+        self.assertFalse(tool.hasPendingUpgrades())
+        self.assertEqual(tool.upgradeAllProfiles(), [])
+
+        # Dependency cycles do not break the sorting.
+        self.assertEqual(
+            sorted(tool._sortProfilesByDependencies(['a', 'd'])), ['a', 'd'])
+
     def test_listExportSteps(self):
         site = self._makeSite()
         site.setup_tool = self._makeOne('setup_tool')
@@ -2173,6 +3140,53 @@ def _purgeIfRequired(context):
     return purged and 'Purged' or 'Unpurged'
 
 
+def _raiseValueError(context):
+    raise ValueError('step failed')
+
+
+def _runInnerStep(context):
+    context.getSetupTool().runImportStepFromProfile(
+        'snapshot-testing', 'simple', run_dependencies=False)
+    return 'Ran inner step'
+
+
+def _runInnerAllocateStep(context):
+    context.getSite().allocated = None
+    context.getSetupTool().runImportStepFromProfile(
+        'snapshot-testing', 'allocate', run_dependencies=False)
+    return 'Ran inner step'
+
+
+def _noopStep(context):
+    pass
+
+
+def _reportProfilePath(context):
+    return context._profile_path
+
+
+def _readChildTitle(context):
+    context.getSite().child.title
+
+
+_overlap = {}
+
+
+def _waitForOverlap(context):
+    _overlap['waiting'].set()
+    _overlap['go'].wait(10)
+
+
+def _finishOverlapping(context):
+    _overlap['go'].set()
+    _overlap['thread'].join(10)
+
+
+def _allocateMemory(context):
+    context.getSite().allocated = [str(i) for i in range(10000)]
+    return 'Allocated memory'
+
+
 def _exportPropertiesINI(context):
 
     site = context.getSite()
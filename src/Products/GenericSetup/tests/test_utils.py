@@ -476,6 +476,17 @@ class UtilsTests(unittest.TestCase):
         self.assertEqual(vfp('unknown'), 'unknown')
         self.assertEqual(vfp(None), 'None')
 
+    def test__getTransferCounts_without_registered_objects(self):
+
+        from ..utils import _getTransferCounts
+
+        class DummyConnection:
+            def getTransferCounts(self):
+                return 3, 2
+
+        self.assertEqual(_getTransferCounts(None), (0, 0))
+        self.assertEqual(_getTransferCounts(DummyConnection()), (3, 2))
+
 
 class PropertyManagerHelpersTests(unittest.TestCase):
 
@@ -989,6 +1000,118 @@ class ObjectManagerHelpersTests(ZopeTestCase):
         self.assertIn('future', obj.objectIds())
 
 
+class ImportConfiguratorBaseTests(unittest.TestCase):
+
+    def _makeClass(self):
+        from ..utils import CONVERTER
+        from ..utils import DEFAULT
+        from ..utils import KEY
+        from ..utils import ImportConfiguratorBase
+
+        class _Configurator(ImportConfiguratorBase):
+
+            calls = 0
+
+            def _getImportMapping(self):
+                self.__class__.calls += 1
+                return {
+                    'root': {'flag': {CONVERTER: self._convertToBoolean},
+                             'item': {KEY: 'items', DEFAULT: ()}},
+                    'item': {'name': {KEY: 'id'},
+                             'item': {KEY: 'items', DEFAULT: ()},
+                             '#text': {KEY: 'value', DEFAULT: ''}}}
+
+        return _Configurator
+
+    def test_parseXML(self):
+        klass = self._makeClass()
+        parsed = klass(None).parseXML(
+            '<root flag="True"><!-- comment -->'
+            '<item name="a"> text</item>'
+            '<item name="b"><item name="c"/></item></root>')
+        self.assertEqual(parsed, {
+            'flag': True,
+            'items': ({'id': 'a', 'value': 'text', 'items': ()},
+                      {'id': 'b', 'value': '',
+                       'items': ({'id': 'c', 'value': '', 'items': ()},)})})
+
+    def test_mapping_compiled_once_per_class(self):
+        klass = self._makeClass()
+        klass(None).parseXML('<root/>')
+        klass(None).parseXML('<root><item name="a"/></root>')
+        self.assertEqual(klass.calls, 1)
+
+    def test_mapping_not_cached(self):
+        klass = self._makeClass()
+        klass._cache_import_mapping = False
+        klass(None).parseXML('<root/>')
+        klass(None).parseXML('<root/>')
+        self.assertEqual(klass.calls, 2)
+
+    def test_deeply_nested(self):
+        import sys
+        depth = sys.getrecursionlimit() + 10
+        xml = '<root>%s%s</root>' % ('<item>' * depth, '</item>' * depth)
+        parsed = self._makeClass()(None).parseXML(xml)
+        for _i in range(depth):
+            parsed, = parsed['items']
+        self.assertEqual(parsed['items'], ())
+
+    def test_unknown_node(self):
+        klass = self._makeClass()
+        self.assertRaises(ValueError, klass(None).parseXML, '<unknown/>')
+
+
+class IterateInBatchesTests(unittest.TestCase):
+
+    def _callFUT(self, *args, **kw):
+        from ..utils import iterateInBatches
+        return iterateInBatches(*args, **kw)
+
+    def _makeItems(self, count, jar):
+        from unittest import mock
+        return [mock.Mock(_p_jar=jar, id=i) for i in range(count)]
+
+    def test_batches(self):
+        from unittest import mock
+
+        jar = mock.Mock()
+        items = self._makeItems(5, jar)
+        logger = mock.Mock()
+        with mock.patch('transaction.savepoint') as savepoint:
+            result = list(self._callFUT(items, batch_size=2, logger=logger))
+        self.assertEqual(result, items)
+        self.assertEqual(savepoint.call_count, 3)
+        savepoint.assert_called_with(optimistic=True)
+        self.assertEqual(jar.cacheGC.call_count, 3)
+        self.assertFalse(jar.cacheMinimize.called)
+        self.assertEqual(logger.info.call_args_list[-1],
+                         mock.call('Processed %d of %d %s.', 5, 5, 'objects'))
+
+    def test_getter_and_minimize(self):
+        from unittest import mock
+
+        jar = mock.Mock()
+        objs = self._makeItems(4, jar)
+        brains = [mock.Mock(getObject=mock.Mock(return_value=obj))
+                  for obj in objs]
+        logger = mock.Mock()
+        with mock.patch('transaction.savepoint') as savepoint:
+            result = list(self._callFUT(
+                iter(brains), batch_size=2, logger=logger, label='brains',
+                getter=lambda brain: brain.getObject(), minimize=True))
+        self.assertEqual(result, objs)
+        self.assertEqual(savepoint.call_count, 2)
+        self.assertEqual(jar.cacheMinimize.call_count, 2)
+        # the total of an iterator is unknown
+        self.assertEqual(logger.info.call_args_list[-1],
+                         mock.call('Processed %d %s.', 4, 'brains'))
+
+    def test_invalid_batch_size(self):
+        with self.assertRaises(ValueError):
+            list(self._callFUT([], batch_size=0))
+
+
 class PrettyDocumentTests(unittest.TestCase):
 
     def test_attr_quoting(self):
@@ -1062,5 +1185,7 @@ def test_suite():
         loader.loadTestsFromTestCase(PropertyManagerHelpersNonPMContextTests),
         loader.loadTestsFromTestCase(MarkerInterfaceHelpersTests),
         loader.loadTestsFromTestCase(ObjectManagerHelpersTests),
+        loader.loadTestsFromTestCase(ImportConfiguratorBaseTests),
+        loader.loadTestsFromTestCase(IterateInBatchesTests),
         loader.loadTestsFromTestCase(PrettyDocumentTests),
     ))
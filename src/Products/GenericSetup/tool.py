@@ -13,13 +13,24 @@
 """ Classes:  SetupTool
 """
 
+import contextlib
+import cProfile
+import io
+import json
 import logging
+import marshal
 import os
+import pstats
+import threading
 import time
+import tracemalloc
 import types
+import uuid
 from html import escape
 from operator import itemgetter
 
+import transaction
+from AccessControl import allow_type
 from AccessControl.class_init import InitializeClass
 from AccessControl.Permissions import view
 from AccessControl.Permissions import view_management_screens
@@ -37,13 +48,29 @@ from .context import SnapshotExportContext
 from .context import SnapshotImportContext
 from .context import TarballExportContext
 from .context import TarballImportContext
+from .counters import getCounters
+from .counters import incrementCounter
+from .counters import recordStep
+from .counters import resetCounters
+from .counters import suspendCounters
 from .differ import ConfigDiff
 from .events import BeforeProfileImportEvent
+from .events import ExportStepFinishedEvent
+from .events import ExportStepStartedEvent
+from .events import ImportStepFinishedEvent
+from .events import ImportStepStartedEvent
 from .events import ProfileImportedEvent
 from .interfaces import BASE
 from .interfaces import EXTENSION
 from .interfaces import SKIPPED_FILES
 from .interfaces import ISetupTool
+from .jobs import JOB_FAILED
+from .jobs import JOB_FINISHED
+from .jobs import JOB_QUEUED
+from .jobs import JOB_RUNNING
+from .jobs import getWorker
+from .jobs import isJobLost
+from .jobs import startJob
 from .permissions import ManagePortal
 from .registry import ExportStepRegistry
 from .registry import ImportStepRegistry
@@ -51,12 +78,23 @@ from .registry import ToolsetRegistry
 from .registry import _export_step_registry
 from .registry import _import_step_registry
 from .registry import _profile_registry
+from .registry import _sameGeneration
+from .registry import getStorageCacheStatistics
+from .registry import resetStorageCacheStatistics
 from .upgrade import _upgrade_registry
+from .upgrade import getVersionCacheStatistics
 from .upgrade import listProfilesWithUpgrades
 from .upgrade import listUpgradeSteps
+from .upgrade import resetVersionCacheStatistics
 from .utils import _computeTopologicalSort
+from .utils import _endBatch
+from .utils import _getPeakMemory
 from .utils import _getProductPath
+from .utils import _getRunState
+from .utils import _getTransferCounts
 from .utils import _resolveDottedName
+from .utils import _run_state
+from .utils import _setRunState
 from .utils import _version_for_print
 from .utils import _wwwdir
 
@@ -193,6 +231,19 @@ class SetupTool(Folder):
     # instances.
     _profile_upgrade_versions = {}
 
+    # Mapping from profile id to the checkpoint of an upgrade which commits
+    # after each step.  Replaced by a PersistentMapping on first use.
+    _upgrade_checkpoints = {}
+
+    # Mapping from job id to the record of a background import or upgrade.
+    # Replaced by a PersistentMapping on first use.
+    _jobs = {}
+
+    # Mapping from profile id to the seconds each of its import steps took
+    # when the profile was last imported.  Replaced by a PersistentMapping
+    # on first use.
+    _import_timings = {}
+
     _exclude_global_steps = False
 
     security = ClassSecurityInfo()
@@ -250,6 +301,10 @@ class SetupTool(Folder):
     def applyContext(self, context, encoding=None):
         self._updateImportStepsRegistry(context, encoding)
         self._updateExportStepsRegistry(context, encoding)
+        run = _getRunState(self, 'upgrade_run')
+        if run is not None:
+            run['applied'] = context
+            run['sorted_steps'] = None
 
     @security.protected(ManagePortal)
     def getImportStepRegistry(self):
@@ -338,9 +393,7 @@ class SetupTool(Folder):
                                  run_dependencies=True, purge_old=None):
         """ See ISetupTool.
         """
-        context = self._getImportContext(profile_id, purge_old)
-
-        self.applyContext(context)
+        context = self._getAppliedImportContext(profile_id, purge_old)
 
         info = self.getImportStepMetadata(step_id)
 
@@ -361,22 +414,84 @@ class SetupTool(Folder):
                     steps.append(dependency)
         steps.append(step_id)
 
-        full_import = (set(steps) == set(self.getSortedImportSteps()))
+        full_import = (set(steps) == set(self._getRunSortedImportSteps()))
+        incrementCounter('imports')
         event.notify(
             BeforeProfileImportEvent(self, profile_id, steps, full_import))
 
+        objects = {}
         for step in steps:
-            message = self._doRunImportStep(step, context)
-            messages[step] = message or ''
+            message = self._doRunImportStep(step, context, objects)
+            messages[step] = '\n'.join(
+                [i for i in [message] if i] + _objectsMessage(objects, step))
 
         message_list = [i for i in [message] if i]
         message_list.extend(['%s: %s' % x[1:] for x in context.listNotes()])
+        message_list.extend(_objectsMessage(objects, step_id))
         messages[step_id] = '\n'.join(message_list)
 
         event.notify(
             ProfileImportedEvent(self, profile_id, steps, full_import))
 
-        return {'steps': steps, 'messages': messages}
+        result = {'steps': steps, 'messages': messages}
+        if objects:
+            result['objects'] = objects
+        return result
+
+    @security.protected(ManagePortal)
+    def runImportStepsFromProfile(self, profile_id, step_ids,
+                                  run_dependencies=True, purge_old=None):
+        """ See ISetupTool.
+        """
+        context = self._getAppliedImportContext(profile_id, purge_old)
+
+        steps = []
+        for step_id in step_ids:
+            info = self.getImportStepMetadata(step_id)
+            if info is None:
+                generic_logger.error(
+                    "No such import step: '%s' Maybe you meant one of %s",
+                    step_id, str(self.listImportSteps()))
+                raise ValueError('No such import step: %s' % step_id)
+            if step_id not in steps:
+                steps.append(step_id)
+        if run_dependencies:
+            # Add the dependencies of the dependencies, too.
+            pending = list(steps)
+            while pending:
+                info = self.getImportStepMetadata(pending.pop()) or {}
+                for dependency in info.get('dependencies', ()):
+                    if dependency not in steps:
+                        steps.append(dependency)
+                        pending.append(dependency)
+
+        sorted_steps = self._getRunSortedImportSteps()
+        order = {step: num for num, step in enumerate(sorted_steps)}
+        steps.sort(key=lambda step: order.get(step, len(order)))
+
+        full_import = (set(steps) == set(sorted_steps))
+        incrementCounter('imports')
+        event.notify(
+            BeforeProfileImportEvent(self, profile_id, steps, full_import))
+
+        messages = {}
+        objects = {}
+        for step in steps:
+            message = self._doRunImportStep(step, context, objects)
+            message_list = [i for i in [message] if i]
+            message_list.extend(['%s: %s' % x[1:]
+                                 for x in context.listNotes()])
+            message_list.extend(_objectsMessage(objects, step))
+            messages[step] = '\n'.join(message_list)
+            context.clearNotes()
+
+        event.notify(
+            ProfileImportedEvent(self, profile_id, steps, full_import))
+
+        result = {'steps': steps, 'messages': messages}
+        if objects:
+            result['objects'] = objects
+        return result
 
     @security.protected(ManagePortal)
     def runAllImportStepsFromProfile(self,
@@ -385,27 +500,134 @@ class SetupTool(Folder):
                                      ignore_dependencies=False,
                                      archive=None,
                                      blacklisted_steps=None,
-                                     dependency_strategy=None):
+                                     dependency_strategy=None,
+                                     release_memory=False,
+                                     cprofile=False,
+                                     trace_memory=False):
         """ See ISetupTool.
         """
         __traceback_info__ = profile_id
 
-        result = self._runImportStepsFromContext(
-            purge_old=purge_old,
-            profile_id=profile_id,
-            archive=archive,
-            ignore_dependencies=ignore_dependencies,
-            blacklisted_steps=blacklisted_steps,
-            dependency_strategy=dependency_strategy)
+        with self._profiledSteps(cprofile) as step_profiles:
+            result = self._runImportStepsFromContext(
+                purge_old=purge_old,
+                profile_id=profile_id,
+                archive=archive,
+                ignore_dependencies=ignore_dependencies,
+                blacklisted_steps=blacklisted_steps,
+                dependency_strategy=dependency_strategy,
+                release_memory=release_memory,
+                trace_memory=trace_memory)
+        if step_profiles is not None:
+            self._addStepProfiles(result, step_profiles)
         if profile_id is None:
             prefix = 'import-all-from-tar'
         else:
             prefix = 'import-all-%s' % profile_id.replace(':', '_')
-        name = self._mangleTimestampName(prefix, 'log')
+        name = self._mangleTimestampName(prefix)
+        self._createReport(name + '.log', result['steps'], result['messages'])
+        for step_id, data in result.get('pstats', {}).items():
+            self._addReportFile('%s-%s.pstats' % (name, step_id), data,
+                                'application/octet-stream')
+
+        return result
+
+    @security.protected(ManagePortal)
+    def runAllImportStepsFromProfiles(self,
+                                      profile_ids,
+                                      purge_old=None,
+                                      ignore_dependencies=False,
+                                      blacklisted_steps=None,
+                                      dependency_strategy=None,
+                                      release_memory=False,
+                                      trace_memory=False):
+        """ See ISetupTool.
+        """
+        __traceback_info__ = profile_ids
+
+        result = self._runImportStepsFromContext(
+            purge_old=purge_old,
+            profile_ids=list(profile_ids),
+            ignore_dependencies=ignore_dependencies,
+            blacklisted_steps=blacklisted_steps,
+            dependency_strategy=dependency_strategy,
+            release_memory=release_memory,
+            trace_memory=trace_memory)
+        name = self._mangleTimestampName('import-all-profiles', 'log')
         self._createReport(name, result['steps'], result['messages'])
 
         return result
 
+    @security.protected(ManagePortal)
+    def planImport(self,
+                   profile_id,
+                   ignore_dependencies=False,
+                   blacklisted_steps=None,
+                   dependency_strategy=None,
+                   purge_old=None):
+        """ See ISetupTool.
+        """
+        __traceback_info__ = profile_id
+
+        dependency_strategy, ignore_dependencies = (
+            self._getDependencyStrategy(dependency_strategy,
+                                        ignore_dependencies))
+        chain = self._getImportChain([profile_id], ignore_dependencies)
+
+        # Step registries of applied profiles are only merged into this
+        # copy, so planning leaves the tool unchanged.
+        step_infos = {step: self.getImportStepMetadata(step)
+                      for step in self.getSortedImportSteps()}
+        profiles = []
+        purged = False
+        for chain_id in chain:
+            action = self._getProfileImportAction(
+                chain_id, _profileKey(chain_id) == _profileKey(profile_id),
+                dependency_strategy, purged)
+            info = {'profile_id': chain_id,
+                    'action': action,
+                    'steps': [],
+                    'files': [],
+                    'upgrades': [],
+                    'seconds': 0.0}
+            if action == 'upgrade':
+                info['upgrades'] = [
+                    step.title for step in
+                    self.listUpgrades(chain_id, simple=True)]
+            elif action != 'skip':
+                try:
+                    profile_type = self.getProfileInfo(chain_id).get('type')
+                except KeyError:
+                    # this will be a snapshot profile
+                    profile_type = None
+                if profile_type == BASE and (purge_old is None or purge_old):
+                    # The import purges all profile upgrade versions.
+                    purged = True
+                context = self._getImportContext(chain_id)
+                # Reading is not importing: keep it out of the counters.
+                with suspendCounters():
+                    xml = context.readDataFile(IMPORT_STEPS_XML)
+                if xml is not None:
+                    for step_info in self._import_registry.parseXML(xml):
+                        step_info['dependencies'] = tuple(
+                            step_info.get('dependencies', ()))
+                        step_infos[step_info['id']] = step_info
+                recorded = self._import_timings.get(_profileKey(chain_id),
+                                                    {})
+                for step in _computeTopologicalSort(step_infos.values()):
+                    if blacklisted_steps and step in blacklisted_steps:
+                        continue
+                    seconds = recorded.get(step)
+                    info['steps'].append({'id': step, 'seconds': seconds})
+                    info['seconds'] += seconds or 0.0
+                info['files'] = _listContextFiles(context)
+            profiles.append(info)
+
+        return {'profile_id': profile_id,
+                'dependency_strategy': dependency_strategy,
+                'profiles': profiles,
+                'seconds': sum(info['seconds'] for info in profiles)}
+
     @security.protected(ManagePortal)
     def runExportStep(self, step_id):
         """ See ISetupTool.
@@ -413,15 +635,21 @@ class SetupTool(Folder):
         return self._doRunExportSteps([step_id])
 
     @security.protected(ManagePortal)
-    def runAllExportSteps(self):
+    def runAllExportSteps(self, cprofile=False, trace_memory=False):
         """ See ISetupTool.
         """
-        return self._doRunExportSteps(self.listExportSteps())
+        with self._profiledSteps(cprofile) as step_profiles:
+            result = self._doRunExportSteps(self.listExportSteps(),
+                                            trace_memory=trace_memory)
+        if step_profiles is not None:
+            self._addStepProfiles(result, step_profiles)
+        return result
 
     @security.protected(ManagePortal)
     def createSnapshot(self, snapshot_id):
         """ See ISetupTool.
         """
+        incrementCounter('snapshots')
         context = SnapshotExportContext(self, snapshot_id)
         messages = {}
         steps = self.listExportSteps()
@@ -435,7 +663,8 @@ class SetupTool(Folder):
                 logger.error('Step %s has an invalid handler' % step_id)
                 continue
 
-            messages[step_id] = handler(context)
+            messages[step_id] = self._doRunStepHandler(
+                handler, step_id, context, 'export')
 
         return {'steps': steps,
                 'messages': messages,
@@ -451,6 +680,7 @@ class SetupTool(Folder):
                               skip=SKIPPED_FILES):
         """ See ISetupTool.
         """
+        incrementCounter('diffs')
         differ = ConfigDiff(lhs_context,
                             rhs_context,
                             missing_as_empty,
@@ -566,15 +796,11 @@ class SetupTool(Folder):
         else:
             if context_id is None:
                 context_id = self.getBaselineContextID()
-            steps_run = []
-            for step_id in ids:
-                result = self.runImportStepFromProfile(context_id,
-                                                       step_id,
-                                                       run_dependencies)
-                steps_run.extend(result['steps'])
-                messages.update(result['messages'])
+            result = self.runImportStepsFromProfile(context_id, ids,
+                                                    run_dependencies)
+            messages.update(result['messages'])
 
-            summary = 'Steps run: %s' % ', '.join(steps_run)
+            summary = 'Steps run: %s' % ', '.join(result['steps'])
 
             name = self._mangleTimestampName('import-selected', 'log')
             self._createReport(name, result['steps'], result['messages'])
@@ -583,11 +809,16 @@ class SetupTool(Folder):
                                        messages=messages)
 
     @security.protected(ManagePortal)
-    def manage_importAllSteps(self, context_id=None, dependency_strategy=None):
+    def manage_importAllSteps(self, context_id=None, dependency_strategy=None,
+                              background=False):
         """ Import all steps.
         """
         if context_id is None:
             context_id = self.getBaselineContextID()
+        if background:
+            job_id = self.queueImport(context_id, dependency_strategy)
+            return self.manage_fullImport(
+                manage_tabs_message='Queued job %s.' % job_id)
         result = self.runAllImportStepsFromProfile(
             context_id, purge_old=None,
             dependency_strategy=dependency_strategy)
@@ -609,12 +840,8 @@ class SetupTool(Folder):
         else:
             message = 'Imported profiles: %s' % ', '.join(profile_ids)
 
-            for profile_id in profile_ids:
-
-                result = self.runAllImportStepsFromProfile(profile_id)
-
-                for k, v in result['messages'].items():
-                    detail[f'{profile_id}:{k}'] = v
+            result = self.runAllImportStepsFromProfiles(profile_ids)
+            detail.update(result['messages'])
 
             return self.manage_fullImport(manage_tabs_message=message,
                                           messages=detail)
@@ -719,28 +946,15 @@ class SetupTool(Folder):
           'path' -- path to the profile within its product
 
           'product' -- name of the registering product
+
+        o The mappings are read-only.
         """
-        base = []
-        ext = []
-        for info in _profile_registry.listProfileInfo(for_):
-            if info.get('type', BASE) == BASE:
-                base.append(info)
-            else:
-                ext.append(info)
-        ext.sort(key=lambda x: x['id'])
-        return base + ext
+        return list(_profile_registry.listOrderedProfileInfo(for_))
 
     @security.protected(ManagePortal)
     def listContextInfos(self, order_by='sortable_title'):
         """ List registered profiles and snapshots.
         """
-        def readableType(x):
-            if x is BASE:
-                return 'base'
-            elif x is EXTENSION:
-                return 'extension'
-            return 'unknown'
-
         s_infos = [{
             'id': 'snapshot-%s' % info['id'],
             'sortable_id': info['id'].lower(),
@@ -749,16 +963,12 @@ class SetupTool(Folder):
             'type': 'snapshot',
         } for info in self.listSnapshotInfo()]
         s_infos.sort(key=itemgetter(order_by))
-        p_infos = [{
-            'id': 'profile-%s' % info['id'],
-            'sortable_id': info['id'].lower(),
-            'title': info['title'],
-            'sortable_title': info['title'].lower(),
-            'type': readableType(info['type']),
-        } for info in self.listProfileInfo()]
-        p_infos.sort(key=itemgetter(order_by))
+        # Profile infos only change with the registered profiles.  The
+        # cached mappings are copied, as callers may change them.
+        p_infos = _profile_registry.queryIndex(
+            'listContextInfos', (order_by,), _listProfileContextInfos)
 
-        return tuple(s_infos + p_infos)
+        return tuple(s_infos) + tuple(dict(info) for info in p_infos)
 
     @security.protected(ManagePortal)
     def getProfileImportDate(self, profile_id):
@@ -887,6 +1097,7 @@ class SetupTool(Folder):
             self._profile_upgrade_versions = PersistentMapping(
                 self._profile_upgrade_versions)
         self._profile_upgrade_versions[profile_id] = version
+        self._invalidatePendingUpgrades()
 
     @security.protected(ManagePortal)
     def unsetLastVersionForProfile(self, profile_id):
@@ -902,6 +1113,7 @@ class SetupTool(Folder):
             self._profile_upgrade_versions = PersistentMapping(
                 self._profile_upgrade_versions)
         del self._profile_upgrade_versions[profile_id]
+        self._invalidatePendingUpgrades()
 
     @security.protected(ManagePortal)
     def getVersionForProfile(self, profile_id):
@@ -915,6 +1127,7 @@ class SetupTool(Folder):
         """Purge the profile upgrade versions.
         """
         self._profile_upgrade_versions = PersistentMapping()
+        self._invalidatePendingUpgrades()
         generic_logger.info('Profile upgrade versions purged.')
 
     @security.protected(ManagePortal)
@@ -991,21 +1204,53 @@ class SetupTool(Folder):
         return profiles
 
     @security.private
-    def _massageUpgradeInfo(self, info):
+    def _massageUpgradeInfo(self, info, run_checkers=True):
         """Add a couple of data points to the upgrade info dictionary.
+
+        o The checker for 'done' only runs when it is looked up.
         """
-        info = info.copy()
+        info = _UpgradeInfo(info)
+        step = info['step']
         info['haspath'] = info['source'] and info['dest']
-        info['ssource'] = '.'.join(info['source'] or ('all',))
-        info['sdest'] = '.'.join(info['dest'] or ('all',))
-        info['done'] = (not info['proposed'] and
-                        info['step'].checker is not None and
-                        not info['step'].checker(self))
+        info['ssource'] = step.ssource
+        info['sdest'] = step.sdest
+        if info['proposed'] or step.checker is None:
+            info['done'] = False
+        elif not run_checkers:
+            info['done'] = None
+        else:
+            info._tool = self
         return info
 
+    @security.private
+    def _getCheckerResult(self, step):
+        """Return the result of the checker of an upgrade step.
+
+        o Results are kept for the current request and transaction, and
+          until upgrade steps are run.
+        """
+        txn = transaction.get()
+        # The request is identified by id, so it is not kept alive.
+        request_id = id(getattr(self, 'REQUEST', None))
+        cached = getattr(self, '_v_checker_results', None)
+        if (cached is None or cached[0] is not txn or
+                cached[1] != request_id):
+            cached = self._v_checker_results = (txn, request_id, {})
+        results = cached[2]
+        try:
+            return results[step]
+        except KeyError:
+            result = results[step] = step.checker(self)
+            return result
+
+    @security.private
+    def _invalidateCheckerResults(self):
+        self._v_checker_results = None
+
     @security.protected(ManagePortal)
     def listUpgrades(
             self, profile_id, show_old=False, dest=None, simple=False,
+            run_checkers=True,
     ):
         """Get the list of available upgrades for a profile.
 
@@ -1021,12 +1266,17 @@ class SetupTool(Folder):
         By default we return a list of dictionaries, and sub lists of
         dictionaries. Each dictionary has information on one upgrade step.
         When simple=True we instead return a flat list with only upgrade steps.
+
+        With 'run_checkers=False', the checkers of the steps are not run:
+        steps are proposed by version only, and 'done' is None for steps
+        with a checker.
         """
         if show_old:
             source = None
         else:
             source = self.getLastVersionForProfile(profile_id)
-        upgrades = listUpgradeSteps(self, profile_id, source, dest=dest)
+        upgrades = listUpgradeSteps(self, profile_id, source, dest=dest,
+                                    run_checkers=run_checkers)
         res = []
         for info in upgrades:
             if isinstance(info, list):
@@ -1035,14 +1285,15 @@ class SetupTool(Folder):
                     if simple:
                         res.append(subinfo['step'])
                         continue
-                    subset.append(self._massageUpgradeInfo(subinfo))
+                    subset.append(
+                        self._massageUpgradeInfo(subinfo, run_checkers))
                 if subset:
                     res.append(subset)
             elif simple:
                 res.append(info['step'])
                 continue
             else:
-                res.append(self._massageUpgradeInfo(info))
+                res.append(self._massageUpgradeInfo(info, run_checkers))
         return res
 
     @security.protected(ManagePortal)
@@ -1064,18 +1315,13 @@ class SetupTool(Folder):
         Without a profile_id, we check if there is any profile at all
         that has an upgrade available.
         """
+        summary = self._getPendingUpgradesSummary()
         if profile_id is not None:
-            profile_ids = [profile_id]
-        else:
-            profile_ids = self.listProfilesWithUpgrades()
-        for profile_id in profile_ids:
-            if self.getLastVersionForProfile(profile_id) == UNKNOWN:
-                # We are not interested in profiles that have never been
-                # applied.
-                continue
-            if self.hasUpgrades(profile_id):
-                return True
-        return False
+            prefix = 'profile-'
+            if profile_id.startswith(prefix):
+                profile_id = profile_id[len(prefix):]
+            return summary.get(profile_id, False)
+        return any(summary.values())
 
     @security.protected(ManagePortal)
     def listProfilesWithPendingUpgrades(self):
@@ -1084,15 +1330,9 @@ class SetupTool(Folder):
         Pending means: a not yet applied upgrade step for an already
         applied profile.
         """
-        res = []
-        for profile_id in self.listProfilesWithUpgrades():
-            if self.getLastVersionForProfile(profile_id) == UNKNOWN:
-                # We are not interested in profiles that have never been
-                # applied.
-                continue
-            if self.hasUpgrades(profile_id):
-                res.append(profile_id)
-        return res
+        summary = self._getPendingUpgradesSummary()
+        return [profile_id for profile_id, pending in summary.items()
+                if pending]
 
     @security.protected(ManagePortal)
     def listUptodateProfiles(self):
@@ -1103,15 +1343,39 @@ class SetupTool(Folder):
 
         We ignore profiles that have no upgrade steps at all.
         """
-        res = []
+        summary = self._getPendingUpgradesSummary()
+        return [profile_id for profile_id, pending in summary.items()
+                if not pending]
+
+    @security.private
+    def _getPendingUpgradesSummary(self):
+        """Return a mapping of applied profile id to pending flag.
+
+        o Only profiles with upgrade steps are included, sorted by id.
+
+        o The summary is kept until upgrade steps are registered or the
+          profile upgrade versions change.
+        """
+        generation = _upgrade_registry.generation()
+        versions = tuple(sorted(self._profile_upgrade_versions.items()))
+        cached = getattr(self, '_v_pending_upgrades', None)
+        if (cached is not None and _sameGeneration(cached[0], generation)
+                and cached[1] == versions):
+            return cached[2]
+
+        summary = {}
         for profile_id in self.listProfilesWithUpgrades():
             if self.getLastVersionForProfile(profile_id) == UNKNOWN:
                 # We are not interested in profiles that have never been
                 # applied.
                 continue
-            if not self.listUpgrades(profile_id):
-                res.append(profile_id)
-        return res
+            summary[profile_id] = bool(self.hasUpgrades(profile_id))
+        self._v_pending_upgrades = (generation, versions, summary)
+        return summary
+
+    @security.private
+    def _invalidatePendingUpgrades(self):
+        self._v_pending_upgrades = None
 
     @security.protected(ManagePortal)
     def manage_doUpgrades(self, request=None):
@@ -1119,28 +1383,44 @@ class SetupTool(Folder):
         """
         if request is None:
             request = self.REQUEST
-        logger = logging.getLogger('GenericSetup')
         steps_to_run = request.form.get('upgrades', [])
         profile_id = request.get('profile_id', '')
+        url = self.absolute_url()
+        if request.form.get('background'):
+            job_id = self.queueUpgrade(profile_id, steps_to_run)
+            request.RESPONSE.redirect(
+                "%s/manage_upgrades?profile_id=%s&manage_tabs_message=%s"
+                % (url, profile_id, 'Queued job %s.' % job_id))
+            return
+        self._doUpgradeSteps(profile_id, steps_to_run)
+
+        request.RESPONSE.redirect("%s/manage_upgrades?saved=%s"
+                                  % (url, profile_id))
+
+    @security.private
+    def _doUpgradeSteps(self, profile_id, step_ids):
+        """Run the given upgrade steps of a profile.
+        """
+        logger = logging.getLogger('GenericSetup')
         step = None
-        for step_id in steps_to_run:
-            step = _upgrade_registry.getUpgradeStep(profile_id, step_id)
-            if step is not None:
-                step.doStep(self)
-                msg = f'Ran upgrade step {step.title} for profile {profile_id}'
-                logger.log(logging.INFO, msg)
+        with self._upgradeRun():
+            for step_id in step_ids:
+                step = _upgrade_registry.getUpgradeStep(profile_id, step_id)
+                if step is not None:
+                    self._doRunUpgradeStep(step)
+                    msg = (f'Ran upgrade step {step.title} '
+                           f'for profile {profile_id}')
+                    logger.log(logging.INFO, msg)
+        self._invalidateCheckerResults()
 
         # We update the profile version to the last one we have reached
         # with running an upgrade step.
         if step and step.dest is not None:
             self.setLastVersionForProfile(profile_id, step.dest)
 
-        url = self.absolute_url()
-        request.RESPONSE.redirect("%s/manage_upgrades?saved=%s"
-                                  % (url, profile_id))
-
     @security.protected(ManagePortal)
-    def upgradeProfile(self, profile_id, dest=None, quiet=False):
+    def upgradeProfile(self, profile_id, dest=None, quiet=False,
+                       commit=False):
         """Upgrade a profile.
 
         Apply all upgrade steps.
@@ -1150,6 +1430,13 @@ class SetupTool(Folder):
 
         When 'quiet' is True, we do not complain when we cannot do anything.
 
+        When 'commit' is True, we commit the transaction after each step
+        and record the step as checkpoint.  If a step fails, the
+        transaction is aborted; calling upgradeProfile again resumes after
+        the checkpoint.  Progress can be polled with getUpgradeProgress.
+        If the checkpoint step is no longer pending, ValueError is raised
+        until the checkpoint is reset with resetUpgradeProgress.
+
         If the profile was not applied previously (last version for
         profile is unknown) we do nothing.
         """
@@ -1191,8 +1478,14 @@ class SetupTool(Folder):
                     )
                 )
             return
-        for step in upgrades:
-            step.doStep(self)
+        with self._upgradeRun():
+            if commit:
+                self._runUpgradeStepsWithCheckpoints(profile_id, upgrades)
+            else:
+                for step in upgrades:
+                    self._doRunUpgradeStep(step)
+        step = upgrades[-1]
+        self._invalidateCheckerResults()
         # We update the profile version to the last one we have
         # reached with running an upgrade step.
         if step.dest is not None:
@@ -1202,10 +1495,420 @@ class SetupTool(Folder):
                 profile_id,
                 _version_for_print(
                     self.getLastVersionForProfile(profile_id)))
+        if commit:
+            self._setUpgradeCheckpoint(profile_id, None)
+            transaction.commit()
+
+    @security.protected(ManagePortal)
+    def upgradeAllProfiles(self, commit=False):
+        """Upgrade all profiles with pending upgrades.
+
+        Profiles are upgraded after the profiles they depend on.  With
+        'commit', each profile is upgraded as with
+        'upgradeProfile(profile_id, commit=True)'.
+
+        Return a list with a mapping for each profile, with the keys
+        'profile_id', 'source' and 'dest' (versions before and after the
+        upgrade) and 'seconds'.
+        """
+        report = []
+        with self._upgradeRun():
+            for profile_id in self._sortProfilesByDependencies(
+                    self.listProfilesWithPendingUpgrades()):
+                source = self.getLastVersionForProfile(profile_id)
+                start = time.time()
+                self.upgradeProfile(profile_id, commit=commit)
+                report.append({
+                    'profile_id': profile_id,
+                    'source': source,
+                    'dest': self.getLastVersionForProfile(profile_id),
+                    'seconds': time.time() - start,
+                })
+        generic_logger.info(
+            'Upgraded %d profiles in %.2f seconds.', len(report),
+            sum(info['seconds'] for info in report))
+        return report
+
+    @security.private
+    def _sortProfilesByDependencies(self, profile_ids):
+        """Sort profile ids, so that profiles come after the profiles they
+        depend on, directly or through other profiles.
+        """
+        prefix = 'profile-'
+        wanted = set(profile_ids)
+        closures = {}
+
+        def getDependencies(profile_id):
+            # All profiles 'profile_id' depends on, directly or not.
+            if profile_id not in closures:
+                closures[profile_id] = set()  # guards against cycles
+                found = set()
+                try:
+                    dependencies = self.getDependenciesForProfile(
+                        profile_id, ignore_broken=True)
+                except KeyError:
+                    dependencies = ()
+                for dependency_id in dependencies:
+                    if dependency_id.startswith(prefix):
+                        dependency_id = dependency_id[len(prefix):]
+                    found.add(dependency_id)
+                    found.update(getDependencies(dependency_id))
+                closures[profile_id] = found
+            return closures[profile_id]
+
+        graph = [{'id': profile_id,
+                  'dependencies': sorted(
+                      getDependencies(profile_id) & wanted - {profile_id})}
+                 for profile_id in sorted(profile_ids)]
+        return _computeTopologicalSort(graph)
+
+    @security.protected(ManagePortal)
+    def getUpgradeProgress(self, profile_id):
+        """Return the progress of an upgrade which commits after each step.
+
+        o Return None if no such upgrade is in progress for the profile.
+
+        o Otherwise return a mapping with the keys 'profile_id', 'step'
+          (id of the last completed step), 'title', 'done', 'total' and
+          'time' (of the last checkpoint).
+        """
+        prefix = 'profile-'
+        if profile_id.startswith(prefix):
+            profile_id = profile_id[len(prefix):]
+        checkpoint = self._upgrade_checkpoints.get(profile_id)
+        if checkpoint is None:
+            return None
+        progress = dict(checkpoint)
+        progress['profile_id'] = profile_id
+        return progress
+
+    @security.protected(ManagePortal)
+    def resetUpgradeProgress(self, profile_id):
+        """Forget the checkpoint of an upgrade which commits after each step.
+
+        o The next such upgrade of the profile runs all pending steps.
+        """
+        self._setUpgradeCheckpoint(profile_id, None)
+
+    @security.private
+    def _runUpgradeStepsWithCheckpoints(self, profile_id, upgrades):
+        """Run upgrade steps, committing and checkpointing after each one.
+
+        o Steps up to an existing checkpoint are skipped.
+
+        o Raise ValueError if the checkpoint step is not pending.  The
+          checkpoint must then be reset with 'resetUpgradeProgress'.
+        """
+        prefix = 'profile-'
+        if profile_id.startswith(prefix):
+            profile_id = profile_id[len(prefix):]
+        start = 0
+        checkpoint = self._upgrade_checkpoints.get(profile_id)
+        if checkpoint is not None:
+            step_ids = [step.id for step in upgrades]
+            if checkpoint['step'] in step_ids:
+                start = step_ids.index(checkpoint['step']) + 1
+                generic_logger.info(
+                    'Resuming upgrade of profile %s after step %r.',
+                    profile_id, checkpoint['title'])
+            else:
+                # Running all steps again could repeat the committed ones.
+                raise ValueError(
+                    'Checkpoint step %r of profile %s is not pending.  '
+                    'Reset the upgrade progress to run all steps.'
+                    % (checkpoint['title'], profile_id))
+
+        total = len(upgrades)
+        for index in range(start, total):
+            step = upgrades[index]
+            try:
+                self._doRunUpgradeStep(step)
+                self._setUpgradeCheckpoint(profile_id, {
+                    'step': step.id,
+                    'title': step.title,
+                    'done': index + 1,
+                    'total': total,
+                    'time': time.time(),
+                })
+                transaction.get().note(
+                    f'Upgrade step {step.title} for profile '
+                    f'{profile_id} ({index + 1}/{total})')
+                transaction.commit()
+            except BaseException:
+                transaction.abort()
+                raise
+
+    @security.private
+    def _setUpgradeCheckpoint(self, profile_id, checkpoint):
+        prefix = 'profile-'
+        if profile_id.startswith(prefix):
+            profile_id = profile_id[len(prefix):]
+        if checkpoint is None and profile_id not in self._upgrade_checkpoints:
+            return
+        if not isinstance(self._upgrade_checkpoints, PersistentMapping):
+            self._upgrade_checkpoints = PersistentMapping(
+                self._upgrade_checkpoints)
+        if checkpoint is None:
+            del self._upgrade_checkpoints[profile_id]
+        else:
+            self._upgrade_checkpoints[profile_id] = checkpoint
+
+    @security.protected(ManagePortal)
+    def queueImport(self, profile_id, dependency_strategy=None):
+        """Queue a background job importing all steps of a profile.
+
+        The job runs 'runAllImportStepsFromProfile' in a worker thread with
+        its own database connection, once the current transaction is
+        committed.  Return the id of the job.
+        """
+        return self._queueJob('import', profile_id,
+                              dependency_strategy=dependency_strategy)
+
+    @security.protected(ManagePortal)
+    def queueUpgrade(self, profile_id, step_ids=None):
+        """Queue a background job upgrading a profile.
+
+        The given upgrade steps are run, or all pending steps as with
+        'upgradeProfile' when 'step_ids' is None.  Return the id of the job.
+        """
+        if step_ids is not None:
+            step_ids = list(step_ids)
+        return self._queueJob('upgrade', profile_id, step_ids=step_ids)
+
+    @security.protected(ManagePortal)
+    def getJobStatus(self, job_id):
+        """Get the status of a background job, or None if unknown.
+
+        This is a mapping with the keys 'id', 'kind' ('import' or
+        'upgrade'), 'profile_id', 'options', 'status' ('queued',
+        'running', 'finished' or 'failed'), the times 'queued', 'started'
+        and 'finished', 'steps' (a list of mappings with 'id', 'title',
+        'status' and 'seconds' of the steps run so far), 'messages',
+        'error' and 'worker' (the 'host' and 'pid' of its process).
+
+        A job whose process is gone before it ended is reported as failed.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        status = dict(job)
+        status['options'] = dict(job['options'])
+        status['steps'] = [dict(info) for info in job['steps']]
+        status['messages'] = dict(job['messages'])
+        if isJobLost(job):
+            status['status'] = JOB_FAILED
+            status['error'] = 'The process running the job is gone.'
+            for info in status['steps']:
+                if info['status'] == JOB_RUNNING:
+                    info['status'] = JOB_FAILED
+        return status
+
+    @security.protected(ManagePortal)
+    def listJobs(self):
+        """List the status of the background jobs, newest first.
+        """
+        jobs = [self.getJobStatus(job_id) for job_id in self._jobs]
+        return sorted(jobs, key=itemgetter('queued'), reverse=True)
+
+    @security.protected(ManagePortal)
+    def manage_jobStatus(self, job_id, RESPONSE=None):
+        """Return the status of a background job as JSON.
+        """
+        status = self.getJobStatus(job_id)
+        if status is None:
+            status = {'id': job_id, 'status': None}
+        if RESPONSE is not None:
+            RESPONSE.setHeader('Content-Type', 'application/json')
+        return json.dumps(status)
+
+    @security.protected(ManagePortal)
+    def getStatistics(self):
+        """Get counters of the setup activity since process start or reset.
+
+        The counters are shared by all setup tools in the process.  The
+        result is a mapping with these keys:
+
+        o 'since' -- time of process start or of the last reset.
+
+        o 'imports', 'exports', 'snapshots', 'diffs' -- number of profile
+          imports (each profile of a dependency chain counts), exports,
+          snapshots and configuration comparisons.
+
+        o 'import_steps', 'export_steps', 'failed_steps' -- number of
+          steps run, and of steps that raised an exception.
+
+        o 'import_seconds', 'export_seconds' -- total duration of the
+          steps.
+
+        o 'steps' -- mapping from 'import' and 'export' to mappings from
+          step id to 'runs' and 'seconds'.
+
+        o 'files_read', 'bytes_read' -- files read by import contexts.
+
+        o 'caches' -- mapping from 'registry' (snapshots of the global
+          registries) and 'versions' (parsed upgrade step versions) to
+          mappings with 'hits', 'misses' and 'ratio', the hits divided by
+          all lookups or None.
+        """
+        counters = getCounters()
+        statistics = {'since': counters['since'], 'steps': counters['steps']}
+        for name in ('imports', 'exports', 'snapshots', 'diffs',
+                     'failed_steps', 'files_read', 'bytes_read'):
+            statistics[name] = counters.get(name, 0)
+        for kind in ('import', 'export'):
+            steps = counters['steps'][kind].values()
+            statistics['%s_steps' % kind] = sum(
+                info['runs'] for info in steps)
+            statistics['%s_seconds' % kind] = sum(
+                info['seconds'] for info in steps)
+        registry = getStorageCacheStatistics().values()
+        statistics['caches'] = {
+            'registry': _cacheRatio(sum(info['hits'] for info in registry),
+                                    sum(info['misses'] for info in registry)),
+            'versions': _cacheRatio(**getVersionCacheStatistics()),
+        }
+        return statistics
+
+    @security.protected(ManagePortal)
+    def resetStatistics(self):
+        """Reset the counters reported by getStatistics.
+        """
+        resetCounters()
+        resetStorageCacheStatistics()
+        resetVersionCacheStatistics()
+
+    @security.private
+    def _queueJob(self, kind, profile_id, **options):
+        if self._p_jar is None:
+            raise ValueError('Background jobs need a stored setup tool.')
+        if not isinstance(self._jobs, PersistentMapping):
+            self._jobs = PersistentMapping(self._jobs)
+        self._pruneJobs()
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = PersistentMapping({
+            'id': job_id,
+            'kind': kind,
+            'profile_id': profile_id,
+            'options': options,
+            'status': JOB_QUEUED,
+            'queued': time.time(),
+            'started': None,
+            'finished': None,
+            'steps': [],
+            'messages': {},
+            'error': None,
+            'worker': getWorker(),
+        })
+        # Start the worker once the job record is committed.
+        self._p_jar.transaction_manager.get().addAfterCommitHook(
+            startJob,
+            (self._p_jar.db(), '/'.join(self.getPhysicalPath()), job_id))
+        return job_id
+
+    @security.private
+    def _pruneJobs(self):
+        """Remove the oldest ended jobs, keeping the last _JOBS_KEPT.
+        """
+        ended = [job for job in self._jobs.values()
+                 if job['status'] in (JOB_FINISHED, JOB_FAILED) or
+                 isJobLost(job)]
+        ended.sort(key=itemgetter('queued'))
+        for job in ended[:-_JOBS_KEPT]:
+            del self._jobs[job['id']]
+
+    @security.private
+    def _executeJob(self, job_id):
+        """Do the work of a background job, and return its messages.
+        """
+        job = self._jobs[job_id]
+        options = job['options']
+        if job['kind'] == 'import':
+            result = self.runAllImportStepsFromProfile(
+                job['profile_id'],
+                dependency_strategy=options.get('dependency_strategy'))
+            return result['messages']
+        if job['kind'] == 'upgrade':
+            if options.get('step_ids') is None:
+                self.upgradeProfile(job['profile_id'])
+            else:
+                self._doUpgradeSteps(job['profile_id'], options['step_ids'])
+            return {}
+        raise ValueError('Unknown job kind %r.' % job['kind'])
+
+    @security.private
+    def _reportJobProgress(self, step_id, title=None):
+        """Record the start of a step, when running in a background job.
+        """
+        reporter = _getRunState(self, 'job_reporter')
+        if reporter is not None:
+            reporter.step(step_id, title)
+
+    @security.private
+    def _doRunUpgradeStep(self, step):
+        self._reportJobProgress(step.id, step.title)
+        step.doStep(self)
 
     #
     #   Helper methods
     #
+    @security.private
+    @contextlib.contextmanager
+    def _upgradeRun(self):
+        """ Share import contexts and sorted import steps while upgrading.
+
+        o Upgrade steps often reimport steps of the same profile.  Within
+          the run, its import context is created once, and its step
+          registries are applied again only if another context was applied
+          since.  Nested runs join the outer run.
+        """
+        if _getRunState(self, 'upgrade_run') is not None:
+            yield
+            return
+        _setRunState(self, 'upgrade_run', {'contexts': {},
+                                           'applied': None,
+                                           'sorted_steps': None})
+        try:
+            yield
+        finally:
+            _setRunState(self, 'upgrade_run', None)
+
+    @security.private
+    def _getAppliedImportContext(self, context_id, should_purge=None,
+                                 archive=None):
+        """ Return an import context, after applying its step registries.
+
+        o Inside an upgrade run, the context is reused.
+        """
+        run = _getRunState(self, 'upgrade_run')
+        if run is None or context_id is None:
+            context = self._getImportContext(context_id, should_purge,
+                                             archive)
+            self.applyContext(context)
+            return context
+
+        key = (context_id, should_purge)
+        context = run['contexts'].get(key)
+        if context is None:
+            context = self._getImportContext(context_id, should_purge)
+            run['contexts'][key] = context
+        else:
+            context.clearNotes()
+        # Another profile may have registered steps with the same ids.
+        if run['applied'] is not context:
+            self.applyContext(context)
+        return context
+
+    @security.private
+    def _getRunSortedImportSteps(self):
+        """ Return the sorted import steps, shared inside an upgrade run.
+        """
+        run = _getRunState(self, 'upgrade_run')
+        if run is None:
+            return self.getSortedImportSteps()
+        if run['sorted_steps'] is None:
+            run['sorted_steps'] = self.getSortedImportSteps()
+        return run['sorted_steps']
+
     @security.private
     def _getImportContext(self, context_id, should_purge=None, archive=None):
         """ Crack ID and generate appropriate import context.
@@ -1296,8 +1999,12 @@ class SetupTool(Folder):
                                                description=description)
 
     @security.private
-    def _doRunImportStep(self, step_id, context):
+    def _doRunImportStep(self, step_id, context, objects=None):
         """ Run a single import step, using a pre-built context.
+
+        o If the tool is stored in a ZODB, count the persistent objects
+          the step loaded and modified, log them, and add them to
+          'objects', if given.
         """
         __traceback_info__ = step_id
         marker = object()
@@ -1313,12 +2020,39 @@ class SetupTool(Folder):
             logger.error(msg)
             return 'ERROR: ' + msg
 
-        return handler(context)
+        self._reportJobProgress(step_id)
+        jar = self._p_jar
+        if jar is None:
+            return self._doRunStepHandler(handler, step_id, context,
+                                          'import')
+        loaded, modified = _getTransferCounts(jar)
+        try:
+            return self._doRunStepHandler(handler, step_id, context,
+                                          'import')
+        finally:
+            after_loaded, after_modified = _getTransferCounts(jar)
+            loaded = after_loaded - loaded
+            modified = after_modified - modified
+            generic_logger.info(
+                'Import step %s: %d objects loaded, %d modified',
+                step_id, loaded, modified)
+            if objects is not None:
+                counts = objects.setdefault(step_id, {'loaded': 0,
+                                                      'modified': 0})
+                counts['loaded'] += loaded
+                counts['modified'] += modified
 
     @security.private
-    def _doRunExportSteps(self, steps):
+    def _doRunExportSteps(self, steps, trace_memory=False):
         """ See ISetupTool.
         """
+        if trace_memory:
+            with self._tracedSteps() as step_memory:
+                result = self._doRunExportSteps(steps)
+            self._addStepMemory(result, step_memory)
+            return result
+
+        incrementCounter('exports')
         context = TarballExportContext(self)
         messages = {}
         marker = object()
@@ -1336,13 +2070,245 @@ class SetupTool(Folder):
                 logger.error(msg)
                 messages[step_id] = msg
             else:
-                messages[step_id] = handler(context)
+                messages[step_id] = self._doRunStepHandler(
+                    handler, step_id, context, 'export')
 
         return {'steps': steps,
                 'messages': messages,
                 'tarball': context.getArchive(),
                 'filename': context.getArchiveFilename()}
 
+    @security.private
+    def _doRunStepHandler(self, handler, step_id, context, kind):
+        """ Run the handler of an 'import' or 'export' step.
+
+        o Step events are notified around it, and the run is counted.
+        """
+        started_event, finished_event = _STEP_EVENTS[kind]
+        event.notify(started_event(self, step_id, context))
+        # Only the outermost step is profiled and traced.  Steps run from
+        # inside its handler are part of its figures, and a nested
+        # profiler or snapshot would fail or spoil the outer ones.
+        outermost = not getattr(_run_state, 'running_step', False)
+        step_profiles = step_memory = None
+        if outermost:
+            step_profiles = _getRunState(self, 'step_profiles')
+            step_memory = _getRunState(self, 'step_memory')
+
+        def run():
+            if step_profiles is None:
+                return handler(context)
+            return self._doProfileStepHandler(handler, step_id, context,
+                                              step_profiles)
+
+        start = time.time()
+        _run_state.running_step = True
+        try:
+            if step_memory is None:
+                message = run()
+            else:
+                message = self._doTraceStepHandler(run, step_id,
+                                                   step_memory)
+        except Exception as e:
+            seconds = time.time() - start
+            recordStep(kind, step_id, seconds)
+            incrementCounter('failed_steps')
+            event.notify(finished_event(self, step_id, context, seconds,
+                                        exception=e))
+            raise
+        finally:
+            if outermost:
+                _run_state.running_step = False
+        seconds = time.time() - start
+        recordStep(kind, step_id, seconds)
+        event.notify(finished_event(self, step_id, context, seconds,
+                                    message=message))
+        return message
+
+    @security.private
+    def _doProfileStepHandler(self, handler, step_id, context,
+                              step_profiles):
+        """ Run the handler of a step with cProfile.
+
+        o Statistics of a step run several times are added up.
+
+        o If another profiler is active, the step runs unprofiled and is
+          mapped to None.
+        """
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Since Python 3.12 only one profiler can be active in a
+            # process, e.g. for a profiled import in another thread.
+            step_profiles.setdefault(step_id, None)
+            return handler(context)
+        try:
+            return handler(context)
+        finally:
+            profiler.disable()
+            profiler.create_stats()
+            if profiler.stats:
+                stats = step_profiles.get(step_id)
+                if stats is None:
+                    step_profiles[step_id] = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+
+    @security.private
+    def _doTraceStepHandler(self, run, step_id, step_memory):
+        """ Call 'run', tracing the memory it allocates with tracemalloc.
+
+        o For a step run several times, growth is added up, and the
+          highest peak and the allocation sites of the run with the most
+          growth are kept.
+        """
+        with _tracing_lock:
+            # The peak is process-wide: it is only measured for a step
+            # during which no other thread runs a traced step.
+            _tracing['steps'] += 1
+            _tracing['started_steps'] += 1
+            alone = _tracing['steps'] == 1
+            started_steps = _tracing['started_steps']
+            if alone:
+                tracemalloc.reset_peak()
+            start_size = tracemalloc.get_traced_memory()[0]
+        before = tracemalloc.take_snapshot()
+        try:
+            return run()
+        finally:
+            with _tracing_lock:
+                _tracing['steps'] -= 1
+                peak = None
+                if alone and _tracing['started_steps'] == started_steps:
+                    peak = tracemalloc.get_traced_memory()[1] - start_size
+            after = tracemalloc.take_snapshot()
+            differences = after.filter_traces(_TRACEMALLOC_FILTERS) \
+                .compare_to(before.filter_traces(_TRACEMALLOC_FILTERS),
+                            'lineno')
+            growth = sum(stat.size_diff for stat in differences)
+            sites = [str(stat) for stat in differences[:_TRACEMALLOC_TOP]
+                     if stat.size_diff > 0]
+            info = step_memory.get(step_id)
+            if info is None:
+                step_memory[step_id] = {'growth': growth,
+                                        'peak': peak,
+                                        'sites': sites,
+                                        '_largest': growth}
+            else:
+                info['growth'] += growth
+                if info['peak'] is not None and peak is not None:
+                    info['peak'] = max(info['peak'], peak)
+                else:
+                    info['peak'] = None
+                if growth > info['_largest']:
+                    info['sites'] = sites
+                    info['_largest'] = growth
+
+    @security.private
+    @contextlib.contextmanager
+    def _tracedSteps(self, enabled=True):
+        """ Trace the memory allocated by the step handlers run inside.
+
+        o Yield a mapping from step id to a mapping with the net 'growth'
+          and 'peak' in bytes and the allocation 'sites' with most growth,
+          or None when not enabled.  The 'peak' is None if steps traced in
+          other threads overlapped.
+
+        o tracemalloc is started if needed, and stopped when the last run
+          tracing memory in any thread ends.
+        """
+        if not enabled:
+            yield None
+            return
+        step_memory = _getRunState(self, 'step_memory')
+        if step_memory is not None:
+            # Join the outer run.
+            yield step_memory
+            return
+        with _tracing_lock:
+            if _tracing['runs'] == 0:
+                _tracing['started'] = not tracemalloc.is_tracing()
+                if _tracing['started']:
+                    tracemalloc.start(_TRACEMALLOC_FRAMES)
+            _tracing['runs'] += 1
+        step_memory = {}
+        _setRunState(self, 'step_memory', step_memory)
+        try:
+            yield step_memory
+        finally:
+            _setRunState(self, 'step_memory', None)
+            with _tracing_lock:
+                _tracing['runs'] -= 1
+                if _tracing['runs'] == 0 and _tracing['started']:
+                    tracemalloc.stop()
+                    _tracing['started'] = False
+            for info in step_memory.values():
+                info.pop('_largest', None)
+
+    @security.private
+    def _addStepMemory(self, result, step_memory):
+        """ Add the traced memory of steps to a result.
+        """
+        result['memory'] = step_memory
+        for step_id, info in step_memory.items():
+            if info['peak'] is None:
+                peak = 'peak unknown, other imports overlapped'
+            else:
+                peak = '%.1f KiB peak' % (info['peak'] / 1024.0)
+            lines = ['Memory: %+.1f KiB net, %s'
+                     % (info['growth'] / 1024.0, peak)]
+            lines.extend('  %s' % site for site in info['sites'])
+            message = result['messages'].get(step_id)
+            result['messages'][step_id] = '\n'.join(
+                [text for text in [message] if text] + lines)
+
+    @security.private
+    @contextlib.contextmanager
+    def _profiledSteps(self, enabled=True):
+        """ Collect cProfile statistics of the step handlers run inside.
+
+        o Yield a mapping from step id to pstats.Stats, or to None for a
+          step run while another profiler was active.  Yield None when not
+          enabled.
+        """
+        if not enabled:
+            yield None
+            return
+        step_profiles = _getRunState(self, 'step_profiles')
+        if step_profiles is not None:
+            # Join the outer run.
+            yield step_profiles
+            return
+        step_profiles = {}
+        _setRunState(self, 'step_profiles', step_profiles)
+        try:
+            yield step_profiles
+        finally:
+            _setRunState(self, 'step_profiles', None)
+
+    @security.private
+    def _addStepProfiles(self, result, step_profiles):
+        """ Add the cProfile statistics of steps to a result.
+
+        o The functions with the highest cumulative time are added to the
+          step messages, the marshalled statistics, as read by
+          pstats.Stats, are added as 'pstats'.
+        """
+        result['pstats'] = {}
+        for step_id, stats in step_profiles.items():
+            if stats is None:
+                report = 'Not profiled: another profiler was active.'
+            else:
+                result['pstats'][step_id] = marshal.dumps(stats.stats)
+                stream = io.StringIO()
+                stats.stream = stream
+                stats.sort_stats('cumulative').print_stats(_CPROFILE_TOP)
+                report = stream.getvalue().strip()
+            message = result['messages'].get(step_id)
+            result['messages'][step_id] = '\n'.join(
+                [text for text in (message, report) if text])
+
     @security.private
     def _doRunHandler(self, handler):
         """Run a single handler.
@@ -1377,18 +2343,10 @@ class SetupTool(Folder):
         return chain
 
     @security.private
-    def _runImportStepsFromContext(self,
-                                   steps=None,
-                                   purge_old=None,
-                                   profile_id=None,
-                                   archive=None,
-                                   ignore_dependencies=False,
-                                   blacklisted_steps=None,
-                                   dependency_strategy=None):
-
-        # 1. Determine upgrade strategy.
-        #    What do we do with already applied dependency profiles?
-
+    def _getDependencyStrategy(self, dependency_strategy,
+                               ignore_dependencies):
+        """ Return the checked dependency strategy and ignore flag.
+        """
         # There are two ways to say you want to ignore all
         # dependencies.  If one is enabled, we enable the other too.
         if dependency_strategy == DEPENDENCY_STRATEGY_IGNORE:
@@ -1398,44 +2356,143 @@ class SetupTool(Folder):
         # Turn None into the default:
         if dependency_strategy is None:
             dependency_strategy = DEFAULT_DEPENDENCY_STRATEGY
-        # Determine the settings based on the strategy.
-        if dependency_strategy == DEPENDENCY_STRATEGY_UPGRADE:
-            apply_new_profiles = True
-            reapply_old_profiles = False
-            upgrade_old_profiles = True
-        elif dependency_strategy == DEPENDENCY_STRATEGY_REAPPLY:
-            apply_new_profiles = True
-            reapply_old_profiles = True
-            upgrade_old_profiles = False
-        elif dependency_strategy == DEPENDENCY_STRATEGY_NEW:
-            apply_new_profiles = True
-            reapply_old_profiles = False
-            upgrade_old_profiles = False
-        elif dependency_strategy == DEPENDENCY_STRATEGY_IGNORE:
-            apply_new_profiles = False
-            reapply_old_profiles = False
-            upgrade_old_profiles = False
-        else:
+        if dependency_strategy not in (DEPENDENCY_STRATEGY_UPGRADE,
+                                       DEPENDENCY_STRATEGY_REAPPLY,
+                                       DEPENDENCY_STRATEGY_NEW,
+                                       DEPENDENCY_STRATEGY_IGNORE):
             raise ValueError('Unknown dependency_strategy %r.' %
                              dependency_strategy)
-        generic_logger.info(
-            'Importing profile %s with dependency strategy %s.',
-            profile_id, dependency_strategy)
+        return dependency_strategy, ignore_dependencies
 
-        # 2. Gather a list of profiles to handle.
+    @security.private
+    def _getImportChain(self, profile_ids, ignore_dependencies):
+        """ Return the profiles to handle, dependencies first.
+
+        o The dependency chains of several main profiles are merged, so
+          that each profile is handled only once.
+        """
+        if profile_ids[0] is None or ignore_dependencies:
+            # Two possibilities:
+            # - We ignore dependencies, so we have only the main profiles.
+            # - Profile id is None and we import a tarball (in the archive).
+            return list(profile_ids)
 
-        if profile_id is not None and not ignore_dependencies:
+        chain = []
+        seen = set()
+        for main_id in profile_ids:
             try:
-                chain = self.getProfileDependencyChain(profile_id)
+                main_chain = self.getProfileDependencyChain(main_id)
             except KeyError as e:
                 logger = logging.getLogger('GenericSetup')
                 logger.error('Unknown step in dependency chain: %s' % str(e))
                 raise
-        else:
-            # Two possibilities:
-            # - We ignore dependencies, so we have a single profile id.
-            # - Profile id is None and we import a tarball (in the archive).
-            chain = [profile_id]
+            for chain_id in main_chain:
+                if _profileKey(chain_id) not in seen:
+                    seen.add(_profileKey(chain_id))
+                    chain.append(chain_id)
+        return chain
+
+    @security.private
+    def _getProfileImportAction(self, profile_id, is_main,
+                                dependency_strategy, purged=False):
+        """ Return what an import does with a profile of the chain.
+
+        o One of 'apply', 'reapply', 'upgrade' or 'skip'.  Main profiles
+          are always applied.
+
+        o With 'purged', take the profile versions as purged by a base
+          profile applied earlier in the chain.
+        """
+        if is_main:
+            return 'apply'
+        # This is a dependency profile.  This means we are not completely
+        # ignoring them, otherwise it would not have ended up in the
+        # chain.  Check if it was already applied.
+        if purged or self.getLastVersionForProfile(profile_id) == UNKNOWN:
+            # This is a new profile.
+            if dependency_strategy == DEPENDENCY_STRATEGY_IGNORE:
+                return 'skip'
+            return 'apply'
+        # Profile was already applied.
+        if dependency_strategy == DEPENDENCY_STRATEGY_UPGRADE:
+            return 'upgrade'
+        if dependency_strategy == DEPENDENCY_STRATEGY_REAPPLY:
+            return 'reapply'
+        return 'skip'
+
+    @security.private
+    def _recordImportTimings(self, profile_id, timings):
+        """ Remember how long the import steps of a profile took.
+
+        o Only new steps and clearly changed durations are stored, so
+          that most imports do not write to the tool.
+        """
+        if profile_id is None or not timings:
+            return
+        recorded = self._import_timings.get(_profileKey(profile_id), {})
+        changed = {step: seconds for step, seconds in timings.items()
+                   if step not in recorded or
+                   abs(seconds - recorded[step]) >
+                   max(recorded[step] * _TIMING_TOLERANCE, _TIMING_MINIMUM)}
+        if not changed:
+            return
+        if not isinstance(self._import_timings, PersistentMapping):
+            self._import_timings = PersistentMapping(self._import_timings)
+        recorded = dict(recorded)
+        recorded.update(changed)
+        self._import_timings[_profileKey(profile_id)] = recorded
+
+    @security.private
+    def _runImportStepsFromContext(self,
+                                   steps=None,
+                                   purge_old=None,
+                                   profile_id=None,
+                                   archive=None,
+                                   ignore_dependencies=False,
+                                   blacklisted_steps=None,
+                                   dependency_strategy=None,
+                                   profile_ids=None,
+                                   release_memory=False,
+                                   trace_memory=False):
+        # 'profile_ids' are several main profiles to import.  Their
+        # dependency chains are merged, so that each profile is handled
+        # only once.
+        # With 'release_memory', a savepoint is taken and the connection
+        # cache is garbage collected after each step and each profile.
+        # How much each step raised the peak memory of the process is
+        # reported.
+        # With 'trace_memory', the memory allocated by each step is traced
+        # with tracemalloc and reported.
+        if trace_memory:
+            with self._tracedSteps() as step_memory:
+                result = self._runImportStepsFromContext(
+                    steps=steps,
+                    purge_old=purge_old,
+                    archive=archive,
+                    ignore_dependencies=ignore_dependencies,
+                    blacklisted_steps=blacklisted_steps,
+                    dependency_strategy=dependency_strategy,
+                    profile_ids=profile_ids or [profile_id],
+                    release_memory=release_memory)
+            self._addStepMemory(result, step_memory)
+            return result
+
+        if profile_ids is None:
+            profile_ids = [profile_id]
+
+        # 1. Determine upgrade strategy.
+        #    What do we do with already applied dependency profiles?
+        dependency_strategy, ignore_dependencies = (
+            self._getDependencyStrategy(dependency_strategy,
+                                        ignore_dependencies))
+        generic_logger.info(
+            'Importing profile %s with dependency strategy %s.',
+            ', '.join(str(main_id) for main_id in profile_ids),
+            dependency_strategy)
+
+        # 2. Gather a list of profiles to handle.
+        chain = self._getImportChain(profile_ids, ignore_dependencies)
+        main_keys = {_profileKey(main_id) for main_id in profile_ids}
 
         # 3. For each profile, depending on the keyword arguments, either:
         # a. do nothing or
@@ -1443,13 +2500,15 @@ class SetupTool(Folder):
         # c. apply its full profile.
 
         results = []
+        peak_memory_growth = {}
+        objects = {}
         detect_steps = steps is None
 
         # The chain is: first all dependency profiles ( recursively if
         # applicable), and as last one the main profile for which we
-        # got passed the profile_id.
-        last_num = len(chain)
-        for num, profile_id in enumerate(chain, 1):
+        # got passed the profile_id.  With several main profiles, each
+        # one comes after its dependencies.
+        for profile_id in chain:
             try:
                 profile_info = self.getProfileInfo(profile_id)
             except KeyError:
@@ -1458,34 +2517,29 @@ class SetupTool(Folder):
                 profile_type = None
             else:
                 profile_type = profile_info.get('type')
-            if num == last_num:
+            action = self._getProfileImportAction(
+                profile_id, _profileKey(profile_id) in main_keys,
+                dependency_strategy)
+            if action == 'skip':
+                continue
+            if action == 'upgrade':
+                self.upgradeProfile(profile_id)
+                continue
+            if _profileKey(profile_id) in main_keys:
                 generic_logger.info('Applying main profile %s', profile_id)
+            elif action == 'reapply':
+                generic_logger.info('Reapplying profile %s', profile_id)
             else:
-                # This is a dependency profile.  This means we are not
-                # completely ignoring them, otherwise it would not
-                # have ended up in the list.  Check if it was already
-                # applied.
-                if self.getLastVersionForProfile(profile_id) == UNKNOWN:
-                    # This is a new profile.
-                    if not apply_new_profiles:
-                        continue
-                    generic_logger.info('Applying profile %s', profile_id)
-                else:
-                    # Profile was already applied.
-                    if upgrade_old_profiles:
-                        self.upgradeProfile(profile_id)
-                        continue
-                    if not reapply_old_profiles:
-                        continue
-                    generic_logger.info('Reapplying profile %s', profile_id)
+                generic_logger.info('Applying profile %s', profile_id)
             # The next lines are done at least for the main profile.
             # Possibly also for dependency profiles, depending on the
             # condition above.  It applies the profile.
-            context = self._getImportContext(profile_id, purge_old, archive)
-            self.applyContext(context)
+            context = self._getAppliedImportContext(
+                profile_id, purge_old, archive)
             if detect_steps:
-                steps = self.getSortedImportSteps()
+                steps = self._getRunSortedImportSteps()
             messages = {}
+            incrementCounter('imports')
             event.notify(
                 BeforeProfileImportEvent(self, profile_id, steps, True))
             # Maybe purge all profile upgrade versions.
@@ -1497,14 +2551,30 @@ class SetupTool(Folder):
             if pre_handler:
                 self._doRunHandler(pre_handler)
             # Run all import steps.
+            timings = {}
             for step in steps:
                 if blacklisted_steps and step in blacklisted_steps:
                     message = 'step skipped'
                 else:
-                    message = self._doRunImportStep(step, context)
+                    if release_memory:
+                        peak_before = _getPeakMemory() or 0
+                    start = time.perf_counter()
+                    message = self._doRunImportStep(step, context, objects)
+                    timings[step] = time.perf_counter() - start
+                    if release_memory:
+                        _endBatch(self._p_jar, False)
+                        # The peak only ever grows: report how much this
+                        # step raised it.
+                        peak_memory_growth[step] = (
+                            peak_memory_growth.get(step, 0) +
+                            (_getPeakMemory() or 0) - peak_before)
                 message_list = [i for i in [message] if i]
                 message_list.extend(['%s: %s' % x[1:]
                                      for x in context.listNotes()])
+                if step in peak_memory_growth:
+                    message_list.append('Peak memory growth: %d KiB'
+                                        % peak_memory_growth[step])
+                message_list.extend(_objectsMessage(objects, step))
                 messages[step] = '\n'.join(message_list)
                 context.clearNotes()
             # Run optional post_handler if available.
@@ -1512,6 +2582,9 @@ class SetupTool(Folder):
             if post_handler:
                 self._doRunHandler(post_handler)
             event.notify(ProfileImportedEvent(self, profile_id, steps, True))
+            self._recordImportTimings(profile_id, timings)
+            if release_memory:
+                _endBatch(self._p_jar, False)
             messages[profile_id] = (
                 'Imported with dependency strategy %s.' % dependency_strategy)
             results.append({'steps': steps, 'messages': messages})
@@ -1530,6 +2603,10 @@ class SetupTool(Folder):
                 else:
                     data['messages'][step] = msg
         data['steps'] = list(data['steps'])
+        if release_memory:
+            data['peak_memory_growth'] = peak_memory_growth
+        if objects:
+            data['objects'] = objects
 
         return data
 
@@ -1566,6 +2643,12 @@ class SetupTool(Folder):
         if isinstance(report, str):
             report = report.encode('latin-1')
 
+        self._addReportFile(basename, report, 'text/plain')
+
+    @security.private
+    def _addReportFile(self, basename, data, content_type):
+        """ Store a file with the results of a run.
+        """
         name = basename
         index = 0
         while name in self:
@@ -1574,8 +2657,8 @@ class SetupTool(Folder):
 
         file = File(id=name,
                     title='',
-                    file=report,
-                    content_type='text/plain')
+                    file=data,
+                    content_type=content_type)
 
         self._setObject(name, file)
 
@@ -1588,6 +2671,151 @@ class SetupTool(Folder):
 InitializeClass(SetupTool)
 
 
+def _objectsMessage(objects, step_id):
+    # Report line for the persistent objects counted for a step, if any.
+    if step_id not in objects:
+        return []
+    return ['ZODB: %(loaded)d objects loaded, %(modified)d modified'
+            % objects[step_id]]
+
+
+def _cacheRatio(hits, misses):
+    lookups = hits + misses
+    return {'hits': hits,
+            'misses': misses,
+            'ratio': hits / lookups if lookups else None}
+
+
+def _profileKey(profile_id):
+    prefix = 'profile-'
+    if profile_id is not None and profile_id.startswith(prefix):
+        return profile_id[len(prefix):]
+    return profile_id
+
+
+def _listContextFiles(context, path=''):
+    names = []
+    for name in sorted(context.listDirectory(path) or ()):
+        subpath = path and '%s/%s' % (path, name) or name
+        if context.isDirectory(subpath):
+            names.extend(_listContextFiles(context, subpath))
+        else:
+            names.append(subpath)
+    return names
+
+
+def _listProfileContextInfos(order_by):
+    """ Return context infos for the registered profiles, see
+    'SetupTool.listContextInfos'.
+    """
+    def readableType(x):
+        if x is BASE:
+            return 'base'
+        elif x is EXTENSION:
+            return 'extension'
+        return 'unknown'
+
+    p_infos = [{
+        'id': 'profile-%s' % info['id'],
+        'sortable_id': info['id'].lower(),
+        'title': info['title'],
+        'sortable_title': info['title'].lower(),
+        'type': readableType(info['type']),
+    } for info in _profile_registry.listOrderedProfileInfo()]
+    p_infos.sort(key=itemgetter(order_by))
+    return tuple(p_infos)
+
+
+class _UpgradeInfo(dict):
+
+    """ Upgrade step info, which looks up 'done' only when needed.
+
+    o 'done' is always part of the mapping: the checker of the step is
+      run on the first read of 'done', or of the mapping as a whole
+      (iterating, copying, comparing, JSON, pickling).
+
+    o A dictionary, so that it can be serialized like the plain infos.
+    """
+
+    _tool = None
+
+    def _resolve(self):
+        if self._tool is not None:
+            done = not self._tool._getCheckerResult(self['step'])
+            self._tool = None
+            dict.__setitem__(self, 'done', done)
+
+    def __missing__(self, key):
+        if key != 'done' or self._tool is None:
+            raise KeyError(key)
+        self._resolve()
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if key == 'done':
+            self._tool = None
+        else:
+            # 'done' belongs to the step as it was listed.
+            self._resolve()
+        dict.__setitem__(self, key, value)
+
+    def __contains__(self, key):
+        return (key == 'done' and self._tool is not None or
+                dict.__contains__(self, key))
+
+    def __len__(self):
+        self._resolve()
+        return dict.__len__(self)
+
+    def __iter__(self):
+        self._resolve()
+        return dict.__iter__(self)
+
+    def keys(self):
+        self._resolve()
+        return dict.keys(self)
+
+    def values(self):
+        self._resolve()
+        return dict.values(self)
+
+    def items(self):
+        self._resolve()
+        return dict.items(self)
+
+    def copy(self):
+        self._resolve()
+        return dict(dict.items(self))
+
+    def __eq__(self, other):
+        self._resolve()
+        if isinstance(other, _UpgradeInfo):
+            other._resolve()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._resolve()
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        # Pickled as a plain dictionary, without the tool.
+        return (dict, (self.copy(),))
+
+
+allow_type(_UpgradeInfo)
+
+
 _PLAINTEXT_DIFF_HEADER = """\
 Comparing configurations: '%s' and '%s'
 
@@ -1595,6 +2823,37 @@ Comparing configurations: '%s' and '%s'
 
 _TOOL_ID = 'setup_tool'
 
+_STEP_EVENTS = {
+    'import': (ImportStepStartedEvent, ImportStepFinishedEvent),
+    'export': (ExportStepStartedEvent, ExportStepFinishedEvent),
+}
+
+# Number of functions listed in the report for each step run with cProfile.
+_CPROFILE_TOP = 20
+
+# Number of allocation sites listed in the report for each step traced with
+# tracemalloc, and the number of frames stored for each allocation.
+_TRACEMALLOC_TOP = 10
+_TRACEMALLOC_FRAMES = 1
+_TRACEMALLOC_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+)
+
+# tracemalloc is process-wide, and shared by the runs tracing memory in
+# all threads: the number of 'runs', whether they 'started' tracemalloc,
+# the number of traced 'steps' running, and of 'started_steps' so far.
+_tracing_lock = threading.Lock()
+_tracing = {'runs': 0, 'started': False, 'steps': 0, 'started_steps': 0}
+
+# Number of ended background jobs kept on the tool.
+_JOBS_KEPT = 20
+
+# A recorded import step duration is only replaced when a new one differs
+# by more than this fraction of it, and by more than this many seconds.
+_TIMING_TOLERANCE = 0.5
+_TIMING_MINIMUM = 1.0
+
 addSetupToolForm = PageTemplateFile('toolAdd.zpt', _wwwdir)
 
 
@@ -12,11 +12,16 @@
 ##############################################################################
 """Upgrade steps and registry.
 """
+import bisect
+import functools
+
 import packaging.version
 from BTrees.OOBTree import OOBTree
 
+from Products.GenericSetup.interfaces import ISetupTool
 from Products.GenericSetup.interfaces import IUpgradeSteps
 from Products.GenericSetup.registry import GlobalRegistryStorage
+from Products.GenericSetup.registry import _sameGeneration
 from Products.GenericSetup.utils import _getHash
 
 
@@ -43,27 +48,76 @@ def _version_matches_all(version):
 
 def _version_matches(source, step_source, step_dest, strict=False, dest=None):
     # Step source and destination must match.
-    source_matches_all = _version_matches_all(source)
-    dest_matches_all = _version_matches_all(dest)
+    return _normalized_version_matches(
+        _parse_version(source),
+        _parse_step_version(step_source),
+        _parse_step_version(step_dest),
+        strict=strict,
+        dest=_parse_version(dest),
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_version(version):
+    """ Return a tuple (matches_all, normalized version) for 'version'.
+
+    o Results are kept in a bounded cache, as the same installed versions
+      are compared with every registered upgrade step.
+    """
+    return _version_matches_all(version), normalize_version(version)
+
+
+# Hits and misses of _parse_version at the last reset of the statistics.
+_version_cache_baseline = (0, 0)
+
+
+def getVersionCacheStatistics():
+    """ Return the 'hits' and 'misses' of the parsed version cache.
+    """
+    info = _parse_version.cache_info()
+    return {'hits': info.hits - _version_cache_baseline[0],
+            'misses': info.misses - _version_cache_baseline[1]}
+
+
+def resetVersionCacheStatistics():
+    global _version_cache_baseline
+    info = _parse_version.cache_info()
+    _version_cache_baseline = (info.hits, info.misses)
+
+
+def _parse_step_version(version):
+    """ Return the normalized step version, or None if it matches all.
+    """
+    matches_all, normalized = _parse_version(version)
+    if matches_all:
+        return None
+    return normalized
+
+
+def _normalized_version_matches(source, start, stop, strict=False, dest=None):
+    """ Like '_version_matches', with pre-parsed versions.
+
+    o 'source' and 'dest' are results of '_parse_version'.
+
+    o 'start' and 'stop' are results of '_parse_step_version'.
+    """
+    source_matches_all, source = source
+    dest_matches_all, dest = dest
     if source_matches_all and dest_matches_all:
         return True
-    source = normalize_version(source)
     if not source_matches_all:
         # Check step source.
-        if not _version_matches_all(step_source):
-            start = normalize_version(step_source)
+        if start is not None:
             if strict:
                 if start != source:
                     return False
             elif start < source:
                 return False
     # Step source is okay. Now check step destination.
-    if _version_matches_all(step_dest):
+    if stop is None:
         return True
-    stop = normalize_version(step_dest)
     # Check maximum or strictly wanted destination.
     if not dest_matches_all:
-        dest = normalize_version(dest)
         if strict:
             if stop != dest:
                 return False
@@ -73,6 +127,64 @@ def _version_matches(source, step_source, step_dest, strict=False, dest=None):
     return stop > source
 
 
+class _UpgradeIndex:
+    """Lookup structures derived from the upgrade steps of one profile.
+
+    Items are single steps or lists of nested steps, as stored in the
+    registry.  Items are sorted by the highest normalized source version of
+    their steps.  Items with a step for all source versions are kept apart.
+
+    Steps are also indexed by id, including nested steps.
+    """
+
+    def __init__(self, profile_steps):
+        self.items = list(profile_steps.items())
+        self.unbounded = []  # positions of items matching all sources
+        self.by_id = {}      # top level id -> step
+        self.nested = {}     # nested step id -> first nested step
+        bounded = []
+        for pos, (id, step) in enumerate(self.items):
+            if isinstance(step, list):
+                subs = dict(step)
+                self.by_id[id] = subs.get(id)
+                for inner_id, inner in subs.items():
+                    self.nested.setdefault(inner_id, inner)
+            else:
+                self.by_id[id] = step
+            if isinstance(step, UpgradeEntity):
+                starts = [step._start]
+            else:
+                starts = [inner._start for inner_id, inner in step]
+            if None in starts:
+                self.unbounded.append(pos)
+            elif starts:
+                bounded.append((max(starts), pos))
+        bounded.sort()
+        self.starts = [start for start, pos in bounded]
+        self.positions = [pos for start, pos in bounded]
+
+    def listCandidates(self, source):
+        """Return the items which may have steps for 'source', in order.
+
+        o Steps with a source lower than 'source' never apply to it.
+        """
+        matches_all, source = _parse_version(source)
+        if matches_all:
+            return self.items
+        first = bisect.bisect_left(self.starts, source)
+        positions = sorted(self.unbounded + self.positions[first:])
+        return [self.items[pos] for pos in positions]
+
+    def getStep(self, step_id):
+        """Return the step with the given id, or None.
+
+        o Top level ids take precedence over nested ones.
+        """
+        if step_id in self.by_id:
+            return self.by_id[step_id]
+        return self.nested.get(step_id)
+
+
 class UpgradeRegistry:
     """Registry of upgrade steps, by profile.
 
@@ -81,10 +193,29 @@ class UpgradeRegistry:
     Each registry value is a nested mapping:
       - id -> step for single steps
       - id -> [ (id1, step1), (id2, step2) ] for nested steps
+
+    Steps should be added with '_registerUpgradeStep' or
+    '_registerNestedUpgradeStep', which keep the lookup indexes current.
+    Steps added directly to the mapping of 'getUpgradeStepsForProfile'
+    are noticed by its length; call 'changed' after replacing or changing
+    steps in place.
     """
 
+    _indexes_generation = None
+
     def __init__(self):
         self._registry = GlobalRegistryStorage(IUpgradeSteps)
+        self._indexes = {}
+
+    def generation(self):
+        """Return a token which changes whenever upgrade steps change.
+        """
+        return self._registry.generation()
+
+    def changed(self):
+        """Note that the steps of a profile were changed in place.
+        """
+        self._registry.changed()
 
     def __getitem__(self, key):
         return self._registry.get(key)
@@ -116,20 +247,32 @@ class UpgradeRegistry:
         prefix = 'profile-'
         if profile_id.startswith(prefix):
             profile_id = profile_id[len(prefix):]
-        profile_steps = self._registry.get(profile_id)
-        if profile_steps is not None:
-            step = profile_steps.get(step_id, None)
-            if step is None:
-                for key in profile_steps.keys():
-                    if isinstance(profile_steps[key], list):
-                        subs = dict(profile_steps[key])
-                        step = subs.get(step_id, None)
-                        if step is not None:
-                            break
-            elif isinstance(step, list):
-                subs = dict(step)
-                step = subs.get(step_id, None)
-            return step
+        if self._registry.get(profile_id) is not None:
+            return self._getIndex(profile_id).getStep(step_id)
+
+    def _getIndex(self, profile_id):
+        profile_steps = self.getUpgradeStepsForProfile(profile_id)
+        generation = self.generation()
+        if not _sameGeneration(self._indexes_generation, generation):
+            self._indexes = {}
+            self._indexes_generation = generation
+        index = self._indexes.get(profile_id)
+        # Steps may have been added to the mapping directly, which does
+        # not change the generation.
+        if index is None or len(index.items) != len(profile_steps):
+            index = self._indexes[profile_id] = _UpgradeIndex(profile_steps)
+        return index
+
+    def listCandidateSteps(self, profile_id, source):
+        """Return the (id, step) items of a profile which may apply to
+        'source', in registration order.
+
+        Nested steps are returned as lists of (id, step) items.
+        """
+        prefix = 'profile-'
+        if profile_id.startswith(prefix):
+            profile_id = profile_id[len(prefix):]
+        return self._getIndex(profile_id).listCandidates(source)
 
 
 _upgrade_registry = UpgradeRegistry()
@@ -144,24 +287,52 @@ class UpgradeEntity:
                  sortkey=0):
         self.id = _getHash(title, source, dest, sortkey)
         self.title = title
-        if source == '*':
-            source = None
-        elif isinstance(source, str):
-            source = tuple(source.split('.'))
         self.source = source
-        if dest == '*':
-            dest = None
-        elif isinstance(dest, str):
-            dest = tuple(dest.split('.'))
         self.dest = dest
         self.description = desc
         self.checker = checker
         self.sortkey = sortkey
         self.profile = profile
 
-    def versionMatch(self, source, dest=None):
-        return _version_matches(
-            source, self.source, self.dest, strict=True, dest=dest
+    # The normalized versions are computed once, when source and dest are
+    # set, instead of each time upgrade steps are listed.
+
+    @property
+    def source(self):
+        return self._source
+
+    @source.setter
+    def source(self, source):
+        source = self._splitVersion(source)
+        self._source = source
+        matches_all, self.normsource = _parse_version(source)
+        self._start = None if matches_all else self.normsource
+        self.ssource = '.'.join(source or ('all',))
+
+    @property
+    def dest(self):
+        return self._dest
+
+    @dest.setter
+    def dest(self, dest):
+        dest = self._splitVersion(dest)
+        self._dest = dest
+        matches_all, self.normdest = _parse_version(dest)
+        self._stop = None if matches_all else self.normdest
+        self.sdest = '.'.join(dest or ('all',))
+
+    @staticmethod
+    def _splitVersion(version):
+        if version == '*':
+            return None
+        if isinstance(version, str):
+            return tuple(version.split('.'))
+        return version
+
+    def versionMatch(self, source, dest=None, strict=True):
+        return _normalized_version_matches(
+            _parse_version(source), self._start, self._stop,
+            strict=strict, dest=_parse_version(dest),
         )
 
     def isProposed(self, tool, source, dest=None):
@@ -172,10 +343,9 @@ class UpgradeEntity:
         """
         if not self.versionMatch(source, dest=dest):
             return False
-        checker = self.checker
-        if checker is None:
+        if self.checker is None:
             return True
-        return checker(tool)
+        return _runChecker(tool, self)
 
 
 class UpgradeStep(UpgradeEntity):
@@ -230,6 +400,7 @@ def _registerUpgradeStep(step):
     profile_id = step.profile
     profile_steps = _upgrade_registry.getUpgradeStepsForProfile(profile_id)
     profile_steps[step.id] = step
+    _upgrade_registry.changed()
 
 
 def _registerNestedUpgradeStep(step, outer_id):
@@ -238,15 +409,30 @@ def _registerNestedUpgradeStep(step, outer_id):
     nested_steps = profile_steps.get(outer_id, [])
     nested_steps.append((step.id, step))
     profile_steps[outer_id] = nested_steps
+    _upgrade_registry.changed()
+
 
+def _runChecker(tool, step):
+    """Return the result of the checker of 'step'.
 
-def _extractStepInfo(tool, id, step, source, dest=None):
+    o A setup tool caches the result.
+    """
+    if ISetupTool.providedBy(tool):
+        return tool._getCheckerResult(step)
+    return step.checker(tool)
+
+
+def _extractStepInfo(tool, id, step, source, dest=None, run_checkers=True):
     """Returns the info data structure for a given step.
+
+    If 'run_checkers' is False, steps are proposed by version only.
     """
-    proposed = step.isProposed(tool, source, dest=dest)
-    if not proposed and not _version_matches(
-            source, step.source, step.dest, dest=dest
-    ):
+    if run_checkers:
+        proposed = step.isProposed(tool, source, dest=dest)
+    else:
+        proposed = step.versionMatch(source, dest=dest)
+    if not proposed and not step.versionMatch(source, dest=dest,
+                                              strict=False):
         return
     info = {
         'id': id,
@@ -265,7 +451,8 @@ def listProfilesWithUpgrades():
     return _upgrade_registry.keys()
 
 
-def listUpgradeSteps(tool, profile_id, source, dest=None, quick=False):
+def listUpgradeSteps(tool, profile_id, source, dest=None, quick=False,
+                     run_checkers=True):
     """Lists upgrade steps available from a given version, for a given
     profile id.
 
@@ -273,27 +460,35 @@ def listUpgradeSteps(tool, profile_id, source, dest=None, quick=False):
     first matching upgrade step.  This is useful when you only want to know
     if there is at least one upgrade step.  This is used by
     tool.hasUpgradeSteps.
+
+    If 'run_checkers' is False, the checkers of the steps are not run, and
+    steps are proposed by version only.  Checkers never decide whether a
+    step is listed, so they are not run in quick mode either.
     """
+    if quick:
+        run_checkers = False
     res = []
-    profile_steps = _upgrade_registry.getUpgradeStepsForProfile(profile_id)
+    candidates = _upgrade_registry.listCandidateSteps(profile_id, source)
     # Optionally limit to a maximum destination.
     if isinstance(dest, str):
         dest = tuple(dest.split('.'))
-    for id, step in profile_steps.items():
+    for id, step in candidates:
         if isinstance(step, UpgradeEntity):
-            info = _extractStepInfo(tool, id, step, source, dest=dest)
+            info = _extractStepInfo(tool, id, step, source, dest=dest,
+                                    run_checkers=run_checkers)
             if info is None:
                 continue
             if quick:
                 return True
-            normsrc = normalize_version(step.source)
-            res.append(((normsrc, step.sortkey, info['proposed']), info))
+            res.append(((step.normsource, step.sortkey, info['proposed']),
+                        info))
         else:  # nested steps
             nested = []
             outer_proposed = False
             for inner_id, inner_step in step:
                 info = _extractStepInfo(
-                    tool, inner_id, inner_step, source, dest=dest
+                    tool, inner_id, inner_step, source, dest=dest,
+                    run_checkers=run_checkers,
                 )
                 if info is None:
                     continue
@@ -302,9 +497,8 @@ def listUpgradeSteps(tool, profile_id, source, dest=None, quick=False):
                 nested.append(info)
                 outer_proposed = outer_proposed or info['proposed']
             if nested:
-                src = nested[0]['source']
+                normsrc = nested[0]['step'].normsource
                 sortkey = nested[0]['sortkey']
-                normsrc = normalize_version(src)
                 res.append(((normsrc, sortkey, outer_proposed), nested))
     res.sort(key=lambda x: x[0])
     res = [i[1] for i in res]
@@ -15,6 +15,8 @@
 
 import hashlib
 import os
+import sys
+import threading
 from html import escape
 from inspect import getdoc
 from logging import getLogger
@@ -25,9 +27,11 @@ from xml.dom.minidom import _nssplit
 from xml.dom.minidom import parseString
 from xml.parsers.expat import ExpatError
 
+import transaction
 from AccessControl.class_init import InitializeClass
 from AccessControl.SecurityInfo import ClassSecurityInfo
 from Acquisition import Implicit
+from Acquisition import aq_base
 from App.Common import package_home
 from OFS.interfaces import IOrderedContainer
 from Products.Five.utilities.interfaces import IMarkerInterfaces
@@ -46,6 +50,13 @@ from .interfaces import ISetupTool
 from .permissions import ManagePortal
 
 
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on Windows.
+    resource = None
+
+
 _pkgdir = package_home(globals())
 _wwwdir = os.path.join(_pkgdir, 'www')
 _xmldir = os.path.join(_pkgdir, 'xml_templates')
@@ -162,6 +173,53 @@ def _version_for_print(version):
 # WILL BECOME DEPRECATED AS SOON AS GENERICSETUP ITSELF NO LONGER USES THEM.
 
 
+_NO_DEFAULT = object()
+_NO_TEXT = object()
+
+# configurator class -> compiled import mapping
+_compiled_import_mappings = {}
+
+
+class _UnboundConverter:
+    """ Converter method of a configurator, to be called with 'self'.
+    """
+
+    __slots__ = ('func',)
+
+    def __init__(self, func):
+        self.func = func
+
+
+class _CompiledNodeMapping:
+    """ Lookup structure for one node of an import mapping.
+    """
+
+    __slots__ = ('attr_keys', 'child_keys', 'text_key', 'finalizers')
+
+    def __init__(self, node_map, configurator):
+        self.attr_keys = {}
+        self.child_keys = {}
+        self.text_key = _NO_TEXT
+        self.finalizers = []
+
+        for name, spec in node_map.items():
+            key = spec.get(KEY, str(name))
+            self.attr_keys[name] = key
+            if name == '#text':
+                self.text_key = spec.get(KEY, 'value')
+            else:
+                self.child_keys[name] = key
+
+            converter = spec.get(CONVERTER)
+            func = getattr(converter, '__func__', None)
+            if (func is not None and
+                    aq_base(converter.__self__) is configurator):
+                converter = _UnboundConverter(func)
+            self.finalizers.append(
+                (spec.get(KEY, name), spec.get(DEFAULT, _NO_DEFAULT),
+                 converter))
+
+
 class ImportConfiguratorBase(Implicit):
     # old code, will become deprecated
     """ Synthesize data from XML description.
@@ -169,6 +227,9 @@ class ImportConfiguratorBase(Implicit):
     security = ClassSecurityInfo()
     security.setDefaultAccess('allow')
 
+    # Set to False if '_getImportMapping' depends on the instance.
+    _cache_import_mapping = True
+
     def __init__(self, site, encoding='utf-8'):
 
         self._site = site
@@ -194,54 +255,117 @@ class ImportConfiguratorBase(Implicit):
     def _extractNode(self, node):
         """ Please see docs/configurator.txt for information about the
         import mapping syntax.
+
+        o The import mapping is compiled once per configurator class, see
+          '_getCompiledImportMapping'.
+
+        o Child nodes are walked with an explicit stack, so deeply nested
+          documents do not run into the recursion limit.
         """
-        nodes_map = self._getImportMapping()
-        if node.nodeName not in nodes_map:
-            nodes_map = self._getSharedImportMapping()
-            if node.nodeName not in nodes_map:
-                raise ValueError('Unknown node: %s' % node.nodeName)
-        node_map = nodes_map[node.nodeName]
-        info = {}
+        compiled = self._getCompiledImportMapping()
+        encoding = self._encoding
+        stack = [self._startNode(compiled, node, None)]
 
-        for name, val in node.attributes.items():
-            key = node_map[name].get(KEY, str(name))
-            val = self._encoding and val.encode(self._encoding) or val
-            info[key] = val
+        while True:
+            frame = stack[-1]
+            node_map, info, children = frame[0], frame[1], frame[2]
 
-        for child in node.childNodes:
-            name = child.nodeName
+            for child in children:
+                name = child.nodeName
 
-            if name == '#comment':
-                continue
+                if name == '#comment':
+                    continue
+
+                if not name == '#text':
+                    key = node_map.child_keys[name]
+                    info.setdefault(key, ())
+                    stack.append(self._startNode(compiled, child, key))
+                    break
+
+                elif node_map.text_key is not _NO_TEXT:
+                    key = node_map.text_key
+                    val = child.nodeValue.lstrip()
+                    val = encoding and val.encode(encoding) or val
+                    info[key] = info.setdefault(key, '') + val
+
+            else:
+                stack.pop()
+                result = self._finishNode(node_map, info)
 
-            if not name == '#text':
-                key = node_map[name].get(KEY, str(name))
-                info[key] = info.setdefault(key,
-                                            ()) + (self._extractNode(child), )
+                if not stack:
+                    return result
 
-            elif '#text' in node_map:
-                key = node_map['#text'].get(KEY, 'value')
-                val = child.nodeValue.lstrip()
-                val = self._encoding and val.encode(self._encoding) or val
-                info[key] = info.setdefault(key, '') + val
+                parent_info = stack[-1][1]
+                key = frame[3]
+                parent_info[key] = parent_info[key] + (result, )
 
-        for k, v in node_map.items():
-            key = v.get(KEY, k)
+    def _startNode(self, compiled, node, key):
+        """ Return a stack frame for 'node', with its attributes extracted.
+        """
+        node_map = compiled.get(node.nodeName)
+        if node_map is None:
+            raise ValueError('Unknown node: %s' % node.nodeName)
+
+        info = {}
+        encoding = self._encoding
+
+        for name, val in node.attributes.items():
+            attr_key = node_map.attr_keys[name]
+            val = encoding and val.encode(encoding) or val
+            info[attr_key] = val
+
+        return (node_map, info, iter(node.childNodes), key)
+
+    def _finishNode(self, node_map, info):
+        """ Apply defaults and converters of 'node_map' to 'info'.
+        """
+        for key, default, converter in node_map.finalizers:
 
-            if DEFAULT in v and key not in info:
-                if isinstance(v[DEFAULT], str):
-                    info[key] = v[DEFAULT] % info
+            if default is not _NO_DEFAULT and key not in info:
+                if isinstance(default, str):
+                    info[key] = default % info
                 else:
-                    info[key] = v[DEFAULT]
+                    info[key] = default
 
-            elif CONVERTER in v and key in info:
-                info[key] = v[CONVERTER](info[key])
+            elif converter is not None and key in info:
+                if isinstance(converter, _UnboundConverter):
+                    info[key] = converter.func(self, info[key])
+                else:
+                    info[key] = converter(info[key])
 
             if key is None:
                 info = info[key]
 
         return info
 
+    def _getCompiledImportMapping(self):
+        """ Return the import mappings compiled into '_CompiledNodeMapping's.
+
+        o The result is cached per class, unless '_cache_import_mapping'
+          is false, e.g. for configurators whose mapping depends on the
+          instance.
+
+        o Converters which are methods of the configurator are stored
+          unbound and get called with the current instance.
+        """
+        klass = self.__class__
+        compiled = None
+        if self._cache_import_mapping:
+            compiled = _compiled_import_mappings.get(klass)
+
+        if compiled is None:
+            base = aq_base(self)
+            compiled = {}
+            for nodes_map in (self._getSharedImportMapping(),
+                              self._getImportMapping()):
+                for node_name, node_map in nodes_map.items():
+                    compiled[node_name] = _CompiledNodeMapping(node_map, base)
+
+            if self._cache_import_mapping:
+                _compiled_import_mappings[klass] = compiled
+
+        return compiled
+
     def _getSharedImportMapping(self):
 
         return {
@@ -953,6 +1077,122 @@ def importObjects(obj, parent_path, context):
             importObjects(sub, path + '/', context)
 
 
+def iterateInBatches(items, batch_size=1000, getter=None, logger=None,
+                     label='objects', minimize=False):
+    """ Yield 'items', keeping memory bounded while they are changed.
+
+    o After each batch of 'batch_size' items, take an optimistic savepoint
+      and shrink the ZODB cache of the connection of the last item.  With
+      'minimize', all unmodified objects are removed from the cache
+      ('cacheMinimize'), otherwise it is reduced to its target size
+      ('cacheGC').
+
+    o 'getter', if given, is called with each item to get the object to
+      yield, e.g. 'lambda brain: brain.getObject()' for catalog results.
+
+    o Progress is logged to 'logger', e.g. the logger of an import
+      context, or the 'GenericSetup' logger.
+
+    Example for the handler of a 'genericsetup:upgradeStep'::
+
+      def reindex(tool):
+          brains = tool.portal_catalog()
+          for obj in iterateInBatches(brains,
+                                      getter=lambda b: b.getObject()):
+              obj.reindexObject()
+    """
+    if batch_size < 1:
+        raise ValueError('batch_size must be positive')
+    if logger is None:
+        logger = getLogger('GenericSetup')
+    try:
+        total = len(items)
+    except TypeError:
+        total = None
+
+    count = 0
+    jar = None
+    for item in items:
+        obj = item if getter is None else getter(item)
+        jar = getattr(obj, '_p_jar', None) or jar
+        yield obj
+        count += 1
+        if count % batch_size == 0:
+            _endBatch(jar, minimize)
+            _logBatchProgress(logger, count, total, label)
+    if count % batch_size:
+        _endBatch(jar, minimize)
+        _logBatchProgress(logger, count, total, label)
+
+
+def _endBatch(jar, minimize):
+    transaction.savepoint(optimistic=True)
+    if jar is not None:
+        if minimize:
+            jar.cacheMinimize()
+        else:
+            jar.cacheGC()
+
+
+def _logBatchProgress(logger, count, total, label):
+    if total is None:
+        logger.info('Processed %d %s.', count, label)
+    else:
+        logger.info('Processed %d of %d %s.', count, total, label)
+
+
+def _getTransferCounts(jar):
+    # Numbers of persistent objects loaded, and stored or registered as
+    # modified, by the ZODB connections of 'jar' in this transaction.
+    # With a multi-database, the connections to all databases count.
+    loaded = modified = 0
+    if jar is None:
+        return loaded, modified
+    connections = getattr(jar, 'connections', None) or {None: jar}
+    for connection in connections.values():
+        load_count, store_count = connection.getTransferCounts()
+        loaded += load_count
+        # Objects modified but not yet stored by a savepoint are only
+        # known to the connection in its private '_registered_objects'.
+        # ZODB has no public API for them; if that changes, count only
+        # the stored ones.
+        registered = getattr(connection, '_registered_objects', ())
+        modified += store_count + len(registered)
+    return loaded, modified
+
+
+# State of the imports, exports and upgrades running in this thread.
+# Unlike '_v_' attributes of the tool, it survives the tool being ghosted
+# during a run, e.g. by 'cacheMinimize'.
+_run_state = threading.local()
+
+
+def _getRunState(tool, name):
+    states = getattr(_run_state, 'tools', {})
+    return states.get((id(aq_base(tool)), name))
+
+
+def _setRunState(tool, name, value):
+    # Set to None to remove the state.
+    states = _run_state.__dict__.setdefault('tools', {})
+    key = (id(aq_base(tool)), name)
+    if value is None:
+        states.pop(key, None)
+    else:
+        states[key] = value
+
+
+def _getPeakMemory():
+    # Peak resident memory of this process in KiB, or None if unknown.
+    if resource is None:  # pragma: no cover
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # pragma: no cover
+        # Reported in bytes instead of KiB.
+        peak //= 1024
+    return peak
+
+
 def _computeTopologicalSort(steps):
     result = []
     graph = [(x['id'], x['dependencies']) for x in steps]
@@ -24,6 +24,7 @@ from .interfaces import BASE
 from .registry import _export_step_registry
 from .registry import _import_step_registry
 from .registry import _profile_registry
+from .registrytimings import timeRegistration
 from .upgrade import UpgradeDepends
 from .upgrade import UpgradeStep
 from .upgrade import _registerNestedUpgradeStep
@@ -104,8 +105,9 @@ def registerProfile(_context, name='default', title=None, description=None,
 
     _context.action(
         discriminator=('registerProfile', product, name),
-        callable=_profile_registry.registerProfile,
-        args=(name, title, description, directory, product, provides, for_,
+        callable=timeRegistration,
+        args=('profile', _profile_registry.registerProfile,
+              name, title, description, directory, product, provides, for_,
               pre_handler, post_handler),
     )
 
@@ -138,8 +140,9 @@ def exportStep(context, name, handler, title=None, description=None):
 
     context.action(
         discriminator=('exportStep', name),
-        callable=_export_step_registry.registerStep,
-        args=(name, handler, title, description),
+        callable=timeRegistration,
+        args=('exportStep', _export_step_registry.registerStep,
+              name, handler, title, description),
     )
 
 
@@ -199,9 +202,10 @@ class importStep:
 
         self.context.action(
             discriminator=self.discriminator,
-            callable=_import_step_registry.registerStep,
-            args=(self.name, None, self.handler, self.dependencies, self.title,
-                  self.description),
+            callable=timeRegistration,
+            args=('importStep', _import_step_registry.registerStep,
+                  self.name, None, self.handler, self.dependencies,
+                  self.title, self.description),
         )
 
 
@@ -315,8 +319,8 @@ def upgradeStep(_context, title, profile, handler, description=None,
     _context.action(
         discriminator=(
             'upgradeStep', profile, source, destination, handler, sortkey),
-        callable=_registerUpgradeStep,
-        args=(step,),
+        callable=timeRegistration,
+        args=('upgradeStep', _registerUpgradeStep, step),
     )
 
 
@@ -330,8 +334,8 @@ def upgradeDepends(_context, title, profile, description=None,
     _context.action(
         discriminator=('upgradeDepends', profile, source, destination,
                        import_profile, str(import_steps), checker, sortkey),
-        callable=_registerUpgradeStep,
-        args=(step,),
+        callable=timeRegistration,
+        args=('upgradeStep', _registerUpgradeStep, step),
     )
 
 
@@ -360,8 +364,8 @@ class upgradeSteps:
             discriminator=(
                 'upgradeStep', self.profile, self.source, self.dest, handler,
                 self.sortkey),
-            callable=_registerNestedUpgradeStep,
-            args=(step, self.id),
+            callable=timeRegistration,
+            args=('upgradeStep', _registerNestedUpgradeStep, step, self.id),
         )
 
     def upgradeDepends(self, _context, title, description=None,
@@ -377,8 +381,8 @@ class upgradeSteps:
             discriminator=(
                 'upgradeDepends', self.profile, self.source, self.dest,
                 import_profile, str(import_steps), checker, self.sortkey),
-            callable=_registerNestedUpgradeStep,
-            args=(step, self.id),
+            callable=timeRegistration,
+            args=('upgradeStep', _registerNestedUpgradeStep, step, self.id),
         )
 
     def __call__(self):